@@ -34,6 +34,10 @@ __all__ = ['blot', 'runBlot', 'help', 'getHelpAsString']
 __taskname__ = 'drizzlepac.ablot'
 _blot_step_num_ = 5
 
+# Number of source pixels to include around the positions blotted from it,
+# covering the reach of the widest interpolation kernel (sinc):
+_blot_margin_ = 10
+
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
 
@@ -176,8 +180,11 @@ def runBlot(imageObjectList, output_wcs, configObj={},
 
     # This can be called directly from MultiDrizle, so only execute if
     # switch has been turned on (no guarantee MD will check before calling).
-    if configObj[blot_name]['blot']:
+    if configObj[blot_name]['blot'] and _blot_in_driz_cr(configObj):
+        log.info('Blot step to be performed by the driz_cr step.')
+    elif configObj[blot_name]['blot']:
         paramDict = buildBlotParamDict(configObj)
+        paramDict['num_cores'] = configObj.get('num_cores')
 
         log.info('USER INPUT PARAMETERS for Blot Step:')
         util.printParams(paramDict, log=log)
@@ -200,9 +207,21 @@ def buildBlotParamDict(configObj):
                 'blot_sinscl':configObj[blot_name]['blot_sinscl'],
                 'blot_addsky':configObj[blot_name]['blot_addsky'],
                 'blot_skyval':configObj[blot_name]['blot_skyval'],
+                'blot_fused':configObj[blot_name].get('blot_fused', False),
                 'coeffs':configObj['coeffs']}
     return paramDict
 
+def _blot_in_driz_cr(configObj):
+    """ Return whether each chip gets blotted by the driz_cr step, right
+    before looking for cosmic rays in it, instead of by the blot step.
+    """
+    blot_name = util.getSectionName(configObj, _blot_step_num_)
+    drizcr_name = util.getSectionName(configObj, _blot_step_num_ + 1)
+    return (configObj[blot_name]['blot'] and
+            configObj[blot_name].get('blot_fused', False) and
+            drizcr_name is not None and
+            configObj[drizcr_name]['driz_cr'])
+
 def _setDefaults(configObj={}):
     """ set up the default parameters to run drizzle
         build,single,units,wt_scl,pixfrac,kernel,fillval,
@@ -243,91 +262,159 @@ def run_blot(imageObjectList,output_wcs,paramDict,wcsmap=wcs_functions.WCSMap):
     # Insure that input imageObject is a list
     if not isinstance(imageObjectList, list):
         imageObjectList = [imageObjectList]
-    #
     # Setup the versions info dictionary for output to PRIMARY header
-    # The keys will be used as the name reported in the header, as-is
-    #
-    _versions = {'AstroDrizzle':__version__,
-                 'PyFITS':util.__fits_version__,
-                 'Numpy':util.__numpy_version__}
+    _versions = _blot_versions()
 
-    _hdrlist = []
+    # Read in the median image only once, for all the chips to blot their
+    # region of it from, as a read-only array shared with any sub-processes.
+    median = _read_median(imageObjectList[0])
 
+    chips = []
     for img in imageObjectList:
-
         for chip in img.returnAllChips(extname=img.scienceExt):
+            chip.outputNames['driz_version'] = _versions['AstroDrizzle']
+            chips.append((img, chip))
+
+    # Blot the chips in parallel, if possible, splitting each blot call
+    # across threads using any remaining cores
+    pool_size = util.get_pool_size(paramDict.get('num_cores'), len(chips))
+    ncores = util.get_pool_size(paramDict.get('num_cores'), None)
+    nthreads = max(ncores // pool_size, 1)
+
+    if pool_size > 1:
+        log.info('Executing %d parallel workers' % pool_size)
+        pool = util.get_worker_pool(paramDict.get('num_cores'))
+        # in-memory products get passed back using shared memory
+        for img in imageObjectList:
+            if img.inmemory:
+                img.virtualOutputs.share(pool.manager)
 
-            print('    Blot: creating blotted image: ',chip.outputNames['data'])
+        tasks = [(img, chip, median, output_wcs, paramDict, _versions,
+                  wcsmap, nthreads) for img, chip in chips]
+        pool.run(run_blot_chip, tasks, name='ablot.run_blot_chip()',
+                 pool_size=pool_size)  # blocks till all done
 
-            #### Check to see what names need to be included here for use in _hdrlist
-            chip.outputNames['driz_version'] = _versions['AstroDrizzle']
-            outputvals = chip.outputNames.copy()
-            outputvals.update(img.outputValues)
-            outputvals['blotnx'] = chip.wcs.naxis1
-            outputvals['blotny'] = chip.wcs.naxis2
-            _hdrlist.append(outputvals)
-
-            plist = outputvals.copy()
-            plist.update(paramDict)
-
-            # PyFITS can be used here as it will always operate on
-            # output from PyDrizzle (which will always be a FITS file)
-            # Open the input science file
-            medianPar = 'outMedian'
-            outMedianObj = img.getOutputName(medianPar)
+        for img in imageObjectList:
             if img.inmemory:
-                outMedian = img.outputNames[medianPar]
-                _fname,_sciextn = fileutil.parseFilename(outMedian)
-                _inimg = outMedianObj
-            else:
-                outMedian = outMedianObj
-                _fname,_sciextn = fileutil.parseFilename(outMedian)
-                _inimg = fileutil.openImage(_fname, memmap=False)
-
-            # Return the PyFITS HDU corresponding to the named extension
-            _scihdu = fileutil.getExtn(_inimg,_sciextn)
-            _insci = _scihdu.data.copy()
-            _inimg.close()
-            del _inimg, _scihdu
-
-            _outsci = do_blot(_insci, output_wcs,
-                   chip.wcs, chip._exptime, coeffs=paramDict['coeffs'],
-                   interp=paramDict['blot_interp'], sinscl=paramDict['blot_sinscl'],
-                   wcsmap=wcsmap)
-            # Apply sky subtraction and unit conversion to blotted array to
-            # match un-modified input array
-            if paramDict['blot_addsky']:
-                skyval = chip.computedSky
-            else:
-                skyval = paramDict['blot_skyval']
-            _outsci /= chip._conversionFactor
-            if skyval is not None:
-                _outsci += skyval
-                log.info('Applying sky value of %0.6f to blotted image %s'%
-                            (skyval,chip.outputNames['data']))
-
-            # Write output Numpy objects to a PyFITS file
-            # Blotting only occurs from a drizzled SCI extension
-            # to a blotted SCI extension...
-
-            _outimg = outputimage.OutputImage(_hdrlist, paramDict, build=False, wcs=chip.wcs, blot=True)
-            _outimg.outweight = None
-            _outimg.outcontext = None
-            outimgs = _outimg.writeFITS(plist['data'],_outsci,None,
-                                versions=_versions,blend=False,
-                                virtual=img.inmemory)
-
-            img.saveVirtualOutputs(outimgs)
-            #_buildOutputFits(_outsci,None,plist['outblot'])
-            _hdrlist = []
-
-            del _outsci
-
-        del _outimg
+                img.virtualOutputs.collect()
+    else:
+        log.info('Executing serially')
+        for img, chip in chips:
+            run_blot_chip(img, chip, median, output_wcs, paramDict, _versions,
+                          wcsmap, nthreads)
+
+    del median
+
+
+def run_blot_chip(img, chip, median, output_wcs, paramDict, _versions,
+                  wcsmap, nthreads):
+    """ Blot the median image back onto a single chip, and write out the
+    result. This gets run as a separate process when blotting in parallel.
+    """
+    _outsci = blot_chip(chip, median, output_wcs, paramDict, wcsmap=wcsmap,
+                        nthreads=nthreads)
+    write_blot_chip(img, chip, _outsci, paramDict, _versions)
+    del _outsci
+
+
+def blot_chip(chip, median, output_wcs, paramDict,
+              wcsmap=wcs_functions.WCSMap, nthreads=1):
+    """ Blot the median image back onto a single chip, returning the
+    blotted array with the sky added back and in the units of the input.
+    """
+    print('    Blot: creating blotted image: ',chip.outputNames['data'])
+
+    _outsci = do_blot(median, output_wcs,
+           chip.wcs, chip._exptime, coeffs=paramDict['coeffs'],
+           interp=paramDict['blot_interp'], sinscl=paramDict['blot_sinscl'],
+           wcsmap=wcsmap, nthreads=nthreads)
+    # Apply sky subtraction and unit conversion to blotted array to
+    # match un-modified input array
+    if paramDict['blot_addsky']:
+        skyval = chip.computedSky
+    else:
+        skyval = paramDict['blot_skyval']
+    _outsci /= chip._conversionFactor
+    if skyval is not None:
+        _outsci += skyval
+        log.info('Applying sky value of %0.6f to blotted image %s'%
+                    (skyval,chip.outputNames['data']))
+
+    return _outsci
+
+
+def write_blot_chip(img, chip, _outsci, paramDict, _versions):
+    """ Write out the blotted array of a chip, as a file or as an in-memory
+    output of its imageObject.
+    """
+    #### Check to see what names need to be included here for use in _hdrlist
+    outputvals = chip.outputNames.copy()
+    outputvals.update(img.outputValues)
+    outputvals['blotnx'] = chip.wcs.naxis1
+    outputvals['blotny'] = chip.wcs.naxis2
+    _hdrlist = [outputvals]
+
+    plist = outputvals.copy()
+    plist.update(paramDict)
+
+    # Write output Numpy objects to a PyFITS file
+    # Blotting only occurs from a drizzled SCI extension
+    # to a blotted SCI extension...
+
+    _outimg = outputimage.OutputImage(_hdrlist, paramDict, build=False, wcs=chip.wcs, blot=True)
+    _outimg.outweight = None
+    _outimg.outcontext = None
+    outimgs = _outimg.writeFITS(plist['data'],_outsci,None,
+                        versions=_versions,blend=False,
+                        virtual=img.inmemory)
+
+    img.saveVirtualOutputs(outimgs)
+    #_buildOutputFits(_outsci,None,plist['outblot'])
+
+    del _outimg
+
+
+def _blot_versions():
+    """ Return the versions info dictionary for output to the PRIMARY header
+    of the blotted images. The keys will be used as the name reported in the
+    header, as-is.
+    """
+    return {'AstroDrizzle':__version__,
+            'PyFITS':util.__fits_version__,
+            'Numpy':util.__numpy_version__}
+
+
+def _read_median(img):
+    """ Read in the SCI array of the median image of an imageObject, as a
+    read-only native float32 array.
+    """
+    # PyFITS can be used here as it will always operate on
+    # output from PyDrizzle (which will always be a FITS file)
+    # Open the input science file
+    medianPar = 'outMedian'
+    outMedianObj = img.getOutputName(medianPar)
+    if img.inmemory:
+        outMedian = img.outputNames[medianPar]
+        _fname,_sciextn = fileutil.parseFilename(outMedian)
+        _inimg = outMedianObj
+    else:
+        outMedian = outMedianObj
+        _fname,_sciextn = fileutil.parseFilename(outMedian)
+        _inimg = fileutil.openImage(_fname, memmap=False)
+
+    # Return the PyFITS HDU corresponding to the named extension
+    _scihdu = fileutil.getExtn(_inimg,_sciextn)
+    median = np.array(_scihdu.data, dtype=np.float32)
+    _inimg.close()
+    del _inimg, _scihdu
+
+    median.flags.writeable = False
+    return median
 
 
 def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
-            interp='poly5', sinscl=1.0, stepsize=10, wcsmap=None):
+            interp='poly5', sinscl=1.0, stepsize=10, wcsmap=None, nthreads=1,
+            pixmap=None):
     """ Core functionality of performing the 'blot' operation to create a single
         blotted image from a single source image.
         All distortion information is assumed to be included in the WCS specification
@@ -363,6 +450,15 @@ def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
             Custom mapping class to use to provide transformation from
             drizzled to blotted WCS.  Default will be to use
             `drizzlepac.wcs_functions.WCSMap`.
+        nthreads
+            Number of threads to split the blotting across, which only
+            applies when using the default C-based mapping with a
+            ``stepsize`` greater than 0, or a ``pixmap``.
+        pixmap
+            Precomputed mapping to use instead of ``wcsmap``, as an array of
+            shape ``(ny, nx, 2)`` matching the blotted image, holding the
+            0-based ``(x, y)`` position of each of its pixels in the source
+            image (see `drizzlepac.wcs_functions.calc_pixmap`).
 
     """
     _outsci = np.zeros(blot_wcs.array_shape, dtype=np.float32)
@@ -372,10 +468,6 @@ def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
     misval = 0.0
     kscale = 1.0
 
-    xmin = 1
-    ymin = 1
-    xmax, ymax = source_wcs.pixel_shape
-
     # compute the undistorted 'natural' plate scale for this chip
     if coeffs:
         wcslin = distortion.utils.make_orthogonal_cd(blot_wcs)
@@ -386,16 +478,19 @@ def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
         blot_wcs.cpdis2 = None
         blot_wcs.det2im = None
 
-    if wcsmap is None and cdriz is not None:
+    if pixmap is not None:
+        print('Using pixel map for coordinate transformation...')
+        if pixmap.shape[:2] != _outsci.shape:
+            raise ValueError("Pixel map does not match the blotted image shape")
+        mapping = wcs_functions.pixmap_to_mapping(pixmap)
+        pix_ratio = source_wcs.pscale/wcslin.pscale
+    elif wcsmap is None and cdriz is not None:
         """
         Use default C mapping function.
         """
         print('Using default C-based coordinate transformation...')
-        mapping = cdriz.DefaultWCSMapping(
-            blot_wcs, source_wcs,
-            blot_wcs.pixel_shape[0], blot_wcs.pixel_shape[1],
-            stepsize
-        )
+        mapping = wcs_functions.get_default_mapping(blot_wcs, source_wcs,
+                                                    stepsize)
         pix_ratio = source_wcs.pscale/wcslin.pscale
     else:
         #
@@ -409,16 +504,60 @@ def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
         mapping = wmap.forward
         pix_ratio = source_wcs.pscale/wcslin.pscale
 
+    # Only pass on the region of the source image which the blotted image
+    # maps onto, padded for the interpolation kernel, instead of all of it.
+    # This cannot be determined for user-defined mappings.
+    if pixmap is not None:
+        region = _pixmap_region(pixmap, source.shape)
+    elif wcsmap is None or wcsmap is wcs_functions.WCSMap:
+        region = wcs_functions.calcOutputBounds(blot_wcs, source_wcs,
+                                                margin=_blot_margin_)
+    else:
+        region = (0, source.shape[1] - 1, 0, source.shape[0] - 1)
+
+    if region is None:
+        # nothing gets blotted from the source image
+        _outsci.fill(misval)
+        return _outsci
+
+    xmin = region[0] + 1
+    xmax = region[1] + 1
+    ymin = region[2] + 1
+    ymax = region[3] + 1
+    source = source[ymin - 1:ymax, xmin - 1:xmax]
+
     t = cdriz.tblot(
         source, _outsci,xmin,xmax,ymin,ymax,
         pix_ratio, kscale, 1.0, 1.0,
         'center',interp, exptime,
-        misval, sinscl, 1, mapping)
+        misval, sinscl, 1, mapping, nthreads=nthreads)
     del mapping
 
     return _outsci
 
 
+def _pixmap_region(pixmap, shape):
+    """ Return the ``(xmin, xmax, ymin, ymax)`` region, as 0-based, inclusive
+    pixel indices, of a source image of the given ``shape`` which the
+    positions of a pixel map fall within, padded by `_blot_margin_`, or
+    `None` if all of them fall outside of the source image.
+    """
+    ny, nx = shape
+    x = pixmap[..., 0]
+    y = pixmap[..., 1]
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        return (0, nx - 1, 0, ny - 1)
+
+    xmin = int(np.floor(x.min())) - _blot_margin_
+    xmax = int(np.ceil(x.max())) + _blot_margin_
+    ymin = int(np.floor(y.min())) - _blot_margin_
+    ymax = int(np.ceil(y.max())) + _blot_margin_
+    if xmax < 0 or ymax < 0 or xmin > nx - 1 or ymin > ny - 1:
+        return None
+
+    return (max(xmin, 0), min(xmax, nx - 1), max(ymin, 0), min(ymax, ny - 1))
+
+
 def help(file=None):
     """
     Print out syntax help for running astrodrizzle
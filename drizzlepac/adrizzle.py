@@ -6,7 +6,7 @@ Interfaces to main drizzle functions.
 :License: :doc:`LICENSE`
 
 """
-import sys,os,copy,time
+import sys,os,copy,time,tempfile
 from . import util
 import numpy as np
 from astropy.io import fits
@@ -30,7 +30,8 @@ if util.can_parallel:
 
 __all__ = ['drizzle', 'run', 'drizSeparate', 'drizFinal', 'mergeDQarray',
            'updateInputDQArray', 'buildDrizParamDict', 'interpret_maskval',
-           'run_driz', 'run_driz_img', 'run_driz_chip', 'do_driz',
+           'run_driz', 'run_driz_img', 'run_driz_chip', 'run_driz_tiles',
+           'run_driz_tile', 'do_driz',
            'get_data', 'create_output', 'help', 'getHelpAsString']
 
 
@@ -38,6 +39,10 @@ __taskname__ = "drizzlepac.adrizzle"
 _single_step_num_ = 3
 _final_step_num_ = 7
 
+# Maximum size of the in-memory copy of each tile of the output arrays
+# drizzled by a parallel worker, when those arrays are memory-mapped
+_max_tile_bytes = 256 * 1024 * 1024
+
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
 time_pre_all = []
@@ -379,6 +384,7 @@ def drizFinal(imageObjectList, output_wcs, configObj,build=None,wcsmap=None,proc
             build = paramDict['build']
         # Record whether or not intermediate files should be deleted when finished
         paramDict['clean'] = configObj['STATE OF INPUT FILES']['clean']
+        paramDict['num_cores'] = configObj.get('num_cores')
 
         log.info('USER INPUT PARAMETERS for Final Drizzle Step:')
         util.printParams(paramDict, log=log)
@@ -554,6 +560,17 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
 
     outwcs = copy.deepcopy(output_wcs)
 
+    # Read in the existing final product to drizzle the inputs onto, if
+    # requested, before it gets replaced by the new one.
+    previous = None
+    paramDict['ctx_offset'] = 0
+    paramDict['previous_header'] = None
+    if not single and paramDict.get('update', False):
+        previous = _read_final_product(imageObjectList, output_wcs, paramDict, build)
+        if previous is not None:
+            paramDict['previous_header'] = previous[0]
+            paramDict['ctx_offset'] = previous[0].get('NDRIZIM', 0)
+
     # Check for existance of output file.
     if (not single and build and
         fileutil.findFile(imageObjectList[0].outputNames['outFinal'])):
@@ -565,13 +582,43 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
     output_wcs.printwcs()
 
     # Will we be running in parallel?
-    pool_size = util.get_pool_size(paramDict.get('num_cores'), len(imageObjectList))
+    if single:
+        pool_size = util.get_pool_size(paramDict.get('num_cores'), len(imageObjectList))
+    elif paramDict.get('num_cores') is not None:
+        # the final drizzle gets parallelized over tiles of the output frame,
+        # but only when asked for: for a few inputs, drizzling all of them
+        # across threads is as fast and does not fork copies of the process
+        pool_size = util.get_pool_size(paramDict.get('num_cores'), None)
+    else:
+        pool_size = 1
     will_parallel = single and pool_size > 1
+    will_tile = (not single) and pool_size > 1
+    # Keep the final output arrays in scratch files instead of in memory?
+    use_memmap = (not single) and paramDict.get('memmap', False)
+    if use_memmap:
+        scratch_dir = os.path.dirname(
+            os.path.abspath(imageObjectList[0].outputNames['outFinal']))
+        log.info('Using memory-mapped scratch files in %s for the output arrays'
+                 % scratch_dir)
+    # Keep only the blocks of the final context image with any bit set?
+    use_sparse_ctx = (not single) and paramDict.get('sparse_ctx', False)
+    # Also write the single drizzle products to a stack for the median step?
+    paramDict['stack_index'] = None
+    if single and paramDict.get('stack', False) and not imageObjectList[0].inmemory:
+        paramDict['stack_index'] = _create_single_stack(imageObjectList, output_wcs)
+
+    # Any cores not used by parallel processes get used by each drizzle
+    # call through threads instead; tiles already use all of them.
+    paramDict['nthreads'] = 1
+    if not will_tile:
+        ncores = util.get_pool_size(paramDict.get('num_cores'), None)
+        paramDict['nthreads'] = max(ncores // pool_size, 1)
     if will_parallel:
         log.info('Executing %d parallel workers' % pool_size)
+    elif will_tile:
+        log.info('Executing %d parallel workers on tiles of the output frame' % pool_size)
     else:
-        if single: # not yet an option for final drizzle, msg would confuse
-            log.info('Executing serially')
+        log.info('Executing serially')
 
     # Set parameters for each input and run drizzle on it here.
     #
@@ -591,7 +638,8 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
             else: _numctx[plsingle] = 1
 
     # Compute how many planes will be needed for the context image.
-    _nplanes = int((_numctx['all']-1) / 32) + 1
+    # Inputs of a previous product keep the first bits of the context.
+    _nplanes = int((_numctx['all'] + paramDict['ctx_offset'] - 1) / 32) + 1
     # For single drizzling or when context is turned off,
     # minimize to 1 plane only...
     if single or imageObjectList[0][1].outputNames['outContext'] in [None,'',' ']:
@@ -604,15 +652,60 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
     # This buffer should be reused for each input if possible.
     #
     _outsci = _outwht = _outctx = _hdrlist = None
-    if (not single) or \
+    if will_tile:
+        # The output arrays get filled in by the tile workers, so they
+        # need to live in memory shared with those processes.
+        # Memory-mapped scratch files get shared with them as well.
+        if use_memmap:
+            _sharedsci = _outsci = _create_scratch_array(
+                output_wcs.array_shape, np.float32, scratch_dir)
+            _sharedwht = _outwht = _create_scratch_array(
+                output_wcs.array_shape, np.float32, scratch_dir)
+        else:
+            _sharedsci, _outsci = _create_shared_array(output_wcs.array_shape, np.float32)
+            _sharedwht, _outwht = _create_shared_array(output_wcs.array_shape, np.float32)
+        if use_sparse_ctx:
+            # the tiles of the context get passed back by the workers
+            _sharedctx = _outctx = outputimage.SparseContext(
+                (_nplanes,) + output_wcs.array_shape)
+        elif use_memmap:
+            _sharedctx = _outctx = _create_scratch_array(
+                (_nplanes,) + output_wcs.array_shape, np.int32, scratch_dir)
+        else:
+            _sharedctx, _outctx = _create_shared_array((_nplanes,) + output_wcs.array_shape,
+                                                       np.int32)
+        _outsci.fill(maskval)
+        if previous is not None:
+            _seed_final_arrays(previous, _outsci, _outwht, _outctx)
+        _hdrlist = []
+
+        run_driz_tiles(imageObjectList, output_wcs, outwcs, paramDict, _nplanes,
+                       pool_size, _sharedsci, _sharedwht, _sharedctx, wcsmap)
+        del _sharedsci, _sharedwht, _sharedctx
+
+    elif (not single) or \
        (single and (not will_parallel) and (not imageObjectList[0].inmemory)):
         # Note there are four cases/combinations for single drizzle alone here:
         # (not-inmem, serial), (not-inmem, parallel), (inmem, serial), (inmem, parallel)
-        _outsci=np.empty(output_wcs.array_shape, dtype=np.float32)
+        if use_memmap:
+            _outsci = _create_scratch_array(output_wcs.array_shape, np.float32,
+                                            scratch_dir)
+            _outwht = _create_scratch_array(output_wcs.array_shape, np.float32,
+                                            scratch_dir)
+        else:
+            _outsci=np.empty(output_wcs.array_shape, dtype=np.float32)
+            _outwht=np.zeros(output_wcs.array_shape, dtype=np.float32)
+        if use_sparse_ctx:
+            _outctx = outputimage.SparseContext((_nplanes,) + output_wcs.array_shape)
+        elif use_memmap:
+            _outctx = _create_scratch_array((_nplanes,) + output_wcs.array_shape,
+                                            np.int32, scratch_dir)
+        else:
+            # initialize context to 3-D array but only pass appropriate plane to drizzle as needed
+            _outctx=np.zeros((_nplanes,) + output_wcs.array_shape, dtype=np.int32)
         _outsci.fill(maskval)
-        _outwht=np.zeros(output_wcs.array_shape, dtype=np.float32)
-        # initialize context to 3-D array but only pass appropriate plane to drizzle as needed
-        _outctx=np.zeros((_nplanes,) + output_wcs.array_shape, dtype=np.int32)
+        if previous is not None:
+            _seed_final_arrays(previous, _outsci, _outwht, _outctx)
         _hdrlist = []
 
     # Keep track of how many chips have been processed
@@ -628,7 +721,9 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
     #
     # Work on each image
     #
-    subprocs = []
+    if will_parallel:
+        pool = util.get_worker_pool(paramDict.get('num_cores'))
+    tasks = []
     for img in imageObjectList:
 
         chiplist = img.returnAllChips(extname=img.scienceExt)
@@ -650,35 +745,37 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
 
         # Work each image, possibly in parallel
         if will_parallel:
-            # use multiprocessing.Manager only if in parallel and in memory
+            # in-memory products get passed back using shared memory
             if img.inmemory:
-                manager = multiprocessing.Manager()
-                dproxy = manager.dict(img.virtualOutputs) # copy & wrap it in proxy
-                img.virtualOutputs = dproxy
+                img.virtualOutputs.share(pool.manager)
 
             # parallelize run_driz_img (currently for separate drizzle only)
-            p = multiprocessing.Process(target=run_driz_img,
-                name='adrizzle.run_driz_img()', # for err msgs
-                args=(img,chiplist,output_wcs,outwcs,template,paramDict,
-                      single,num_in_prod,build,_versions,_numctx,_nplanes,
-                      _chipIdx,None,None,None,None,wcsmap))
-            subprocs.append(p)
+            tasks.append((img,chiplist,output_wcs,outwcs,template,paramDict,
+                          single,num_in_prod,build,_versions,_numctx,_nplanes,
+                          _chipIdx,None,None,None,None,wcsmap))
         else:
             # serial run_driz_img run (either separate drizzle or final drizzle)
+            # When tiled, the drizzling itself has already been done by the
+            # tile workers, leaving only the per-chip bookkeeping to be done.
             run_driz_img(img,chiplist,output_wcs,outwcs,template,paramDict,
                          single,num_in_prod,build,_versions,_numctx,_nplanes,
-                         _chipIdx,_outsci,_outwht,_outctx,_hdrlist,wcsmap)
+                         _chipIdx,_outsci,_outwht,_outctx,_hdrlist,wcsmap,
+                         predrizzled=will_tile)
 
         # Increment/reset master chip counter
         _chipIdx += len(chiplist)
         if _chipIdx == num_in_prod:
             _chipIdx = 0
 
-    # do the join if we spawned tasks
+    # run the tasks on the worker pool, if any
     if will_parallel:
-        mputil.launch_and_wait(subprocs, pool_size) # blocks till all done
+        pool.run(run_driz_img, tasks, name='adrizzle.run_driz_img()',
+                 pool_size=pool_size) # blocks till all done
+        for img in imageObjectList:
+            if img.inmemory:
+                img.virtualOutputs.collect()
 
-    del _outsci,_outwht,_outctx,_hdrlist
+    del _outsci,_outwht,_outctx,_hdrlist,previous
     # have looped over each img/chip
 
 
@@ -688,7 +785,7 @@ def run_driz(imageObjectList,output_wcs,paramDict,single,build,wcsmap=None):
 
 def run_driz_img(img,chiplist,output_wcs,outwcs,template,paramDict,single,
                  num_in_prod,build,_versions,_numctx,_nplanes,chipIdxCopy,
-                 _outsci,_outwht,_outctx,_hdrlist,wcsmap):
+                 _outsci,_outwht,_outctx,_hdrlist,wcsmap,predrizzled=False):
     """ Perform the drizzle operation on a single image.
     This is separated out from :py:func:`run_driz` so as to keep together
     the entirety of the code which is inside the loop over
@@ -724,7 +821,8 @@ def run_driz_img(img,chiplist,output_wcs,outwcs,template,paramDict,single,
         # run_driz_chip
         run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,
                       single,doWrite,build,_versions,_numctx,_nplanes,
-                      chipIdxCopy,_outsci,_outwht,_outctx,_hdrlist,wcsmap)
+                      chipIdxCopy,_outsci,_outwht,_outctx,_hdrlist,wcsmap,
+                      predrizzled=predrizzled)
 
         # Increment chip counter (also done outside of this function)
         chipIdxCopy += 1
@@ -746,27 +844,376 @@ def run_driz_img(img,chiplist,output_wcs,outwcs,template,paramDict,single,
     # only if single and doWrite)
 
 
-def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
-                  doWrite,build,_versions,_numctx,_nplanes,_numchips,
-                  _outsci,_outwht,_outctx,_hdrlist,wcsmap):
-    """ Perform the drizzle operation on a single chip.
-    This is separated out from `run_driz_img` so as to keep together
-    the entirety of the code which is inside the loop over
-    chips.  See the `run_driz` code for more documentation.
+def run_driz_tiles(imageObjectList, output_wcs, outwcs, paramDict, _nplanes,
+                   pool_size, _sharedsci, _sharedwht, _sharedctx, wcsmap):
+    """ Perform the final drizzle operation in parallel by splitting the
+    output frame into tiles, with each tile being drizzled by a separate
+    process into the shared output arrays.
+
+    Each tile only gets the chips whose footprint overlaps it, drizzled
+    in the same order as in the serial case, so that the result is
+    identical to drizzling the full output frame at once. Only the
+    drizzling itself is done here; all the remaining per-chip operations
+    (updating the input DQ arrays, writing out the products, ...) still
+    need to be done serially afterwards.
+
+    When the output arrays are memory-mapped (``paramDict['memmap']``),
+    the frame gets split into as many more tiles as needed to keep the
+    in-memory copy of each tile below ``_max_tile_bytes``.
+
+    With a sparse context (``paramDict['sparse_ctx']``), ``_sharedctx`` is
+    an `~drizzlepac.outputimage.SparseContext`, into which the context of
+    each tile gets merged once passed back by the workers.
     """
-    global time_pre_all, time_driz_all, time_post_all, time_write_all
+    shape = output_wcs.array_shape
+    sparse_ctx = paramDict.get('sparse_ctx', False)
+    max_pixels = None
+    if paramDict.get('memmap', False):
+        max_pixels = _max_tile_bytes // (4 * (2 + (1 if sparse_ctx else _nplanes)))
+    tiles = _build_output_tiles(shape, pool_size, max_pixels=max_pixels)
+
+    # Work out which chips fall on each tile
+    chipinfo = []
+    for img in imageObjectList:
+        for chip in img.returnAllChips(extname=img.scienceExt):
+            _uniqid = len(chipinfo) + 1 + paramDict.get('ctx_offset', 0)
+            if _nplanes == 1:
+                _uniqid = ((_uniqid-1) % 32) + 1
+            if wcsmap is None:
+                pix_ratio = outwcs.pscale / chip.wcslin_pscale
+                margin = _kernel_margin(paramDict['kernel'],
+                                        paramDict['pixfrac'], pix_ratio)
+                bounds = wcs_functions.calcOutputBounds(chip.wcs, outwcs,
+                                                        margin=margin)
+            else:
+                # No way to know where a user-supplied mapping will
+                # put this chip, so assume it may cover the full frame
+                bounds = (0, shape[1] - 1, 0, shape[0] - 1)
+            chipinfo.append((img, chip, _uniqid, bounds))
+
+    pool = util.get_worker_pool(paramDict.get('num_cores'))
+    tilectx = pool.manager.dict() if sparse_ctx else _sharedctx
+
+    tasks = []
+    for tile in tiles:
+        tilechips = [(img, chip, uniqid) for img, chip, uniqid, bounds in chipinfo
+                     if _bounds_overlap(bounds, tile)]
+        if len(tilechips) == 0:
+            continue
+        tasks.append((tilechips, tile, outwcs, paramDict, _nplanes,
+                      _sharedsci, _sharedwht, tilectx, wcsmap))
+
+    log.info('Drizzling %d tiles of the output frame' % len(tasks))
+    pool.run(run_driz_tile, tasks, name='adrizzle.run_driz_tile()',
+             pool_size=pool_size) # blocks till all done
+
+    if sparse_ctx:
+        for tile, ctx in tilectx.items():
+            _sharedctx.merge(ctx, y0=tile[2], x0=tile[0])
+
+    # Apply the fill value to all pixels which did not receive any input,
+    # just as drizzling the full frame serially would have done.
+    fillval = paramDict['fillval']
+    if not util.is_blank(fillval):
+        _outsci = _shared_array_view(_sharedsci, shape, np.float32)
+        _outwht = _shared_array_view(_sharedwht, shape, np.float32)
+        _outsci[_outwht == 0] = np.float32(fillval)
+
+
+def run_driz_tile(tilechips, tile, outwcs, paramDict, _nplanes,
+                  _sharedsci, _sharedwht, _sharedctx, wcsmap):
+    """ Drizzle all the chips which overlap a single tile of the output frame.
+    This gets run as a separate process by :py:func:`run_driz_tiles`, with
+    the results being copied into the shared output arrays when done.
+
+    With a sparse context, ``_sharedctx`` is a (manager) dictionary instead,
+    in which the context of this tile gets returned.
+    """
+    shape = outwcs.array_shape
+    xmin, xmax, ymin, ymax = tile
+    tslice = (slice(ymin, ymax + 1), slice(xmin, xmax + 1))
+    sparse_ctx = paramDict.get('sparse_ctx', False)
+
+    _outsci = _shared_array_view(_sharedsci, shape, np.float32)
+    _outwht = _shared_array_view(_sharedwht, shape, np.float32)
+
+    # Work on contiguous copies of this tile, as required by 'tdriz'
+    _tilesci = _outsci[tslice].copy()
+    _tilewht = _outwht[tslice].copy()
+    if sparse_ctx:
+        _tilectx = outputimage.SparseContext((_nplanes,) + _tilesci.shape)
+    else:
+        _outctx = _shared_array_view(_sharedctx, (_nplanes,) + shape, np.int32)
+        _tilectx = _outctx[(slice(None),) + tslice].copy()
 
-    epoch = time.time()
+    for img, chip, _uniqid in tilechips:
+        _expname = _get_chip_input_name(chip)
+        _insci = _get_chip_science(chip, _expname)
+        dqarr = _build_chip_mask(img, chip, paramDict, False, _expname)
+        img.set_wtscl(chip._chip, paramDict['wt_scl'])
+        pix_ratio = outwcs.pscale / chip.wcslin_pscale
+        _inwht = _build_chip_weight(img, chip, dqarr, paramDict, pix_ratio)
 
-    # Look for sky-subtracted product
+        _in_units = chip.in_units.lower()
+        _expin = 1.0 if _in_units == 'cps' else chip._exptime
+
+        do_driz(_insci, chip.wcs, _inwht, outwcs, _tilesci, _tilewht, _tilectx,
+                _expin, _in_units, chip._wtscl,
+                wcslin_pscale=chip.wcslin_pscale, uniqid=_uniqid,
+                pixfrac=paramDict['pixfrac'], kernel=paramDict['kernel'],
+                fillval=paramDict['fillval'], stepsize=paramDict['stepsize'],
+                wcsmap=wcsmap, out_origin=(xmin, ymin))
+
+    _outsci[tslice] = _tilesci
+    _outwht[tslice] = _tilewht
+    if sparse_ctx:
+        _sharedctx[tile] = _tilectx
+    else:
+        _outctx[(slice(None),) + tslice] = _tilectx
+
+
+def _create_shared_array(shape, dtype):
+    """ Allocate a zero-initialized array in memory which can be shared
+    with sub-processes. Returns both the raw shared buffer, to be passed
+    on to the sub-processes, and a numpy array view of it.
+    """
+    ctype = np.ctypeslib.as_ctypes_type(np.dtype(dtype))
+    raw = multiprocessing.RawArray(ctype, int(np.prod(shape)))
+    return raw, _shared_array_view(raw, shape, dtype)
+
+
+def _shared_array_view(raw, shape, dtype):
+    """ Return a numpy array view of a raw shared memory buffer. """
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _create_scratch_array(shape, dtype, directory=None):
+    """ Allocate a zero-initialized array backed by an anonymous scratch
+    file in ``directory``, instead of by memory. The file gets removed
+    once the array is no longer in use. Being a shared mapping, changes
+    made by (forked) sub-processes are seen by the main process as well.
+    """
+    with tempfile.TemporaryFile(prefix='drz_', suffix='.tmp',
+                                dir=directory) as scratch:
+        # the mapping keeps its own reference to the file once created
+        return np.memmap(scratch, dtype=dtype, mode='w+', shape=shape)
+
+
+def _create_single_stack(imageObjectList, output_wcs):
+    """ Create the ``.npy`` file holding the stack of all the single drizzled
+    science (first) and weight (second) arrays, in the order of the inputs,
+    which the median step can memory-map instead of reading in sections of
+    each single drizzled image. Returns the name of the file along with the
+    position of each single drizzle product in the stack.
+    """
+    stackname = imageObjectList[0].outputNames['outSStack']
+    util.removeFileSafely(stackname)
+
+    index = {}
+    for img in imageObjectList:
+        for chip in img.returnAllChips(extname=img.scienceExt):
+            index.setdefault(chip.outputNames['outSingle'], len(index))
+
+    shape = (2, len(index)) + tuple(output_wcs.array_shape)
+    log.info('Writing single drizzle products to stack %s' % stackname)
+    stack = np.lib.format.open_memmap(stackname, mode='w+', dtype=np.float32,
+                                      shape=shape)
+    del stack
+    return stackname, index
+
+
+def _write_single_stack(stack_index, outsingle, _outsci, _outwht):
+    """ Copy a single drizzle product into its place in the stack created
+    by `_create_single_stack`. This may be run by parallel processes, each
+    writing to its own part of the file.
+    """
+    stackname, index = stack_index
+    stack = np.load(stackname, mmap_mode='r+')
+    stack[0, index[outsingle]] = _outsci
+    stack[1, index[outsingle]] = _outwht
+    stack.flush()
+    del stack
+
+
+def _build_output_tiles(shape, pool_size, max_pixels=None):
+    """ Split an output frame of the given (numpy) shape into tiles, one
+    per parallel worker, or more when needed to keep each tile below
+    ``max_pixels`` pixels. Returns a list of ``(xmin, xmax, ymin, ymax)``
+    0-based, inclusive tile bounds.
+    """
+    nxtiles, nytiles = mputil.best_tile_layout(pool_size)
+    if max_pixels:
+        tile_pixels = (shape[0] / nytiles) * (shape[1] / nxtiles)
+        nytiles *= max(int(np.ceil(tile_pixels / max_pixels)), 1)
+    xedges = np.linspace(0, shape[1], nxtiles + 1).astype(int)
+    yedges = np.linspace(0, shape[0], nytiles + 1).astype(int)
+
+    tiles = []
+    for y0, y1 in zip(yedges[:-1], yedges[1:]):
+        for x0, x1 in zip(xedges[:-1], xedges[1:]):
+            if x1 > x0 and y1 > y0:
+                tiles.append((int(x0), int(x1) - 1, int(y0), int(y1) - 1))
+    return tiles
+
+
+def _bounds_overlap(bounds, tile):
+    """ Check whether ``(xmin, xmax, ymin, ymax)`` bounds overlap a tile. """
+    if bounds is None:
+        return False
+    return (bounds[0] <= tile[1] and bounds[1] >= tile[0] and
+            bounds[2] <= tile[3] and bounds[3] >= tile[2])
+
+
+def _kernel_margin(kernel, pixfrac, pix_ratio):
+    """ Compute a conservative estimate, in output pixels, of how far beyond
+    the mapped position of an input pixel center the drizzle kernel can
+    deposit flux.
+    """
+    # The widest kernels (lanczos3) reach out 3*pixfrac input pixels,
+    # while the gaussian kernel always reaches at least 1.2 input pixels.
+    radius = max(3.0 * pixfrac, 1.2) / pix_ratio
+    # pad for rounding and for the interpolation of the WCS mapping
+    return int(np.ceil(radius)) + 2
+
+
+def _get_input_rows(input_wcs, output_wcs, window, margin, pixmap=None):
+    """ Return the range of rows of the input, as ``(ystart, nrows)``, which
+    can drop any flux onto the ``(xmin, xmax, ymin, ymax)`` window of the
+    output frame, with ``nrows`` being 0 when the input does not overlap the
+    window at all. ``margin`` is the reach of the kernel in output pixels.
+    """
+    if pixmap is not None:
+        with np.errstate(invalid='ignore'):
+            reach = ((pixmap[..., 0] >= window[0] - margin) &
+                     (pixmap[..., 0] <= window[1] + margin) &
+                     (pixmap[..., 1] >= window[2] - margin) &
+                     (pixmap[..., 1] <= window[3] + margin))
+        rows = np.flatnonzero(reach.any(axis=1))
+        if rows.size == 0:
+            return 0, 0
+        return int(rows[0]), int(rows[-1] - rows[0] + 1)
+
+    ny = input_wcs.array_shape[0]
+    footprint = wcs_functions.calcOutputBounds(input_wcs, output_wcs,
+                                               margin=margin)
+    if footprint is None or not _bounds_overlap(footprint, window):
+        return 0, 0
+    if (footprint[0] >= window[0] and footprint[1] <= window[1] and
+        footprint[2] >= window[2] and footprint[3] <= window[3]):
+        # the input lands entirely within the window
+        return 0, ny
+
+    # Only the part of the window reached by the input needs to be mapped
+    # back onto the input, padded to allow for the reach of the kernel and
+    # for the edges bending between the points checked.
+    region = (max(window[0] - margin, footprint[0]), min(window[1] + margin, footprint[1]),
+              max(window[2] - margin, footprint[2]), min(window[3] + margin, footprint[3]))
+    rows = wcs_functions.calcInputRows(input_wcs, output_wcs, region, margin=2)
+    if rows is None:
+        return 0, 0
+    return rows[0], rows[1] - rows[0] + 1
+
+
+def _read_final_product(imageObjectList, output_wcs, paramDict, build):
+    """ Read in the existing final product which the inputs will be drizzled
+    onto, from either the multi-extension file or the separate SCI, WHT and
+    CTX files depending on ``build``.
+
+    Returns ``(header, sci, wht, ctx)``, with the header of the product
+    holding the drizzle keywords, the science array converted back to the
+    units used while drizzling, and the context as a 3-D array or as an
+    `~drizzlepac.outputimage.SparseContext` (or None if the product has no
+    context). Returns None if there is no such product yet.
+    """
+    outnames = imageObjectList[0].outputNames
+    prodname = outnames['outFinal'] if build else outnames['outSci']
+    if not fileutil.findFile(prodname):
+        log.info('No existing product %s to update; creating it' % prodname)
+        return None
+    log.info('Drizzling inputs onto existing product %s' % prodname)
+
+    ctxhdu = None
+    with fits.open(prodname, memmap=False) as prodfits:
+        if build:
+            hdr = prodfits[0].header.copy()
+            sci = prodfits['SCI'].data
+            wht = prodfits['WHT'].data
+            if outnames['outContext'] and 'CTX' in prodfits:
+                ctxhdu = prodfits['CTX'].copy()
+        else:
+            sciext = 1 if prodfits[0].data is None else 0
+            hdr = prodfits[sciext].header.copy()
+            sci = prodfits[sciext].data
+            wht = None
+            if outnames['outWeight'] and fileutil.findFile(outnames['outWeight']):
+                wht = fits.getdata(outnames['outWeight'])
+            if outnames['outContext'] and fileutil.findFile(outnames['outContext']):
+                with fits.open(outnames['outContext'], memmap=False) as ctxfits:
+                    ctxext = 1 if ctxfits[0].data is None else 0
+                    ctxhdu = ctxfits[ctxext].copy()
+
+    if sci is None or wht is None or sci.shape != output_wcs.array_shape:
+        raise RuntimeError('Existing product {} does not provide SCI and WHT '
+                           'arrays matching the output frame'.format(prodname))
+
+    sci = sci.astype(np.float32)
+    # Undo the scaling applied when writing out the product
+    if hdr.get('D001OUUN', 'cps') == 'counts' and hdr.get('EXPTIME', 0.0):
+        np.divide(sci, hdr['EXPTIME'], sci)
+    img = imageObjectList[-1]
+    if (paramDict['proc_unit'].lower() == 'native' and
+        img.native_units.lower()[:6] == 'counts'):
+        chip = img.returnAllChips(extname=img.scienceExt)[-1]
+        np.multiply(sci, chip._gain, sci)
+
+    ctx = None
+    if ctxhdu is not None and ctxhdu.header.get('CTXTYPE', '') == 'SPARSE':
+        ctx = outputimage.SparseContext.from_hdu(ctxhdu)
+    elif ctxhdu is not None and ctxhdu.data is not None:
+        ctx = ctxhdu.data.astype(np.int32)
+        if ctx.ndim == 2:
+            ctx = ctx.reshape((1,) + ctx.shape)
+
+    return hdr, sci, wht.astype(np.float32), ctx
+
+
+def _seed_final_arrays(previous, _outsci, _outwht, _outctx):
+    """ Copy the arrays of an existing product (as returned by
+    :py:func:`_read_final_product`) into the output arrays.
+    """
+    hdr, sci, wht, ctx = previous
+    _outsci[...] = sci
+    _outwht[...] = wht
+    if ctx is None:
+        return
+    if isinstance(_outctx, outputimage.SparseContext):
+        if isinstance(ctx, outputimage.SparseContext):
+            _outctx.merge(ctx)
+        else:
+            for plane in range(min(ctx.shape[0], _outctx.shape[0])):
+                _outctx.set_window(plane, 0, 0, ctx[plane])
+    else:
+        if isinstance(ctx, outputimage.SparseContext):
+            ctx = ctx.toarray()
+        nplanes = min(ctx.shape[0], _outctx.shape[0])
+        _outctx[:nplanes] = ctx[:nplanes]
+
+
+def _get_chip_input_name(chip):
+    """ Return the name of the (sky-subtracted, if available) input for a chip. """
     if os.path.exists(chip.outputNames['outSky']):
         chipextn = '['+chip.header['extname']+','+str(chip.header['extver'])+']'
         _expname = chip.outputNames['outSky']+chipextn
     else:
         # If sky-subtracted product does not exist, use regular input
         _expname = chip.outputNames['data']
-    log.info('-Drizzle input: %s' % _expname)
+    return _expname
+
 
+def _get_chip_science(chip, _expname):
+    """ Read in the science array for a chip, applying the sky subtraction and
+    gain conversion needed before drizzling it.
+    """
     # Open the SCI image
     _handle = fileutil.openImage(_expname, mode='readonly', memmap=False)
     _sciext = _handle[chip.header['extname'],chip.header['extver']]
@@ -785,6 +1232,111 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
 
     _insci *= chip._effGain
 
+    return _insci
+
+
+def _get_chip_masknames(img, chip):
+    """ Return the static mask and CR mask for a chip, either as filenames or
+    as in-memory objects.
+    """
+    staticMaskName = chip.outputNames['staticMask']
+    crMaskName = chip.outputNames['crmaskImage']
+
+    if img.inmemory:
+        if staticMaskName in img.virtualOutputs:
+            staticMaskName = img.virtualOutputs[staticMaskName]
+        if crMaskName in img.virtualOutputs:
+            crMaskName = img.virtualOutputs[crMaskName]
+
+    return staticMaskName, crMaskName
+
+
+def _build_chip_mask(img, chip, paramDict, single, _expname):
+    """ Build the mask of good pixels for drizzling a chip, merging the mask
+    generated from the DQ array with the static mask and (for the final
+    drizzle) the cosmic-ray mask.
+    """
+    # Build basic DQMask from DQ array and bits value
+    dqarr = img.buildMask(chip._chip,bits=paramDict['bits'])
+
+    # get correct mask filenames/objects
+    staticMaskName, crMaskName = _get_chip_masknames(img, chip)
+
+    # Merge appropriate additional mask(s) with DQ mask
+    if single:
+        mergeDQarray(staticMaskName,dqarr)
+        if dqarr.sum() == 0:
+            log.warning('All pixels masked out when applying static mask!')
+    else:
+        mergeDQarray(staticMaskName,dqarr)
+
+        if dqarr.sum() == 0:
+            log.warning('All pixels masked out when applying static mask!')
+        else:
+            # Only apply cosmic-ray mask when some good pixels remain after
+            # applying the static mask
+            mergeDQarray(crMaskName,dqarr)
+
+            if dqarr.sum() == 0:
+                log.warning('WARNING: All pixels masked out when applying '
+                            'cosmic ray mask to %s' % _expname)
+
+    return dqarr
+
+
+def _build_chip_weight(img, chip, dqarr, paramDict, pix_ratio):
+    """ Build the input weight array for drizzling a chip. """
+    # Convert mask to a datatype expected by 'tdriz'
+    # Also, base weight mask on ERR or IVM file as requested by user
+    wht_type = paramDict['wht_type']
+
+    if wht_type == 'ERR':
+        _inwht = img.buildERRmask(chip._chip,dqarr,pix_ratio)
+    elif wht_type == 'IVM':
+        _inwht = img.buildIVMmask(chip._chip,dqarr,pix_ratio)
+    elif wht_type == 'EXP':
+        _inwht = img.buildEXPmask(chip._chip,dqarr)
+    else:  # wht_type == None, used for single drizzle images
+        _inwht = chip._exptime * dqarr.astype(np.float32)
+
+    return _inwht
+
+
+def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
+                  doWrite,build,_versions,_numctx,_nplanes,_numchips,
+                  _outsci,_outwht,_outctx,_hdrlist,wcsmap,predrizzled=False):
+    """ Perform the drizzle operation on a single chip.
+    This is separated out from `run_driz_img` so as to keep together
+    the entirety of the code which is inside the loop over
+    chips.  See the `run_driz` code for more documentation.
+
+    If ``predrizzled`` is True, the chip has already been drizzled into the
+    output arrays (see :py:func:`run_driz_tiles`), so that only the
+    remaining operations (updating the input DQ array, writing out masks
+    and products) get performed.
+    """
+    global time_pre_all, time_driz_all, time_post_all, time_write_all
+
+    epoch = time.time()
+
+    # Chips which do not overlap the output frame at all do not even need
+    # to be read in (only known without a user-supplied mapping)
+    overlaps = True
+    if not predrizzled and wcsmap is None:
+        margin = _kernel_margin(paramDict['kernel'], paramDict['pixfrac'],
+                                outwcs.pscale / chip.wcslin_pscale)
+        if wcs_functions.calcOutputBounds(chip.wcs, outwcs, margin=margin) is None:
+            log.info('-Skipping input %s, which does not overlap the output'
+                     % chip.outputNames['data'])
+            overlaps = False
+    drizzle_chip = overlaps and not predrizzled
+
+    # Look for sky-subtracted product
+    _expname = _get_chip_input_name(chip)
+    if drizzle_chip:
+        log.info('-Drizzle input: %s' % _expname)
+        _insci = _get_chip_science(chip, _expname)
+
     # Set additional parameters needed by 'drizzle'
     _in_units = chip.in_units.lower()
     if _in_units == 'cps':
@@ -821,7 +1373,7 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
             #    overwrite what is already in header
             _bunit = None
 
-    _uniqid = _numchips + 1
+    _uniqid = _numchips + 1 + paramDict.get('ctx_offset', 0)
     if _nplanes == 1:
         # We need to reset what gets passed to TDRIZ
         # when only 1 context image plane gets generated
@@ -836,57 +1388,20 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
     # and combine it with the static_mask for single_drizzle case...
     #
     ####
-    # Build basic DQMask from DQ array and bits value
-    dqarr = img.buildMask(chip._chip,bits=paramDict['bits'])
-
-    # get correct mask filenames/objects
-    staticMaskName = chip.outputNames['staticMask']
-    crMaskName = chip.outputNames['crmaskImage']
-
-    if img.inmemory:
-        if staticMaskName in img.virtualOutputs:
-            staticMaskName = img.virtualOutputs[staticMaskName]
-        if crMaskName in img.virtualOutputs:
-            crMaskName = img.virtualOutputs[crMaskName]
-
-    # Merge appropriate additional mask(s) with DQ mask
-    if single:
-        mergeDQarray(staticMaskName,dqarr)
-        if dqarr.sum() == 0:
-            log.warning('All pixels masked out when applying static mask!')
-    else:
-        mergeDQarray(staticMaskName,dqarr)
-
-        if dqarr.sum() == 0:
-            log.warning('All pixels masked out when applying static mask!')
-        else:
-            # Only apply cosmic-ray mask when some good pixels remain after
-            # applying the static mask
-            mergeDQarray(crMaskName,dqarr)
-
-            if dqarr.sum() == 0:
-                log.warning('WARNING: All pixels masked out when applying '
-                            'cosmic ray mask to %s' % _expname)
+    # When already drizzled, the weights are only needed to write out the mask
+    _inwht = None
+    if drizzle_chip or not paramDict['clean']:
+        dqarr = _build_chip_mask(img, chip, paramDict, single, _expname)
+        pix_ratio = outwcs.pscale / chip.wcslin_pscale
+        _inwht = _build_chip_weight(img, chip, dqarr, paramDict, pix_ratio)
+
+    if not single:
+        crMaskName = _get_chip_masknames(img, chip)[1]
         updateInputDQArray(chip.dqfile,chip.dq_extn,chip._chip,
                            crMaskName, paramDict['crbit'])
 
     img.set_wtscl(chip._chip,paramDict['wt_scl'])
 
-    pix_ratio = outwcs.pscale / chip.wcslin_pscale
-
-    # Convert mask to a datatype expected by 'tdriz'
-    # Also, base weight mask on ERR or IVM file as requested by user
-    wht_type = paramDict['wht_type']
-
-    if wht_type == 'ERR':
-        _inwht = img.buildERRmask(chip._chip,dqarr,pix_ratio)
-    elif wht_type == 'IVM':
-        _inwht = img.buildIVMmask(chip._chip,dqarr,pix_ratio)
-    elif wht_type == 'EXP':
-        _inwht = img.buildEXPmask(chip._chip,dqarr)
-    else:  # wht_type == None, used for single drizzle images
-        _inwht = chip._exptime * dqarr.astype(np.float32)
-
     if not(paramDict['clean']):
         # Write out mask file if 'clean' has been turned off
         if single:
@@ -905,13 +1420,19 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
             log.info('Writing out mask file: %s' % _outmaskname)
 
     time_pre = time.time() - epoch; epoch = time.time()
-    # New interface to performing the drizzle operation on a single chip/image
-    _vers = do_driz(_insci, chip.wcs, _inwht, outwcs, _outsci, _outwht, _outctx,
-                _expin, _in_units, chip._wtscl,
-                wcslin_pscale=chip.wcslin_pscale, uniqid=_uniqid,
-                pixfrac=paramDict['pixfrac'], kernel=paramDict['kernel'],
-                fillval=paramDict['fillval'], stepsize=paramDict['stepsize'],
-                wcsmap=wcsmap)
+    if not drizzle_chip:
+        _vers = cdriz.tdriz_version
+        if not overlaps and not util.is_blank(paramDict['fillval']):
+            # as 'tdriz' would have done for this chip
+            _outsci[_outwht == 0] = np.float32(paramDict['fillval'])
+    else:
+        # New interface to performing the drizzle operation on a single chip/image
+        _vers = do_driz(_insci, chip.wcs, _inwht, outwcs, _outsci, _outwht, _outctx,
+                    _expin, _in_units, chip._wtscl,
+                    wcslin_pscale=chip.wcslin_pscale, uniqid=_uniqid,
+                    pixfrac=paramDict['pixfrac'], kernel=paramDict['kernel'],
+                    fillval=paramDict['fillval'], stepsize=paramDict['stepsize'],
+                    wcsmap=wcsmap, nthreads=paramDict['nthreads'])
     time_driz = time.time() - epoch; epoch = time.time()
 
     # Set up information for generating output FITS image
@@ -975,6 +1496,8 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
                                           wcs=output_wcs, single=single)
         _outimg.set_bunit(_bunit)
         _outimg.set_units(paramDict['units'])
+        if not single:
+            _outimg.set_previous(paramDict.get('previous_header'))
         outimgs = _outimg.writeFITS(template,_outsci,_outwht,ctxarr=_outctx,
                                         versions=_versions,virtual=img.inmemory)
         del _outimg
@@ -982,6 +1505,9 @@ def run_driz_chip(img,chip,output_wcs,outwcs,template,paramDict,single,
         # update imageObject with product in memory
         if single:
             img.saveVirtualOutputs(outimgs)
+        if single and paramDict.get('stack_index') is not None:
+            _write_single_stack(paramDict['stack_index'],
+                                chip.outputNames['outSingle'], _outsci, _outwht)
 
     # this is after the doWrite
     time_write = time.time() - epoch; epoch = time.time()
@@ -1012,13 +1538,33 @@ def do_driz(insci, input_wcs, inwht,
             output_wcs, outsci, outwht, outcon,
             expin, in_units, wt_scl,
             wcslin_pscale=1.0,uniqid=1, pixfrac=1.0, kernel='square',
-            fillval="INDEF", stepsize=10,wcsmap=None):
+            fillval="INDEF", stepsize=10,wcsmap=None,out_origin=None,
+            nthreads=1, pixmap=None):
     """
     Core routine for performing 'drizzle' operation on a single input image
     All input values will be Python objects such as ndarrays, instead
     of filenames.
     File handling (input and output) will be performed by calling routine.
 
+    If ``out_origin`` is given as an ``(x, y)`` 0-based pixel position, the
+    output arrays only hold a tile of the frame defined by ``output_wcs``,
+    starting at that position.
+
+    With the default WCS-based mapping (``wcsmap=None`` and ``stepsize > 0``),
+    the drizzling can be split across ``nthreads`` threads, each working
+    on its own band of the output, with results identical to those
+    from a single thread.
+
+    A precomputed ``pixmap``, of shape ``(ny, nx, 2)`` and holding the
+    0-based output ``(x, y)`` position of each input pixel (see
+    `~drizzlepac.wcs_functions.calc_pixmap`), can be given instead of
+    ``wcsmap``. It then gets used directly by the C code, without any
+    calls back into Python.
+
+    ``outcon`` can also be a `~drizzlepac.outputimage.SparseContext`, in
+    which case only the part of the output reached by this input gets
+    drizzled, using dense copies of just that part of the output arrays.
+
     """
     # Insure that the fillval parameter gets properly interpreted for use with tdriz
     if util.is_blank(fillval):
@@ -1026,6 +1572,53 @@ def do_driz(insci, input_wcs, inwht,
     else:
         fillval = str(fillval)
 
+    if isinstance(outcon, outputimage.SparseContext):
+        planeid = int((uniqid-1) / 32)
+        if outcon.shape[0] <= planeid:
+            raise IndexError("Not enough planes in drizzle context image")
+
+        # Bounds (in the full output frame) of the part of the output arrays
+        # which this input can reach
+        x0, y0 = (0, 0) if out_origin is None else out_origin
+        ny, nx = outsci.shape
+        bounds = (x0, x0 + nx - 1, y0, y0 + ny - 1)
+        if wcsmap is None and pixmap is None:
+            margin = _kernel_margin(kernel, pixfrac,
+                                    output_wcs.pscale / wcslin_pscale)
+            footprint = wcs_functions.calcOutputBounds(input_wcs, output_wcs,
+                                                       margin=margin)
+            if footprint is None or not _bounds_overlap(footprint, bounds):
+                bounds = None
+            else:
+                bounds = (max(bounds[0], footprint[0]), min(bounds[1], footprint[1]),
+                          max(bounds[2], footprint[2]), min(bounds[3], footprint[3]))
+
+        _vers = cdriz.tdriz_version
+        if bounds is not None:
+            wx0, wx1, wy0, wy1 = bounds
+            wslice = (slice(wy0 - y0, wy1 - y0 + 1), slice(wx0 - x0, wx1 - x0 + 1))
+            _winsci = outsci[wslice].copy()
+            _winwht = outwht[wslice].copy()
+            _winctx = outcon.get_window(planeid, wy0 - y0, wy1 - y0 + 1,
+                                        wx0 - x0, wx1 - x0 + 1)
+            _vers = do_driz(insci, input_wcs, inwht,
+                            output_wcs, _winsci, _winwht, _winctx,
+                            expin, in_units, wt_scl,
+                            wcslin_pscale=wcslin_pscale,
+                            uniqid=((uniqid-1) % 32) + 1,
+                            pixfrac=pixfrac, kernel=kernel, fillval='INDEF',
+                            stepsize=stepsize, wcsmap=wcsmap,
+                            out_origin=(wx0, wy0), nthreads=nthreads,
+                            pixmap=pixmap)
+            outsci[wslice] = _winsci
+            outwht[wslice] = _winwht
+            outcon.set_window(planeid, wy0 - y0, wx0 - x0, _winctx)
+
+        # Apply the fill value to the full output, as 'tdriz' would have
+        if fillval != 'INDEF':
+            outsci[outwht == 0] = np.float32(fillval)
+        return _vers
+
     if in_units == 'cps':
         expscale = 1.0
     else:
@@ -1054,14 +1647,46 @@ def do_driz(insci, input_wcs, inwht,
 
     pix_ratio = output_wcs.pscale/wcslin_pscale
 
-    if wcsmap is None and cdriz is not None:
+    if pixmap is not None and pixmap.shape[:2] != insci.shape:
+        raise ValueError("Pixel map does not match the input image shape")
+
+    _shift_fr = 'output'
+    _shift_un = 'output'
+    ystart = 0
+    nmiss = 0
+    nskip = 0
+    #
+    # This call to 'cdriz.tdriz' uses the new C syntax
+    #
+    _dny = insci.shape[0]
+
+    # Only drizzle the input rows which can reach the output arrays, and
+    # none at all for an input which does not overlap them (unless a
+    # user-supplied mapping, with an unknown footprint, gets used).
+    if pixmap is not None or wcsmap is None:
+        x0, y0 = (0, 0) if out_origin is None else out_origin
+        window = (x0, x0 + outsci.shape[1] - 1, y0, y0 + outsci.shape[0] - 1)
+        margin = _kernel_margin(kernel, pixfrac, pix_ratio)
+        ystart, _dny = _get_input_rows(input_wcs, output_wcs, window, margin,
+                                       pixmap=pixmap)
+        if _dny == 0:
+            log.info('Input does not overlap the output; skipping it...')
+            if out_origin is None:
+                log.warning('! %s points were outside the output image.' % insci.size)
+            if fillval != 'INDEF':
+                outsci[outwht == 0] = np.float32(fillval)
+            return cdriz.tdriz_version
+        if _dny < insci.shape[0]:
+            log.info('Drizzling input rows %d to %d only' % (ystart + 1, ystart + _dny))
+
+    if pixmap is not None:
+        log.info('Using pixel map for coordinate transformation...')
+        mapping = wcs_functions.pixmap_to_mapping(pixmap)
+    elif wcsmap is None and cdriz is not None:
         log.info('Using WCSLIB-based coordinate transformation...')
         log.info('stepsize = %s' % stepsize)
-        mapping = cdriz.DefaultWCSMapping(
-            input_wcs, output_wcs,
-            input_wcs.pixel_shape[0], input_wcs.pixel_shape[1],
-            stepsize
-        )
+        mapping = wcs_functions.get_default_mapping(input_wcs, output_wcs,
+                                                    stepsize)
     else:
         #
         ##Using the Python class for the WCS-based transformation
@@ -1073,25 +1698,31 @@ def do_driz(insci, input_wcs, inwht,
         wmap = wcsmap(input_wcs,output_wcs)
         mapping = wmap.forward
 
-    _shift_fr = 'output'
-    _shift_un = 'output'
-    ystart = 0
-    nmiss = 0
-    nskip = 0
-    #
-    # This call to 'cdriz.tdriz' uses the new C syntax
-    #
-    _dny = insci.shape[0]
     # Call 'drizzle' to perform image combination
     if insci.dtype > np.float32:
         #WARNING: Input array recast as a float32 array
         insci = insci.astype(np.float32)
 
-    _vers,nmiss,nskip = cdriz.tdriz(insci, inwht, outsci, outwht,
-        outctx, uniqid, ystart, 1, 1, _dny,
-        pix_ratio, 1.0, 1.0, 'center', pixfrac,
-        kernel, in_units, expscale, wt_scl,
-        fillval, nmiss, nskip, 1, mapping)
+    if out_origin is None:
+        _vers,nmiss,nskip = cdriz.tdriz(insci, inwht, outsci, outwht,
+            outctx, uniqid, ystart, 1, 1, _dny,
+            pix_ratio, 1.0, 1.0, 'center', pixfrac,
+            kernel, in_units, expscale, wt_scl,
+            fillval, nmiss, nskip, 1, mapping, nthreads=nthreads)
+        # rows left out above are entirely outside of the output
+        nmiss += (insci.shape[0] - _dny) * insci.shape[1]
+        nskip += insci.shape[0] - _dny
+    else:
+        _vers,nmiss,nskip = cdriz.tdriz(insci, inwht, outsci, outwht,
+            outctx, uniqid, ystart, 1, 1, _dny,
+            pix_ratio, 1.0, 1.0, 'center', pixfrac,
+            kernel, in_units, expscale, wt_scl,
+            fillval, nmiss, nskip, 1, mapping,
+            outx0=out_origin[0], outy0=out_origin[1],
+            outnx=output_wcs.pixel_shape[0], outny=output_wcs.pixel_shape[1],
+            nthreads=nthreads)
+        # points outside of this tile are not necessarily outside the output
+        nmiss = 0
 
     if nmiss > 0:
         log.warning('! %s points were outside the output image.' % nmiss)
@@ -0,0 +1,181 @@
+"""
+Approximate median combination of images, streaming through the inputs one
+at a time so that memory use does not depend on the number of inputs.
+
+:License: :doc:`LICENSE`
+
+"""
+import numpy as np
+
+from .version import *
+
+# Default number of bins each interval gets divided in, and number of
+# refining passes over the inputs:
+NBINS = 16
+NPASSES = 4
+
+
+def approx_median(read_inputs, shape, nlow=0, nhigh=0, lower=None,
+                  upper=None, nbins=NBINS, npasses=NPASSES):
+    """ Compute an approximate median of a stack of images, reading the
+    images in one at a time.
+
+    For each pixel, the value of the median is narrowed down to a range of
+    the good input values, starting from their minimum and maximum. Each
+    pass over the inputs counts how many of the values fall within each of
+    ``nbins`` equal bins of that range, and keeps only the bin holding the
+    median. The result is the middle of the final range. Memory use is about
+    ``nbins`` counters per pixel, regardless of the number of inputs.
+
+    The error of the result, compared to the exact median, is at most half
+    the final range, that is::
+
+        (maximum - minimum) / (2 * nbins**npasses)
+
+    where *maximum* and *minimum* are the highest and lowest good input
+    values of each pixel. With the default settings, this is less than
+    1e-5 of that spread.
+
+    Parameters
+    ----------
+    read_inputs : callable
+        Function returning an iterable over the inputs, yielding a tuple of
+        ``(data, mask)`` arrays of the given shape for each input, where
+        ``mask`` is non-zero for bad pixels, or `None` if all of them are
+        good. This gets called once for each pass over the inputs.
+
+    shape : tuple
+        Shape of the input arrays.
+
+    nlow : int
+        Number of low values to reject for each pixel. (Default: 0)
+
+    nhigh : int
+        Number of high values to reject for each pixel. (Default: 0)
+
+    lower : float, None
+        Input values below this value are rejected as well. (Default: `None`)
+
+    upper : float, None
+        Input values above this value are rejected as well. (Default: `None`)
+
+    nbins : int
+        Number of bins each range gets divided in. (Default: `NBINS`)
+
+    npasses : int
+        Number of passes over the inputs refining the ranges, after the
+        first one finding their minimum and maximum. (Default: `NPASSES`)
+
+    Returns
+    -------
+    median : numpy.ndarray
+        Approximate median, set to 0 where no input value is good.
+
+    """
+    if nbins < 2:
+        raise ValueError("At least 2 bins are needed for the approximate "
+                         "median")
+
+    count = np.zeros(shape, dtype=np.int32)
+    lo = np.full(shape, np.inf)
+    hi = np.full(shape, -np.inf)
+
+    for data, good in _good_values(read_inputs, lower, upper):
+        count += good
+        np.fmin(lo, np.where(good, data, np.inf), out=lo)
+        np.fmax(hi, np.where(good, data, -np.inf), out=hi)
+
+    covered = count > 0
+    lo[~covered] = 0.0
+    hi[~covered] = 0.0
+
+    # 0-based rank(s) of the median of the values left after rejecting the
+    # nlow lowest and nhigh highest ones, averaging the two inner values
+    # when an even number of them is left. As for numcombine's 'median',
+    # the same rank (limited to that of the good values) also gets used
+    # where all of them get rejected, which is the plain median of all the
+    # good values when nlow equals nhigh:
+    rank = np.clip((count - 1 + nlow - nhigh) / 2.0, 0,
+                   np.maximum(count - 1, 0))
+    targets = [np.floor(rank).astype(np.int32)]
+    if np.any(np.ceil(rank) != targets[0]):
+        targets.append(np.ceil(rank).astype(np.int32))
+
+    ranges = [(lo.copy(), hi.copy()) for rank in targets]
+    del lo, hi
+
+    npix = int(np.prod(shape))
+    pixels = np.arange(npix)
+
+    for p in range(npasses):
+        below = [np.zeros(npix, dtype=np.int32) for rank in targets]
+        counts = [np.zeros((nbins, npix), dtype=np.int32) for rank in targets]
+
+        for data, good in _good_values(read_inputs, lower, upper):
+            data = data.ravel()
+            good = good.ravel()
+            for (rlo, rhi), nbelow, ncounts in zip(ranges, below, counts):
+                rlo = rlo.ravel()
+                rhi = rhi.ravel()
+                nbelow += good & (data < rlo)
+                inside = good & (data >= rlo) & (data <= rhi)
+                width = rhi[inside] - rlo[inside]
+                bins = np.zeros(width.shape, dtype=np.intp)
+                nonzero = width > 0
+                bins[nonzero] = np.minimum(
+                    (data[inside][nonzero] - rlo[inside][nonzero]) *
+                    (nbins / width[nonzero]),
+                    nbins - 1
+                ).astype(np.intp)
+                # each input adds at most one value to each pixel:
+                ncounts[bins, pixels[inside]] += 1
+
+        for (rlo, rhi), rank, nbelow, ncounts in zip(ranges, targets, below,
+                                                     counts):
+            _narrow_range(rlo.ravel(), rhi.ravel(), rank.ravel(), nbelow,
+                          ncounts)
+
+    median = np.zeros(shape, dtype=np.float64)
+    for rlo, rhi in ranges:
+        median += 0.5 * (rlo + rhi)
+    median /= len(ranges)
+    median[~covered] = 0.0
+
+    return median.astype(np.float32)
+
+
+def _good_values(read_inputs, lower, upper):
+    """ Iterate over the inputs, yielding each one along with the mask of its
+    good values, excluding any which are not finite or outside of the
+    ``lower`` and ``upper`` limits.
+    """
+    for data, mask in read_inputs():
+        data = np.asarray(data)
+        good = np.isfinite(data)
+        if mask is not None:
+            good &= np.logical_not(mask)
+        if lower is not None:
+            good &= data >= lower
+        if upper is not None:
+            good &= data <= upper
+        yield data, good
+
+
+def _narrow_range(rlo, rhi, rank, nbelow, ncounts):
+    """ Narrow down, in place, the range of values holding the value of the
+    given rank to the bin holding it, from the number of values below the
+    range and the number of values in each bin of it. Ranges for which the
+    bin cannot be found, due to rounding, are left unchanged.
+    """
+    nbins = ncounts.shape[0]
+    cumulative = nbelow + np.cumsum(ncounts, axis=0)
+    # first bin with more values up to its end than the rank:
+    found = cumulative[-1] > rank
+    found &= nbelow <= rank
+    b = np.argmax(cumulative > rank, axis=0)
+
+    width = (rhi - rlo) / nbins
+    new_lo = rlo + b * width
+    new_hi = np.where(b == nbins - 1, rhi, rlo + (b + 1) * width)
+    rlo[found] = new_lo[found]
+    rhi[found] = new_hi[found]
@@ -173,6 +173,12 @@ def run(configobj, wcsmap=None):
     log.debug('')
     util.print_cfg(configobj, log.debug)
 
+    # Set up the worker pool to be shared by all parallel processing steps
+    pool = util.start_worker_pool(configobj.get('num_cores'))
+    # Reuse the pixel mapping of each image in all drizzle and blot steps
+    wcs_functions.start_pixmap_cache(configobj.get('pixmap_cache') or None,
+                                     shared=pool.size > 1)
+
     try:
         # Define list of imageObject instances and output WCSObject instance
         # based on input paramters
@@ -219,7 +225,8 @@ def run(configobj, wcsmap=None):
                       procSteps=procSteps)
 
         #look for cosmic rays
-        drizCR.rundrizCR(imgObjList, configobj, procSteps=procSteps)
+        drizCR.rundrizCR(imgObjList, configobj, procSteps=procSteps,
+                         output_wcs=outwcs, wcsmap=wcsmap)
 
         #Make your final drizzled image
         adrizzle.drizFinal(imgObjList, outwcs, configobj, wcsmap=wcsmap,
@@ -238,6 +245,8 @@ def run(configobj, wcsmap=None):
         raise
 
     finally:
+        util.end_worker_pool()
+        wcs_functions.end_pixmap_cache()
         procSteps.reportTimes()
         if imgObjList:
             for image in imgObjList:
@@ -10,6 +10,7 @@ import os
 import sys
 import math
 import numpy as np
+from scipy import ndimage
 from astropy.io import fits
 
 from stsci.imagestats import ImageStats
@@ -19,8 +20,10 @@ from stsci.tools import iterfile, teal, logutil
 from . import imageObject
 from . import util
 from .minmed import min_med
+from .approxmed import approx_median
 from . import processInput
-from .adrizzle import _single_step_num_
+from .adrizzle import (_single_step_num_, _create_shared_array,
+                       _shared_array_view)
 
 from .version import *
 
@@ -87,11 +90,13 @@ def createMedian(imgObjList, configObj, procSteps=None):
 
     paramDict = configObj[step_name]
     paramDict['proc_unit'] = configObj['proc_unit']
+    paramDict['num_cores'] = configObj.get('num_cores')
 
     # include whether or not compression was performed
     driz_sep_name = util.getSectionName(configObj, _single_step_num_)
     driz_sep_paramDict = configObj[driz_sep_name]
     paramDict['compress'] = driz_sep_paramDict['driz_sep_compress']
+    paramDict['stack'] = driz_sep_paramDict.get('driz_sep_stack', False)
 
     log.info('USER INPUT PARAMETERS for Create Median Step:')
     util.printParams(paramDict, log=log)
@@ -297,10 +302,22 @@ def _median(imageObjectList, paramDict):
     single_data_dtype = single_driz_data.dtype
     imrows, imcols = single_driz_data.shape
 
-    medianImageArray = np.zeros_like(single_driz_data)
-
     del single_driz_data
 
+    # Combine views of the memory-mapped stack of single drizzled images,
+    # when available, instead of copying sections out of each image.
+    drizStack, weightStack = singleDrizList, singleWeightList
+    if (paramDict.get('stack', False) and not virtual and
+            len(singleWeightList) == len(singleDrizList)):
+        stack = _open_single_stack(
+            imageObjectList[0].outputNames.get('outSStack'),
+            (2, len(singleDrizList), imrows, imcols)
+        )
+        if stack is not None:
+            log.info('Combining the memory-mapped stack of single drizzled '
+                     'images')
+            drizStack, weightStack = stack[0], stack[1]
+
     if comb_type == "minmed" and not newmasks:
         # Issue a warning if minmed is being run with newmasks turned off.
         print('\nWARNING: Creating median image without the application of '
@@ -333,92 +350,20 @@ def _median(imageObjectList, paramDict):
         grow = new_grow
         overlap = 2 * grow
 
-    nbr = section_nrows - overlap
-    nsec = (imrows - overlap) // nbr
-    if (imrows - overlap) % nbr > 0:
-        nsec += 1
+    sections = _build_sections(imrows, section_nrows, grow)
 
-    for k in range(nsec):
-        e1 = k * nbr
-        e2 = e1 + section_nrows
-        u1 = grow
-        u2 = u1 + nbr
+    combine_pars = {
+        'comb_type': comb_type, 'newmasks': newmasks, 'grow': grow,
+        'nsigma1': nsigma1, 'nsigma2': nsigma2, 'nlow': nlow, 'nhigh': nhigh,
+        'lthresh': lthresh, 'hthresh': hthresh, 'wht_mean': wht_mean,
+        'readnoise': readnoiseList, 'exptime': exposureTimeList,
+        'background': backgroundValueList,
+        'shape': (imrows, imcols), 'dtype': single_data_dtype
+    }
 
-        if k == 0:  # first section
-            u1 = 0
-
-        if k == nsec - 1:  # last section
-            e2 = min(e2, imrows)
-            e1 = min(e1, e2 - overlap - 1)
-            u2 = e2 - e1
-
-        imdrizSectionsList = np.empty(
-            (len(singleDrizList), e2 - e1, imcols),
-            dtype=single_data_dtype
-        )
-        for i, w in enumerate(singleDrizList):
-            imdrizSectionsList[i, :, :] = w[e1:e2]
-
-        if singleWeightList:
-            weightSectionsList = np.empty(
-                (len(singleWeightList), e2 - e1, imcols),
-                dtype=single_data_dtype
-            )
-            for i, w in enumerate(singleWeightList):
-                weightSectionsList[i, :, :] = w[e1:e2]
-        else:
-            weightSectionsList = None
-
-        weight_mask_list = None
-
-        if newmasks and weightSectionsList is not None:
-            # Build new masks from single drizzled images.
-            # Generate new pixel mask file for median step.
-            # This mask will be created from the single-drizzled
-            # weight image for this image.
-
-            # The mean of the weight array will be computed and all
-            # pixels with values less than 0.7 of the mean will be flagged
-            # as bad in this mask. This mask will then be used when
-            # creating the median image.
-            # 0 means good, 1 means bad here...
-            weight_mask_list = np.less(
-                weightSectionsList,
-                np.asarray(wht_mean)[:, None, None]
-            ).astype(np.uint8)
-
-        if 'minmed' in comb_type:  # Do MINMED
-            # set up use of 'imedian'/'imean' in minmed algorithm
-            fillval = comb_type.startswith('i')
-
-            # Create the combined array object using the minmed algorithm
-            result = min_med(
-                imdrizSectionsList,
-                weightSectionsList,
-                readnoiseList,
-                exposureTimeList,
-                backgroundValueList,
-                weight_masks=weight_mask_list,
-                combine_grow=grow,
-                combine_nsigma1=nsigma1,
-                combine_nsigma2=nsigma2,
-                fillval=fillval
-            )
-
-        else:  # DO NUMCOMBINE
-            # Create the combined array object using the numcombine task
-            result = numcombine.num_combine(
-                imdrizSectionsList,
-                masks=weight_mask_list,
-                combination_type=comb_type,
-                nlow=nlow,
-                nhigh=nhigh,
-                upper=hthresh,
-                lower=lthresh
-            )
-
-        # Write out the processed image sections to the final output array:
-        medianImageArray[e1+u1:e1+u2, :] = result[u1:u2, :]
+    medianImageArray = _combine_sections(sections, drizStack, weightStack,
+                                         combine_pars,
+                                         paramDict.get('num_cores'))
 
     # Write out the combined image
     # use the header from the first single drizzled image in the list
@@ -451,6 +396,322 @@ def _median(imageObjectList, paramDict):
             img.close()
 
 
+def _build_sections(imrows, section_nrows, grow):
+    """ Split the rows of the single drizzled images into sections of
+    ``section_nrows`` rows overlapping by ``2 * grow`` rows. Returns a list
+    of ``(e1, e2, u1, u2)`` tuples, for the rows ``e1`` to ``e2`` (excluded)
+    of each section, of which rows ``u1`` to ``u2`` (excluded) make it to
+    the median image.
+    """
+    overlap = 2 * grow
+    nbr = section_nrows - overlap
+    nsec = (imrows - overlap) // nbr
+    if (imrows - overlap) % nbr > 0:
+        nsec += 1
+
+    sections = []
+    for k in range(nsec):
+        e1 = k * nbr
+        e2 = e1 + section_nrows
+        u1 = grow
+        u2 = u1 + nbr
+
+        if k == 0:  # first section
+            u1 = 0
+
+        if k == nsec - 1:  # last section
+            e2 = min(e2, imrows)
+            e1 = min(e1, e2 - overlap - 1)
+            u2 = e2 - e1
+
+        sections.append((e1, e2, u1, u2))
+
+    return sections
+
+
+def _combine_sections(sections, drizStack, weightStack, combine_pars,
+                      num_cores=None):
+    """ Combine all the sections (see `_build_sections`) of the single
+    drizzled images into the median image, using parallel processes when
+    ``num_cores`` allows it.
+    """
+    imrows, imcols = combine_pars['shape']
+    nsec = len(sections)
+
+    # Sections are independent of each other, so that bands of them can
+    # be combined in parallel, each band by a separate worker process
+    # writing directly into the shared median array.
+    pool_size = util.get_pool_size(num_cores, nsec)
+    if pool_size > 1:
+        log.info('Executing %d parallel workers' % pool_size)
+        median_dtype = np.dtype(combine_pars['dtype']).newbyteorder('=')
+        shared_median, medianImageArray = _create_shared_array(
+            (imrows, imcols), median_dtype)
+        bands = np.array_split(np.arange(nsec), pool_size)
+        tasks = [([sections[k] for k in band], shared_median, median_dtype,
+                  drizStack, weightStack, combine_pars)
+                 for band in bands if len(band) > 0]
+        pool = util.get_worker_pool(num_cores)
+        pool.run(_median_sections, tasks,
+                 name='createMedian._median_sections()',
+                 pool_size=pool_size)  # blocks till all done
+    else:
+        log.info('Executing serially')
+        medianImageArray = np.zeros((imrows, imcols),
+                                    dtype=combine_pars['dtype'])
+        for e1, e2, u1, u2 in sections:
+            result = _combine_section(e1, e2, drizStack, weightStack,
+                                      combine_pars)
+            # Write out the processed image sections to the final output array:
+            medianImageArray[e1+u1:e1+u2, :] = result[u1:u2, :]
+
+    return medianImageArray
+
+
+def _combine_section(e1, e2, singleDrizList, singleWeightList, combine_pars):
+    """ Combine rows ``e1`` to ``e2`` (excluded) of all the single drizzled
+    images, using the parameters set up by `_median`.
+    """
+    comb_type = combine_pars['comb_type']
+    imcols = combine_pars['shape'][1]
+    dtype = combine_pars['dtype']
+
+    if comb_type == 'amedian':
+        return _stream_section(e1, e2, singleDrizList, singleWeightList,
+                               combine_pars)
+
+    if isinstance(singleDrizList, np.ndarray):
+        # (memory-mapped) stack of all the single drizzled images
+        imdrizSectionsList = singleDrizList[:, e1:e2]
+    else:
+        imdrizSectionsList = np.empty(
+            (len(singleDrizList), e2 - e1, imcols),
+            dtype=dtype
+        )
+        for i, w in enumerate(singleDrizList):
+            imdrizSectionsList[i, :, :] = w[e1:e2]
+
+    if isinstance(singleWeightList, np.ndarray):
+        weightSectionsList = singleWeightList[:, e1:e2]
+    elif singleWeightList:
+        weightSectionsList = np.empty(
+            (len(singleWeightList), e2 - e1, imcols),
+            dtype=dtype
+        )
+        for i, w in enumerate(singleWeightList):
+            weightSectionsList[i, :, :] = w[e1:e2]
+    else:
+        weightSectionsList = None
+
+    weight_mask_list = None
+
+    if combine_pars['newmasks'] and weightSectionsList is not None:
+        # Build new masks from single drizzled images.
+        # Generate new pixel mask file for median step.
+        # This mask will be created from the single-drizzled
+        # weight image for this image.
+
+        # The mean of the weight array will be computed and all
+        # pixels with values less than 0.7 of the mean will be flagged
+        # as bad in this mask. This mask will then be used when
+        # creating the median image.
+        # 0 means good, 1 means bad here...
+        weight_mask_list = np.less(
+            weightSectionsList,
+            np.asarray(combine_pars['wht_mean'])[:, None, None]
+        ).astype(np.uint8)
+
+    return _combine_coverage(imdrizSectionsList, weightSectionsList,
+                             weight_mask_list, combine_pars)
+
+
+def _combine_coverage(images, weights, masks, combine_pars):
+    """ Combine stacked sections of the single drizzled images, running the
+    full combination only over the parts of the sections covered by more
+    inputs than the result is already known for. Elsewhere, such as in the
+    gaps of a mosaic, the result gets computed directly instead.
+    """
+    comb_type = combine_pars['comb_type']
+    nimages = len(images)
+
+    # Largest number of contributing (not masked) inputs for which the
+    # result of the combination is known without running it:
+    max_direct = -1
+    if masks is not None:
+        if 'minmed' in comb_type and nimages > 2:
+            # none: 0, one: its value, two: the lower value, since the median
+            # rejects the highest one and thus equals the minimum.
+            max_direct = 2
+        elif (comb_type in ['median', 'mean'] and
+              nimages - combine_pars['nlow'] - combine_pars['nhigh'] > 0):
+            # none: 0
+            max_direct = 0
+
+    if max_direct < 0:
+        return _combine_stack(images, weights, masks, combine_pars)
+
+    coverage = nimages - np.count_nonzero(masks, axis=0)
+    full = coverage > max_direct
+    if np.all(full):
+        return _combine_stack(images, weights, masks, combine_pars)
+
+    result = np.zeros(coverage.shape, dtype=images.dtype.newbyteorder('='))
+    if max_direct > 0:
+        # any contributing value which is not finite needs the full
+        # combination as well:
+        bad = masks.astype(bool)
+        full |= np.logical_not(np.all(np.isfinite(images) | bad, axis=0))
+        good_sum = np.sum(images * np.logical_not(bad), axis=0)
+        good_min = np.min(np.where(bad, np.inf, images), axis=0)
+        direct = np.where(coverage == 1, good_sum, good_min)
+        covered = coverage > 0
+        result[covered] = direct[covered]
+        del bad, good_sum, good_min, direct
+
+    # The regions where the minimum gets accepted by minmed are grown by
+    # 'grow' pixels, so the full combination of each covered region needs
+    # to include that many pixels around it. Pixels with a known result are
+    # not affected by this, and do not affect any other pixel either.
+    grow = combine_pars['grow'] if 'minmed' in comb_type else 0
+    boxsize = 2 * grow + 1
+    nrows = coverage.shape[0]
+
+    full_rows = ndimage.maximum_filter1d(np.any(full, axis=1), boxsize,
+                                         mode='constant', cval=0)
+    for r1, r2 in _true_runs(full_rows):
+        full_cols = ndimage.maximum_filter1d(np.any(full[r1:r2], axis=0),
+                                             boxsize, mode='constant', cval=0)
+        # minmed needs at least as many rows as the size of its boxcar:
+        b1 = max(min(r1, r2 - boxsize), 0)
+        b2 = min(max(r2, b1 + boxsize), nrows)
+
+        for c1, c2 in _true_runs(full_cols):
+            box = (slice(None), slice(b1, b2), slice(c1, c2))
+            combined = _combine_stack(images[box], weights[box], masks[box],
+                                      combine_pars)
+            result[r1:r2, c1:c2] = combined[r1 - b1:r2 - b1]
+
+    return result
+
+
+def _true_runs(flags):
+    """ Return the (start, stop) ranges of the runs of `True` values in a
+    1D boolean array.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], flags, [0]))
+                                   .astype(np.int8)))
+    return zip(edges[::2], edges[1::2])
+
+
+def _combine_stack(imdrizSectionsList, weightSectionsList, weight_mask_list,
+                   combine_pars):
+    """ Run the combination selected by ``combine_pars['comb_type']`` over
+    stacked sections of the single drizzled images.
+    """
+    comb_type = combine_pars['comb_type']
+
+    if 'minmed' in comb_type:  # Do MINMED
+        # set up use of 'imedian'/'imean' in minmed algorithm
+        fillval = comb_type.startswith('i')
+
+        # Create the combined array object using the minmed algorithm
+        result = min_med(
+            imdrizSectionsList,
+            weightSectionsList,
+            combine_pars['readnoise'],
+            combine_pars['exptime'],
+            combine_pars['background'],
+            weight_masks=weight_mask_list,
+            combine_grow=combine_pars['grow'],
+            combine_nsigma1=combine_pars['nsigma1'],
+            combine_nsigma2=combine_pars['nsigma2'],
+            fillval=fillval
+        )
+
+    else:  # DO NUMCOMBINE
+        # numcombine needs a writeable, contiguous stack, unlike the
+        # read-only views of a memory-mapped stack:
+        if not imdrizSectionsList.flags.writeable:
+            imdrizSectionsList = np.array(imdrizSectionsList)
+
+        # Create the combined array object using the numcombine task
+        result = numcombine.num_combine(
+            imdrizSectionsList,
+            masks=weight_mask_list,
+            combination_type=comb_type,
+            nlow=combine_pars['nlow'],
+            nhigh=combine_pars['nhigh'],
+            upper=combine_pars['hthresh'],
+            lower=combine_pars['lthresh']
+        )
+
+    return result
+
+
+def _stream_section(e1, e2, singleDrizList, singleWeightList, combine_pars):
+    """ Compute the approximate median of rows ``e1`` to ``e2`` (excluded) of
+    the single drizzled images, reading them in one at a time instead of
+    stacking them.
+    """
+    use_masks = combine_pars['newmasks'] and len(singleWeightList) > 0
+
+    def read_inputs():
+        for k, w in enumerate(singleDrizList):
+            if use_masks:
+                mask = np.less(singleWeightList[k][e1:e2],
+                               combine_pars['wht_mean'][k])
+            else:
+                mask = None
+            yield w[e1:e2], mask
+
+    return approx_median(
+        read_inputs,
+        (e2 - e1, combine_pars['shape'][1]),
+        nlow=combine_pars['nlow'],
+        nhigh=combine_pars['nhigh'],
+        lower=combine_pars['lthresh'],
+        upper=combine_pars['hthresh']
+    )
+
+
+def _median_sections(sections, shared_median, dtype, singleDrizList,
+                     singleWeightList, combine_pars):
+    """ Combine a band of sections of the single drizzled images, writing
+    the results into the median array shared with the main process. This
+    gets run as a separate process by `_median`.
+    """
+    medianImageArray = _shared_array_view(shared_median, combine_pars['shape'],
+                                          dtype)
+    for e1, e2, u1, u2 in sections:
+        result = _combine_section(e1, e2, singleDrizList, singleWeightList,
+                                  combine_pars)
+        medianImageArray[e1+u1:e1+u2, :] = result[u1:u2, :]
+
+
+def _open_single_stack(stackname, shape):
+    """ Memory-map the stack of single drizzled science and weight images
+    written by the single drizzle step. Returns `None` when there is no such
+    stack or when it does not match the single drizzled images.
+    """
+    if stackname is None or not os.path.isfile(stackname):
+        return None
+
+    try:
+        stack = np.load(stackname, mmap_mode='r')
+    except (IOError, ValueError):
+        log.warning("Unable to read stack of single drizzled images '{}'"
+                    .format(stackname))
+        return None
+
+    if stack.shape != shape:
+        log.warning("Ignoring stack of single drizzled images '{}' with "
+                    "shape {} instead of {}".format(stackname, stack.shape,
+                                                    shape))
+        return None
+
+    return stack
+
+
 def _writeImage(dataArray=None, inputHeader=None):
     """ Writes out the result of the combination step.
         The header of the first 'outsingle' file in the
@@ -11,17 +11,16 @@ import os
 import re
 
 import numpy as np
-from scipy import signal
 from astropy.io import fits
-from stsci.tools import fileutil, logutil, mputil, teal
+from stsci.tools import fileutil, logutil, teal
 
 
+from . import ablot
+from . import outputimage
 from . import quickDeriv
 from . import util
 from . import processInput
 from . version import __version__, __version_date__
-if util.can_parallel:
-    import multiprocessing
 
 
 __taskname__ = "drizzlepac.drizCR"  # looks in drizzlepac for sky.cfg
@@ -52,7 +51,8 @@ def run(configObj):
     rundrizCR(imgObjList, configObj)
 
 
-def rundrizCR(imgObjList, configObj, procSteps=None):
+def rundrizCR(imgObjList, configObj, procSteps=None, output_wcs=None,
+              wcsmap=None):
     if procSteps is not None:
         procSteps.addStep('Driz_CR')
 
@@ -68,37 +68,59 @@ def rundrizCR(imgObjList, configObj, procSteps=None):
     log.info("USER INPUT PARAMETERS for Driz_CR Step:")
     util.printParams(paramDict, log=log)
 
+    # the blotted images get reused only if blotted with the same parameters
+    paramDict['blot_pars'] = ablot.buildBlotParamDict(configObj)
+
     # if we have the cpus and s/w, ok, but still allow user to set pool size
     pool_size = util.get_pool_size(configObj.get('num_cores'), len(imgObjList))
-    if imgObjList[0].inmemory:
-        pool_size = 1  # reason why is output in drizzle step
 
-    subprocs = []
+    # Blot each chip right before looking for cosmic rays in it, instead
+    # of reading it back from the blot step, when both steps get run
+    # together. The blotted chips then only get written out when the
+    # intermediate products are being kept.
+    blotDict = None
+    if output_wcs is not None and ablot._blot_in_driz_cr(configObj):
+        # split each blot call across threads using any remaining cores
+        ncores = util.get_pool_size(configObj.get('num_cores'), None)
+        blotDict = {
+            'pars': ablot.buildBlotParamDict(configObj),
+            'clean': configObj['STATE OF INPUT FILES']['clean'],
+            'median': ablot._read_median(imgObjList[0]),
+            'output_wcs': output_wcs.single_wcs,
+            'wcsmap': wcsmap,
+            'versions': ablot._blot_versions(),
+            'nthreads': max(ncores // pool_size, 1)
+        }
+
+        log.info('Blotting the chips within the Driz_CR step')
+        for image in imgObjList:
+            for chip in image.returnAllChips(extname=image.scienceExt):
+                chip.outputNames['driz_version'] = __version__
+
     if pool_size > 1:
         log.info('Executing {:d} parallel workers'.format(pool_size))
+        pool = util.get_worker_pool(configObj.get('num_cores'))
+        if imgObjList[0].inmemory:
+            # the CR masks get passed back using shared memory
+            for image in imgObjList:
+                image.virtualOutputs.share(pool.manager)
+        tasks = [(image, image.virtualOutputs, paramDict.dict(), blotDict)
+                 for image in imgObjList]
+        pool.run(_driz_cr, tasks, name='drizCR._driz_cr()',
+                 pool_size=pool_size)  # blocks till all done
         for image in imgObjList:
-            manager = multiprocessing.Manager()
-            mgr = manager.dict({})
-
-            p = multiprocessing.Process(
-                target=_driz_cr,
-                name='drizCR._driz_cr()',  # for err msgs
-                args=(image, mgr, paramDict.dict())
-            )
-            subprocs.append(p)
-            image.virtualOutputs.update(mgr)
-        mputil.launch_and_wait(subprocs, pool_size)  # blocks till all done
+            image.virtualOutputs.collect()
 
     else:
         log.info('Executing serially')
         for image in imgObjList:
-            _driz_cr(image, image.virtualOutputs, paramDict)
+            _driz_cr(image, image.virtualOutputs, paramDict, blotDict)
 
     if procSteps is not None:
         procSteps.endStep('Driz_CR')
 
 
-def _driz_cr(sciImage, virtual_outputs, paramDict):
+def _driz_cr(sciImage, virtual_outputs, paramDict, blotDict=None):
     """mask blemishes in dithered data by comparison of an image
     with a model image and the derivative of the model image.
 
@@ -111,6 +133,9 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
         ``configObj`` instance
     - ``dqMask`` is inferred from the ``sciImage`` object, the name of the mask
         file to combine with the generated Cosmic ray mask
+    - ``blotDict``, if given, contains the blot parameters along with the
+        median image and its WCS, for blotting each chip here instead of
+        reading in its blotted image
 
     Here are the options you can override in ``configObj``
 
@@ -136,8 +161,30 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
     """
     grow = paramDict["driz_cr_grow"]
     ctegrow = paramDict["driz_cr_ctegrow"]
-    crcorr_list = []
-    cr_mask_dict = {}
+
+    # parse out the SNR information
+    snr = tuple(map(
+        float, filter(None, re.split("[,;\s]+", paramDict["driz_cr_snr"]))
+    ))
+
+    # parse out the scaling information
+    mult = tuple(map(
+        float, filter(None, re.split("[,;\s]+", paramDict["driz_cr_scale"]))
+    ))
+
+    # The cleaned chips get written out to the _crclean file as soon as
+    # each one is done, rather than all of them at the end.
+    if paramDict['driz_cr_corr']:
+        createCorrFile(sciImage.outputNames["crcorImage"], [],
+                       sciImage._filename)
+
+    # The derivative of each blotted image can be saved next to it, and
+    # reused along with the blotted image itself by later runs, as long as
+    # they are newer than the median image they were computed from and
+    # were blotted with the same parameters.
+    use_cache = paramDict.get('driz_cr_cache', False) and not sciImage.inmemory
+    median_name = fileutil.parseFilename(sciImage.outputNames['outMedian'])[0]
+    blot_pars = paramDict.get('blot_pars')
 
     for chip in range(1, sciImage._numchips + 1, 1):
         exten = sciImage.scienceExt + ',' + str(chip)
@@ -147,8 +194,29 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
             continue
 
         blot_image_name = sci_chip.outputNames['blotImage']
-
-        if sciImage.inmemory:
+        deriv_image_name = sci_chip.outputNames['blotDeriv']
+        blot_deriv = None
+
+        if (use_cache and
+                _is_current(blot_image_name, median_name,
+                            blot_pars=blot_pars) and
+                _is_current(deriv_image_name, blot_image_name,
+                            blot_pars=blot_pars)):
+            print("Reusing blotted image '{:s}' and its derivative '{:s}'"
+                  .format(blot_image_name, deriv_image_name))
+            blot_data = fits.getdata(blot_image_name, ext=0)
+            blot_deriv = fits.getdata(deriv_image_name, ext=0)
+
+        elif blotDict is not None:
+            blot_data = ablot.blot_chip(
+                sci_chip, blotDict['median'], blotDict['output_wcs'],
+                blotDict['pars'], wcsmap=blotDict['wcsmap'],
+                nthreads=blotDict['nthreads']
+            )
+            if not blotDict['clean']:
+                ablot.write_blot_chip(sciImage, sci_chip, blot_data,
+                                      blotDict['pars'], blotDict['versions'])
+        elif sciImage.inmemory:
             blot_data = sciImage.virtualOutputs[blot_image_name][0].data
         else:
             if not os.path.isfile(blot_image_name):
@@ -163,120 +231,69 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
         # Scale blot image, as needed, to match original input data units.
         blot_data *= sci_chip._conversionFactor
 
+        if use_cache and blot_deriv is None:
+            # make the derivative blot image, and save it for later runs
+            blot_deriv = quickDeriv.qderiv(blot_data)
+            if os.path.isfile(deriv_image_name):
+                os.remove(deriv_image_name)
+            print("Creating output: {:s}".format(deriv_image_name))
+            deriv_header = None
+            if blot_pars is not None:
+                deriv_header = fits.Header()
+                outputimage.addBlotKeywords(deriv_header, blot_pars)
+            util.createFile(blot_deriv, outfile=deriv_image_name,
+                            header=deriv_header)
+
         input_image = sciImage.getData(exten)
 
         # Apply any unit conversions to input image here for comparison
         # with blotted image in units of electrons
         input_image *= sci_chip._conversionFactor
 
-        # make the derivative blot image
-        blot_deriv = quickDeriv.qderiv(blot_data)
-
         # Boolean mask needs to take into account any crbits values
         # specified by the user to be ignored when converting DQ array.
         dq_mask = sciImage.buildMask(chip, paramDict['crbit'])
 
-        # parse out the SNR information
-        snr1, snr2 = map(
-            float, filter(None, re.split("[,;\s]+", paramDict["driz_cr_snr"]))
-        )
-
-        # parse out the scaling information
-        mult1, mult2 = map(
-            float, filter(
-                None, re.split("[,;\s]+", paramDict["driz_cr_scale"])
-            )
-        )
-
         gain = sci_chip._effGain
         rn = sci_chip._rdnoise
         backg = sci_chip.subtractedSky * sci_chip._conversionFactor
 
-        # Set scaling factor (used by MultiDrizzle) to 1 since scaling has
-        # already been accounted for in blotted image
-        # expmult = 1.
-
-        # #################   COMPUTATION PART I    ###################
-        # Create a temporary array mask
-        t1 = np.absolute(input_image - blot_data)
-        # ta = np.sqrt(gain * np.abs((blot_data + backg) * expmult) + rn**2)
-        ta = np.sqrt(gain * np.abs(blot_data + backg) + rn**2)
-        t2 = (mult1 * blot_deriv + snr1 * ta / gain)  # / expmult
-        tmp1 = t1 <= t2
-
-        # Create a convolution kernel that is 3 x 3 of 1's
-        kernel = np.ones((3, 3), dtype=np.uint16)
-        # Convolve the mask with the kernel
-        tmp2 = signal.convolve2d(tmp1, kernel, boundary='symm', mode='same')
-
-        # #################   COMPUTATION PART II    ###################
-        # Create the CR Mask
-        t2 = (mult2 * blot_deriv + snr2 * ta / gain)  # / expmult
-        cr_mask = (t1 <= t2) | (tmp2 >= 9)
-
-        # #################   COMPUTATION PART III    ##################
-        # flag additional cte 'radial' and 'tail' pixels surrounding CR pixels
-        # as CRs
-
-        # In both the 'radial' and 'length' kernels below, 0->good and 1->bad,
-        # so that upon convolving the kernels with cr_mask, the convolution
-        # output will have low->bad and high->good from which 2 new arrays are
-        # created having 0->bad and 1->good. These 2 new arrays are then
-        # 'anded' to create a new cr_mask.
-
-        # make radial convolution kernel and convolve it with original cr_mask
-        cr_grow_kernel = np.ones((grow, grow), dtype=np.uint16)
-        cr_grow_kernel_conv = signal.convolve2d(
-            cr_mask, cr_grow_kernel, boundary='symm', mode='same'
-        )
-
-        # make tail convolution kernel and convolve it with original cr_mask
-        cr_ctegrow_kernel = np.zeros((2 * ctegrow + 1, 2 * ctegrow + 1))
-
-        # which pixels are masked by tail kernel depends on sign of
-        # sci_chip.cte_dir (i.e.,readout direction):
-        if sci_chip.cte_dir == 1:
-            # 'positive' direction:  HRC: amp C or D; WFC: chip = sci,1; WFPC2
-            cr_ctegrow_kernel[0:ctegrow, ctegrow] = 1
-        elif sci_chip.cte_dir == -1:
-            # 'negative' direction:  HRC: amp A or B; WFC: chip = sci,2
-            cr_ctegrow_kernel[ctegrow+1:2*ctegrow+1, ctegrow] = 1
-
-        # do the convolution
-        cr_ctegrow_kernel_conv = signal.convolve2d(
-            cr_mask, cr_ctegrow_kernel, boundary='symm', mode='same'
+        # Compute the CR mask over sections of rows of the chip, to limit
+        # the size of the temporary arrays
+        ny, nx = input_image.shape
+        nrows = _section_rows(paramDict.get('driz_cr_bufsize'), nx, ny)
+        cr_mask = _cr_mask_sections(
+            input_image, blot_data, backg, gain, rn, snr, mult, grow,
+            ctegrow, sci_chip.cte_dir, nrows, blot_deriv=blot_deriv
         )
 
-        # select high pixels from both convolution outputs;
-        # then 'and' them to create new cr_mask
-        cr_grow_mask = cr_grow_kernel_conv >= grow**2  # radial
-        cr_ctegrow_mask = cr_ctegrow_kernel_conv >= ctegrow  # length
-        cr_mask = cr_grow_mask & cr_ctegrow_mask
-
         # Apply CR mask to the DQ array in place
-        dq_mask &= cr_mask
-
-        # Create the corr file
-        corrFile = np.where(dq_mask, input_image, blot_data)
-        corrFile /= sci_chip._conversionFactor
-        corrDQMask = np.where(dq_mask, 0, paramDict['crbit']).astype(np.uint16)
+        dq_mask &= cr_mask.view(bool)
 
         if paramDict['driz_cr_corr']:
-            crcorr_list.append({
+            # Create the corr file
+            corrFile = np.where(dq_mask, input_image, blot_data)
+            corrFile /= sci_chip._conversionFactor
+            corrDQMask = np.where(
+                dq_mask, 0, paramDict['crbit']
+            ).astype(np.uint16)
+
+            _update_corr_file(sciImage.outputNames["crcorImage"], {
                 'sciext': fileutil.parseExtn(exten),
-                'corrFile': corrFile.copy(),
+                'corrFile': corrFile,
                 'dqext': fileutil.parseExtn(sci_chip.dq_extn),
                 'dqMask': corrDQMask
             })
+            del corrFile, corrDQMask
+
+        del blot_data, blot_deriv, input_image, dq_mask
 
         # Save the cosmic ray mask file to disk
         cr_mask_image = sci_chip.outputNames["crmaskImage"]
         if paramDict['inmemory']:
             print('Creating in-memory(virtual) FITS file...')
-            _pf = util.createFile(cr_mask.astype(np.uint8),
-                                  outfile=None, header=None)
-            cr_mask_dict[cr_mask_image] = _pf
-            sciImage.saveVirtualOutputs(cr_mask_dict)
+            _pf = util.createFile(cr_mask, outfile=None, header=None)
+            sciImage.saveVirtualOutputs({cr_mask_image: _pf})
 
         else:
             # Always write out crmaskimage, as it is required input for
@@ -289,12 +306,148 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
                 print("Removed old cosmic ray mask file: '{:s}'"
                       .format(cr_mask_image))
             print("Creating output: {:s}".format(cr_mask_image))
-            util.createFile(cr_mask.astype(np.uint8),
-                            outfile=cr_mask_image, header=None)
+            util.createFile(cr_mask, outfile=cr_mask_image, header=None)
 
-    if paramDict['driz_cr_corr']:
-        createCorrFile(sciImage.outputNames["crcorImage"], crcorr_list,
-                       sciImage._filename)
+
+def _section_rows(bufsizeMB, nx, ny):
+    """ Return the number of rows of a chip to process at a time, for
+    float32 sections of about ``bufsizeMB`` MB, or all of them if `None`.
+    """
+    if bufsizeMB is None:
+        return ny
+    nbytes = int(bufsizeMB * 1024 * 1024)
+    return min(max(nbytes // (4 * nx), 1), ny)
+
+
+def _cr_mask_sections(input_image, blot_data, backg, gain, rn, snr, mult,
+                      grow, ctegrow, cte_dir, nrows, blot_deriv=None):
+    """ Compute the CR mask (as uint8, 0 for CRs) of a chip by sections of
+    ``nrows`` rows, giving the same result as `_cr_mask` for the whole chip.
+    """
+    # Number of rows needed on either side of each section of a chip for
+    # computing the derivative and growing the CR mask within the section
+    halo = 3 + max(grow, ctegrow, 0)
+
+    ny = input_image.shape[0]
+    cr_mask = np.empty(input_image.shape, dtype=np.uint8)
+    for y1 in range(0, ny, nrows):
+        y2 = min(y1 + nrows, ny)
+        h1 = max(y1 - halo, 0)
+        h2 = min(y2 + halo, ny)
+        section_mask = _cr_mask(
+            input_image[h1:h2], blot_data[h1:h2], backg, gain, rn, snr,
+            mult, grow, ctegrow, cte_dir,
+            blot_deriv=None if blot_deriv is None else blot_deriv[h1:h2]
+        )
+        cr_mask[y1:y2] = section_mask[y1 - h1:y2 - h1]
+        del section_mask
+
+    return cr_mask
+
+
+def _cr_mask(input_image, blot_data, backg, gain, rn, snr, mult, grow,
+             ctegrow, cte_dir, blot_deriv=None):
+    """ Compute the CR mask (0 for CRs) of a chip, or of a section of its
+    rows, from its input image and blotted image in units of electrons,
+    along with the derivative of the blotted image, if already computed.
+    """
+    snr1, snr2 = snr
+    mult1, mult2 = mult
+
+    # make the derivative blot image
+    if blot_deriv is None:
+        blot_deriv = quickDeriv.qderiv(blot_data)
+
+    # Set scaling factor (used by MultiDrizzle) to 1 since scaling has
+    # already been accounted for in blotted image
+    # expmult = 1.
+
+    # #################   COMPUTATION PART I    ###################
+    # Create a temporary array mask
+    t1 = np.absolute(input_image - blot_data)
+    # ta = np.sqrt(gain * np.abs((blot_data + backg) * expmult) + rn**2)
+    ta = np.sqrt(gain * np.abs(blot_data + backg) + rn**2)
+    t2 = (mult1 * blot_deriv + snr1 * ta / gain)  # / expmult
+    tmp1 = t1 <= t2
+
+    # Keep the pixels which are not CRs along with all of their 3 x 3
+    # neighbors
+    tmp2 = _all_within(_all_within(tmp1, -1, 1, 0), -1, 1, 1)
+
+    # #################   COMPUTATION PART II    ###################
+    # Create the CR Mask
+    t2 = (mult2 * blot_deriv + snr2 * ta / gain)  # / expmult
+    cr_mask = (t1 <= t2) | tmp2
+    del t1, t2, ta, tmp1, tmp2, blot_deriv
+
+    # #################   COMPUTATION PART III    ##################
+    # flag additional cte 'radial' and 'tail' pixels surrounding CR pixels
+    # as CRs
+
+    # In cr_mask, 0->bad and 1->good, so that a pixel stays good only if
+    # all of the pixels within the 'radial' and 'length' kernels below
+    # are good. Rather than convolving cr_mask with kernels of 1's and
+    # selecting the pixels where the sum matches the number of 1's, this
+    # 'ands' shifted copies of cr_mask along each axis of the kernels.
+    # These 2 new arrays are then 'anded' to create a new cr_mask.
+
+    # radial kernel: grow x grow box
+    if grow > 0:
+        cr_grow_mask = _all_within(
+            _all_within(cr_mask, -(grow // 2), (grow - 1) // 2, 0),
+            -(grow // 2), (grow - 1) // 2, 1
+        )
+    else:
+        cr_grow_mask = np.ones_like(cr_mask)
+
+    # tail kernel: the ctegrow pixels on one side of each pixel along
+    # the columns. Which pixels are masked by the tail kernel depends
+    # on sign of sci_chip.cte_dir (i.e.,readout direction):
+    if ctegrow <= 0:
+        cr_ctegrow_mask = np.ones_like(cr_mask)
+    elif cte_dir == 1:
+        # 'positive' direction:  HRC: amp C or D; WFC: chip = sci,1; WFPC2
+        cr_ctegrow_mask = _all_within(cr_mask, 1, ctegrow, 0)
+    elif cte_dir == -1:
+        # 'negative' direction:  HRC: amp A or B; WFC: chip = sci,2
+        cr_ctegrow_mask = _all_within(cr_mask, -ctegrow, -1, 0)
+    else:
+        cr_ctegrow_mask = np.zeros_like(cr_mask)
+
+    return cr_grow_mask & cr_ctegrow_mask
+
+
+def _all_within(mask, lo, hi, axis):
+    """
+    Return whether all the elements of a boolean ``mask`` within offsets
+    ``lo`` to ``hi`` (inclusive) of each element along the given ``axis``
+    are set. The mask is reflected about its edges, like the 'symm'
+    boundary of ``scipy.signal.convolve2d``.
+
+    This is equivalent to convolving the mask with a line of 1's and
+    selecting the elements where the sum matches the number of 1's, but
+    only takes a few logical 'and' operations over the whole array, with
+    the width of the window covered doubling with each of them.
+    """
+    def shifted(arr, start, stop=None):
+        section = [slice(None)] * arr.ndim
+        section[axis] = slice(start, stop)
+        return arr[tuple(section)]
+
+    pad = [(0, 0)] * mask.ndim
+    pad[axis] = (max(-lo, 0), max(hi, 0))
+    result = np.pad(np.asarray(mask, dtype=bool), pad, mode='symmetric')
+
+    # each element of result covers the 'width' elements starting at it:
+    size = hi - lo + 1
+    width = 1
+    while width < size:
+        step = min(width, size - width)
+        result = shifted(result, 0, -step) & shifted(result, step)
+        width += step
+
+    start = pad[axis][0] + lo
+    return shifted(result, start, start + mask.shape[axis])
 
 
 def createCorrFile(outfile, arrlist, template):
@@ -318,6 +471,37 @@ def createCorrFile(outfile, arrlist, template):
         print("Created CR corrected file: '{:s}'".format(outfile))
 
 
+def _is_current(filename, *sources, blot_pars=None):
+    """ Return whether a file exists and is not older than any of the
+    files it was computed from which still exist. If ``blot_pars`` are
+    given, the blot parameters recorded in its header (see
+    `~drizzlepac.outputimage.BLOT_KEYWORDS`) must also match them.
+    """
+    if not os.path.isfile(filename):
+        return False
+    mtime = os.path.getmtime(filename)
+    for source in sources:
+        if os.path.isfile(source) and os.path.getmtime(source) > mtime:
+            return False
+    if blot_pars is not None:
+        hdr = fits.getheader(filename, ext=0)
+        for kw, kwdict in outputimage.BLOT_KEYWORDS.items():
+            if kw not in hdr or hdr[kw] != blot_pars[kwdict['par']]:
+                return False
+    return True
+
+
+def _update_corr_file(outfile, arr):
+    """
+    Replace the science and DQ arrays of one chip of an existing _cor file,
+    given as an entry like those of the list passed to `createCorrFile`.
+    """
+    with fits.open(outfile, mode='update', memmap=False) as fcorr:
+        fcorr[arr['sciext']].data = arr['corrFile']
+        if arr['dqext'][0] != arr['sciext'][0]:
+            fcorr[arr['dqext']].data = arr['dqMask']
+
+
 def setDefaults(configObj={}):
     """ Return a dictionary of the default parameters
         which also been updated with the user overrides.
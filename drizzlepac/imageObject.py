@@ -58,6 +58,9 @@ class baseImageObject:
         self._nextend=0
         # this is the number of chip which will be combined based on 'group' parameter
         self._nmembers = 0
+        # changes to the headers of the input file waiting to be written out
+        # by flushHeaderUpdates(), as (extension, keyword, value) tuples
+        self._headerUpdates = []
 
     def __getitem__(self,exten):
         """ Overload  getitem to return the data and header
@@ -131,7 +134,7 @@ class baseImageObject:
     def clean(self):
         """ Deletes intermediate products generated for this imageObject.
         """
-        clean_files = ['blotImage','crmaskImage','finalMask',
+        clean_files = ['blotImage','blotDeriv','crmaskImage','finalMask',
                         'staticMask','singleDrizMask','outSky',
                         'outSContext','outSWeight','outSingle',
                         'outMedian','dqmask','tmpmask',
@@ -140,6 +143,7 @@ class baseImageObject:
         log.info('Removing intermediate files for %s' % self._filename)
         # We need to remove the combined products first; namely, median image
         util.removeFileSafely(self.outputNames['outMedian'])
+        util.removeFileSafely(self.outputNames.get('outSStack'))
         # Now remove chip-specific intermediate files, if any were created.
         for chip in self.returnAllChips(extname='SCI'):
             for fname in clean_files:
@@ -236,13 +240,39 @@ class baseImageObject:
         if data is None:
             log.warning("No data supplied")
         else:
-            extnum = _interpretExten(exten)
+            extnum = self._interpretExten(exten)
             ext = self._image[extnum]
             # update the bitpix to the current datatype, this aint fancy and
             # ignores bscale
             ext.header['BITPIX'] = _NUMPY_TO_IRAF_DTYPES[data.dtype.name]
             ext.data = data
 
+    def queueHeaderUpdate(self, exten, keyword, value=None):
+        """ Record a change of a keyword in the header of an extension of
+            the input file, deleting it when ``value`` is None, to be
+            written out with all the others by flushHeaderUpdates().
+        """
+        self._headerUpdates.append((exten, keyword, value))
+
+    def flushHeaderUpdates(self):
+        """ Write out all the header changes recorded by queueHeaderUpdate()
+            to the input file, opening it (in update mode) only once, and
+            only if there are any.
+        """
+        if not self._headerUpdates:
+            return
+        fimg = fileutil.openImage(self._filename, mode='update', memmap=False)
+        for exten, keyword, value in self._headerUpdates:
+            hdr = fimg[exten].header
+            if value is None:
+                if keyword in hdr:
+                    del hdr[keyword]
+            else:
+                hdr[keyword] = value
+        fimg.close()
+        del fimg
+        self._headerUpdates = []
+
     def getAllData(self,extname=None,exclude=None):
         """ This function is meant to make it easier to attach ALL the data
             extensions of the image object so that we can write out copies of
@@ -362,6 +392,7 @@ class baseImageObject:
         outWeight = rootname+suffix+'_wht.fits'
         outContext = rootname+suffix+'_ctx.fits'
         outMedian = rootname+'_med.fits'
+        outSStack = rootname+'_single_stack.npy'
 
         # Build names based on input name
         origFilename = self._filename.replace('.fits','_OrIg.fits')
@@ -375,6 +406,7 @@ class baseImageObject:
             'origFilename': origFilename,
             'outFinal': outFinal,
             'outMedian': outMedian,
+            'outSStack': outSStack,
             'outSci': outSci,
             'outWeight': outWeight,
             'outContext': outContext,
@@ -390,6 +422,7 @@ class baseImageObject:
 
     def _setChipOutputNames(self,rootname,chip):
         blotImage = rootname + '_blt.fits'
+        blotDeriv = rootname + '_blt_deriv.fits'
         crmaskImage = rootname + '_crmask.fits'
 
         # Start with global names
@@ -397,6 +430,7 @@ class baseImageObject:
 
         # Now add chip-specific entries
         fnames['blotImage'] = blotImage
+        fnames['blotDeriv'] = blotDeriv
         fnames['crmaskImage'] = crmaskImage
         sci_chip = self._image[self.scienceExt,chip]
         # Define mask names as additional entries into outputNames dictionary
@@ -418,7 +452,7 @@ class baseImageObject:
         """ Sets up the structure to hold all the output data arrays for
         this image in memory.
         """
-        self.virtualOutputs = {}
+        self.virtualOutputs = util.SharedOutputs()
         for product in self.outputNames:
             self.virtualOutputs[product] = None
 
@@ -462,6 +496,7 @@ class baseImageObject:
 
         outnames = self.outputNames
         outnames['outMedian'] = output_wcs.outputNames['outMedian']
+        outnames['outSStack'] = output_wcs.outputNames['outSStack']
         outnames['outFinal'] = output_wcs.outputNames['outFinal']
         outnames['outSci'] = output_wcs.outputNames['outSci']
         outnames['outWeight'] = output_wcs.outputNames['outWeight']
@@ -1014,12 +1049,10 @@ class imageObject(baseImageObject):
 
         self._isSimpleFits = False
 
-        # Clean out any stray MDRIZSKY keywords from PRIMARY headers
-        fimg = fileutil.openImage(filename, mode='update', memmap=False)
-        if 'MDRIZSKY' in fimg['PRIMARY'].header:
-            del fimg['PRIMARY'].header['MDRIZSKY']
-        fimg.close()
-        del fimg
+        # Clean out any stray MDRIZSKY keywords from PRIMARY headers, only
+        # reopening the file (once all header changes are known) if needed
+        if 'MDRIZSKY' in self._image['PRIMARY'].header:
+            self.queueHeaderUpdate('PRIMARY', 'MDRIZSKY')
 
         if group not in [None,'']:
             # Only use selected chip
@@ -1044,6 +1077,9 @@ class imageObject(baseImageObject):
 
         if not self._isSimpleFits:
 
+            # the same for all chips
+            dqfile, dq_extn = self.find_DQ_extension()
+
             #assign chip specific information
             for chip in range(1,self._numchips+1,1):
 
@@ -1063,7 +1099,7 @@ class imageObject(baseImageObject):
                 sci_chip.dqname = None
                 sci_chip.dqmaskname = None
 
-                sci_chip.dqfile,sci_chip.dq_extn = self.find_DQ_extension()
+                sci_chip.dqfile,sci_chip.dq_extn = dqfile,dq_extn
                 #self.maskExt = sci_chip.dq_extn
                 if(sci_chip.dqfile is not None):
                     sci_chip.dqname = sci_chip.dqfile +'['+sci_chip.dq_extn+','+str(chip)+']'
@@ -1141,6 +1177,8 @@ class imageObject(baseImageObject):
                     # read image data array into memory
                     shape = sci_chip.data.shape
 
+        self.flushHeaderUpdates()
+
     def setInstrumentParameters(self,instrpars):
         """ Define instrument-specific parameters for use in the code.
             By definition, this definition will need to be overridden by
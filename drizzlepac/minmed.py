@@ -26,10 +26,14 @@ or median image based up bad pixel identification.
 #        code up to modern standards.-- Mihai Cara -- 02/19/2018
 import warnings
 import numpy as np
-from scipy import signal
+from scipy import ndimage, signal
 from stsci.image.numcombine import numCombine, num_combine
 from .version import *
 
+# Default size (in bytes) of the blocks of the input stack combined at once
+# by `min_med`:
+BLOCK_SIZE = 4 * 1024 * 1024
+
 class minmed:
     """ **DEPRECATED** Create a median array, rejecting the highest pixel and
     computing the lowest valid pixel after mask application
@@ -348,7 +352,8 @@ class minmed:
 
 def min_med(images, weight_images, readnoise_list, exptime_list,
             background_values, weight_masks=None, combine_grow=1,
-            combine_nsigma1=4, combine_nsigma2=3, fillval=False):
+            combine_nsigma1=4, combine_nsigma2=3, fillval=False,
+            block_rows=None):
     """ Create a median array, rejecting the highest pixel and
     computing the lowest valid pixel after mask application.
 
@@ -356,6 +361,12 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
         In this version of the mimmed algorithm we assume that the units of
         all input data is electons.
 
+    The input stack gets processed in blocks of rows, computing all the
+    intermediate arrays for one block before moving on to the next one, so
+    that these only need to be as large as a block instead of as the whole
+    image. Blocks overlap by ``combine_grow`` rows for the neighbor
+    rejection, giving the same result as processing the whole image at once.
+
     Parameters
     ----------
     images : list of numpy.ndarray
@@ -389,11 +400,103 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
     fillval : bool
         Turn on use of imedian/imean. (Default: `False`)
 
+    block_rows : int, None
+        Number of rows of the input stack to process at once. When `None`,
+        blocks of about `BLOCK_SIZE` bytes of the input stack get used.
+        (Default: `None`)
+
     Returns
     -------
     combined_array : numpy.ndarray
         Combined array.
 
+    """
+    images = np.asarray(images)
+    weight_images = np.asarray(weight_images)
+
+    if weight_masks is None or len(weight_masks) == 0:
+        weight_masks = None
+    else:
+        weight_masks = np.asarray(weight_masks, dtype=bool)
+
+    if combine_grow != 0:
+        # The box size value must be an integer. This is not a problem since
+        # __combine_grow should always be an integer type. The combine_grow
+        # column in the MDRIZTAB should also be an integer type.
+        boxsize = int(2 * combine_grow + 1)
+
+        # The boxcar used to grow the rejection fails for two reasons:
+        #   1) The kernel size for the boxcar is bigger than the actual image.
+        #   2) The grow parameter was specified with a value < 0.  This would
+        #      result in an illegal boxshape kernel. The dimensions of the
+        #      kernel box *MUST* be integer and greater than zero.
+        #
+        #   Try to give a meaningfull explanation as to why based upon the
+        #   conditionals described above.
+        if boxsize <= 0:
+            errormsg1 = "############################################################\n"
+            errormsg1 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
+            errormsg1 += "# parameter must be greater than or equal to zero. You     #\n"
+            errormsg1 += "# specified an input value for the 'grow' parameter of:    #\n"
+            errormsg1 += "        combine_grow: " + str(combine_grow)+'\n'
+            errormsg1 += "############################################################\n"
+            raise ValueError(errormsg1)
+
+        if boxsize > images.shape[1]:
+            errormsg2 = "############################################################\n"
+            errormsg2 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
+            errormsg2 += "# parameter specified has resulted in a boxcar kernel that #\n"
+            errormsg2 += "# has dimensions larger than the actual image.  You        #\n"
+            errormsg2 += "# specified an input value for the 'grow' parameter of:    #\n"
+            errormsg2 += "        combine_grow: " + str(combine_grow) + '\n'
+            errormsg2 += "############################################################\n"
+            print(images.shape[1:])
+            raise ValueError(errormsg2)
+
+    else:
+        boxsize = 0
+
+    nimages, nrows, ncols = images.shape
+    if block_rows is None:
+        block_rows = BLOCK_SIZE // max(nimages * ncols * images.itemsize, 1)
+    block_rows = max(int(block_rows), 1)
+    halo = boxsize // 2
+
+    combined_array = None
+
+    for b1 in range(0, nrows, block_rows):
+        b2 = min(b1 + block_rows, nrows)
+
+        # include the rows needed for growing the rejection into the block:
+        x1 = max(b1 - halo, 0)
+        x2 = min(b2 + halo, nrows)
+
+        block = _min_med_rows(
+            images[:, x1:x2],
+            weight_images[:, x1:x2],
+            readnoise_list,
+            exptime_list,
+            background_values,
+            None if weight_masks is None else weight_masks[:, x1:x2],
+            boxsize,
+            combine_nsigma1,
+            combine_nsigma2,
+            fillval
+        )
+
+        if combined_array is None:
+            combined_array = np.empty((nrows, ncols), dtype=block.dtype)
+        combined_array[b1:b2] = block[b1 - x1:b2 - x1]
+
+    return combined_array
+
+
+def _min_med_rows(images, weight_images, readnoise_list, exptime_list,
+                  background_values, weight_masks, boxsize, combine_nsigma1,
+                  combine_nsigma2, fillval):
+    """ Compute the minmed combination of a block of rows of the input
+    stack for `min_med`, growing the regions where the minimum gets
+    accepted by a boxcar of ``boxsize`` pixels, unless ``boxsize`` is 0.
     """
     # In this case we want to calculate two things:
     #   1) the median array, rejecting the highest pixel (thus running
@@ -418,16 +521,17 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
 
     nimages = len(images)
     combtype_median = 'imedian' if fillval else 'median'
-    images = np.asarray(images)
-    weight_images = np.asarray(weight_images)
 
-    if weight_masks == [] or weight_masks is None:
-        weight_masks = None
+    # num_combine needs a writeable block, unlike read-only (memory-mapped)
+    # views of the input stack:
+    if not images.flags.writeable:
+        images = np.array(images)
+
+    if weight_masks is None:
         mask_sum = np.zeros(images.shape[1:], dtype=np.int16)
-        all_bad_idx = np.array([], dtype=np.int)
-        all_bad_idy = np.array([], dtype=np.int)
+        all_bad_idx = np.array([], dtype=int)
+        all_bad_idy = np.array([], dtype=int)
     else:
-        weight_masks = np.asarray(weight_masks, dtype=np.bool)
         mask_sum = np.sum(weight_masks, axis=0, dtype=np.int16)
         all_bad_idx, all_bad_idy = np.where(mask_sum == nimages)
 
@@ -543,13 +647,13 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
         np.zeros_like(median_file_weighted)
     )
     rms_file = np.sqrt(rms_file2)
-    del bkgd_file, readnoise_file
+    del bkgd_file, readnoise_file, rms_file2
 
     # For the median array, calculate the n-sigma lower threshold to the array
     # and incorporate that into the pixel values.
     median_rms_file = median_file_weighted - rms_file * combine_nsigma1
 
-    if combine_grow != 0:
+    if boxsize > 0:
         # Do a more sophisticated rejection: For all cases where the minimum
         # pixel will be accepted instead of the median, set a lower threshold
         # for that pixel and the ones around it (ie become less conservative
@@ -562,63 +666,28 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
         # This is done as follows:
         # 1) make an image which is zero everywhere except where the minimum
         #    will be accepted
-        # 2) box-car smooth this image, to make these regions grow.
+        # 2) grow these regions by the size of the box-car, that is, flag
+        #    every pixel with any flagged pixel within the box around it
+        #    (where a box-car smoothed image would be non-zero).
         # 3) In the file "median_rms_file_electrons", replace these pixels
         #     by median - combine_nsigma2 * rms
         #
         # Then use this image in the final replacement, in the same way as for
         # the case where this option is not selected.
-        minimum_flag_file = np.less(minimum_file_weighted,
-                                    median_rms_file).astype(np.float64)
-
-        # The box size value must be an integer. This is not a problem since
-        # __combine_grow should always be an integer type. The combine_grow
-        # column in the MDRIZTAB should also be an integer type.
-        boxsize = int(2 * combine_grow + 1)
-        boxshape = (boxsize, boxsize)
-        minimum_grow_file = np.zeros_like(images[0])
-
-        # If the boxcar convolution has failed it is potentially for
-        # two reasons:
-        #   1) The kernel size for the boxcar is bigger than the actual image.
-        #   2) The grow parameter was specified with a value < 0.  This would
-        #      result in an illegal boxshape kernel. The dimensions of the
-        #      kernel box *MUST* be integer and greater than zero.
-        #
-        #   If the boxcar convolution has failed, try to give a meaningfull
-        #   explanation as to why based upon the conditionals described above.
-        if boxsize <= 0:
-            errormsg1 = "############################################################\n"
-            errormsg1 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
-            errormsg1 += "# parameter must be greater than or equal to zero. You     #\n"
-            errormsg1 += "# specified an input value for the 'grow' parameter of:    #\n"
-            errormsg1 += "        combine_grow: " + str(combine_grow)+'\n'
-            errormsg1 += "############################################################\n"
-            raise ValueError(errormsg1)
-
-        if boxsize > images.shape[1]:
-            errormsg2 = "############################################################\n"
-            errormsg2 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
-            errormsg2 += "# parameter specified has resulted in a boxcar kernel that #\n"
-            errormsg2 += "# has dimensions larger than the actual image.  You        #\n"
-            errormsg2 += "# specified an input value for the 'grow' parameter of:    #\n"
-            errormsg2 += "        combine_grow: " + str(combine_grow) + '\n'
-            errormsg2 += "############################################################\n"
-            print(images.shape[1:])
-            raise ValueError(errormsg2)
-
-        # Attempt the boxcar convolution using the boxshape based upon the user
-        # input value of "grow"
-        ker = np.ones((boxsize, boxsize)) / float(boxsize**2)
-        minimum_grow_file = signal.convolve2d(minimum_flag_file, ker,
-                                              boundary='fill', mode='same')
+        minimum_flag_file = np.less(minimum_file_weighted, median_rms_file)
+        minimum_grow_file = ndimage.maximum_filter(
+            minimum_flag_file, size=boxsize, mode='constant', cval=0
+        )
+        del minimum_flag_file
 
         median_rms_file = np.where(
-            np.equal(minimum_grow_file, 0),
-            median_file_weighted - rms_file * combine_nsigma1,
-            median_file_weighted - rms_file * combine_nsigma2
+            minimum_grow_file,
+            median_file_weighted - rms_file * combine_nsigma2,
+            median_rms_file
         )
-        del rms_file, minimum_grow_file
+        del minimum_grow_file
+
+    del rms_file
 
     # Finally decide whether to use the minimim or the median (in counts/s),
     # based on whether the median is more than 3 sigma above the minimum.
@@ -6,6 +6,7 @@ This module manages the creation of the output image FITS file.
 :License: :doc:`LICENSE`
 
 """
+import numpy as np
 from astropy.io import fits
 from stsci.tools import fileutil, readgeis, logutil
 
@@ -49,6 +50,15 @@ DRIZ_KEYWORDS = {
                 'WKEY':{'value':"",'comment':'Input image WCS Version used'}
                 }
 
+# Keywords recording the blot parameters in the blotted images, along with
+# the name of the parameter each of them records
+BLOT_KEYWORDS = {
+                'BLOTINTP':{'par':'blot_interp','comment':'Blot, form of interpolation'},
+                'BLOTSINC':{'par':'blot_sinscl','comment':'Blot, scale for sinc interpolation kernel'},
+                'BLOTADSK':{'par':'blot_addsky','comment':'Blot, sky (MDRIZSKY) added back?'},
+                'BLOTSKYV':{'par':'blot_skyval','comment':'Blot, custom sky value added back'}
+                }
+
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
 
@@ -103,6 +113,7 @@ class OutputImage:
         self.bunit = None
         self.units = 'cps'
         self.blot = blot
+        self.previous = None
 
         if PYFITS_COMPRESSION and 'compress' in input_pars:
             self.compress = input_pars['compress'] # Control creation of compressed FITS files
@@ -171,6 +182,19 @@ class OutputImage:
         """
         self.units = units
 
+    def set_previous(self,hdr):
+        """
+        Method used to record the header of the existing product the inputs
+        were drizzled onto, so that its drizzle keywords get carried over.
+        """
+        self.previous = hdr
+
+    def _num_previous(self):
+        """ Number of images already drizzled onto the previous product. """
+        if self.previous is None:
+            return 0
+        return self.previous.get('NDRIZIM', 0)
+
     def writeFITS(self, template, sciarr, whtarr, ctxarr=None,
                 versions=None, overwrite=yes, blend=True, virtual=False):
         """
@@ -288,7 +312,7 @@ class OutputImage:
         if 'DITHCORR' in prihdu.header:
             prihdu.header['DITHCORR'] = 'COMPLETE'
 
-        prihdu.header['NDRIZIM'] =(len(self.parlist),
+        prihdu.header['NDRIZIM'] =(len(self.parlist) + self._num_previous(),
                                    'Drizzle, No. images drizzled onto output')
 
         # Only a subset of these keywords makes sense for the new WCS based
@@ -296,6 +320,8 @@ class OutputImage:
         # and what to leave out.
         if not self.blot:
             self.addDrizKeywords(prihdu.header,versions)
+        else:
+            addBlotKeywords(prihdu.header,self.input_pars)
 
         if scihdr:
             try:
@@ -372,7 +398,7 @@ class OutputImage:
 
             # Build CTX extension here
             # If there is only 1 plane, write it out as a 2-D extension
-            if self.outcontext:
+            if self.outcontext and not isinstance(ctxarr, SparseContext):
                 if ctxarr.shape[0] == 1:
                     _ctxarr = ctxarr[0]
                 else:
@@ -380,7 +406,9 @@ class OutputImage:
             else:
                 _ctxarr = None
 
-            if self.single and self.compress:
+            if self.outcontext and isinstance(ctxarr, SparseContext):
+                hdu = ctxarr.to_hdu(header=dqhdr, name=EXTLIST[2])
+            elif self.single and self.compress:
                 hdu = fits.CompImageHDU(data=_ctxarr, header=dqhdr, name=EXTLIST[2])
             else:
                 hdu = fits.ImageHDU(data=_ctxarr, header=dqhdr, name=EXTLIST[2])
@@ -510,17 +538,24 @@ class OutputImage:
             # for it as well...
             if self.outcontext and ctxarr is not None:
                 fctx = fits.HDUList()
+                ctx_ext = wcs_ext
 
-                # If there is only 1 plane, write it out as a 2-D extension
-                if ctxarr.shape[0] == 1:
-                    _ctxarr = ctxarr[0]
-                else:
-                    _ctxarr = ctxarr
-
-                if self.compress:
-                    hdu = fits.CompImageHDU(data=_ctxarr, header=prihdu.header)
+                if isinstance(ctxarr, SparseContext):
+                    # A table can not be the primary HDU of the file
+                    fctx.append(fits.PrimaryHDU())
+                    hdu = ctxarr.to_hdu(header=prihdu.header)
+                    ctx_ext = [1]
                 else:
-                    hdu = fits.ImageHDU(data=_ctxarr, header=prihdu.header)
+                    # If there is only 1 plane, write it out as a 2-D extension
+                    if ctxarr.shape[0] == 1:
+                        _ctxarr = ctxarr[0]
+                    else:
+                        _ctxarr = ctxarr
+
+                    if self.compress:
+                        hdu = fits.CompImageHDU(data=_ctxarr, header=prihdu.header)
+                    else:
+                        hdu = fits.ImageHDU(data=_ctxarr, header=prihdu.header)
                 # Append remaining unique header keywords from template DQ
                 # header to Primary header...
                 if dqhdr:
@@ -538,7 +573,7 @@ class OutputImage:
 
                 fctx.append(hdu)
                 # remove all alternate WCS solutions from headers of this product
-                wcs_functions.removeAllAltWCS(fctx,wcs_ext)
+                wcs_functions.removeAllAltWCS(fctx,ctx_ext)
                 if not virtual:
                     print('Writing out image to disk:',self.outcontext)
                     fctx.writeto(self.outcontext)
@@ -591,7 +626,14 @@ class OutputImage:
         # Extract some global information for the keywords
         _geom = 'User parameters'
 
-        _imgnum = 0
+        # Keep the keywords of the images drizzled onto a previous product
+        _imgnum = self._num_previous()
+        if _imgnum > 0:
+            for card in self.previous.cards:
+                kw = card.keyword
+                if kw[:1] == 'D' and kw[1:4].isdigit() and 0 < int(kw[1:4]) <= _imgnum:
+                    hdr[kw] = (card.value, card.comment)
+
         for pl in self.parlist:
 
             # Start by building up the keyword prefix based
@@ -696,6 +738,14 @@ def getTemplates(fnames, blend=True):
 
     return newhdrs, newtab
 
+def addBlotKeywords(hdr, pars):
+    """ Add the keywords recording the blot parameters found in ``pars``
+    (see `BLOT_KEYWORDS`) to a header.
+    """
+    for kw, kwdict in BLOT_KEYWORDS.items():
+        if kwdict['par'] in pars:
+            hdr[kw] = (pars[kwdict['par']], kwdict['comment'])
+
 def addWCSKeywords(wcs,hdr,blot=False,single=False,after=None):
     """ Update input header 'hdr' with WCS keywords.
     """
@@ -828,3 +878,149 @@ def writeDrizKeywords(hdr,imgnum,drizdict):
         comment = drizdict[key]['comment']
         if comment is None: comment = ""
         hdr[_keyprefix+key] = (val, drizdict[key]['comment'])
+
+
+class SparseContext:
+    """
+    Context image stored as a set of square blocks, keeping only the
+    blocks which have any bit set.
+
+    The classic context image is a dense ``(nplanes, ny, nx)`` int32 cube
+    with one bit for each input, which for wide mosaics is mostly zeros,
+    since most output pixels only receive a few of the inputs.
+    ``adrizzle.do_driz()`` updates this representation directly, using a
+    dense copy of only the part of the context plane reached by each input.
+
+    The context gets written out by `OutputImage.writeFITS` as a binary
+    table extension (see `to_hdu`), which can be expanded back to the
+    classic cube using `expand_context`.
+    """
+    def __init__(self, shape, block_size=256):
+        self.shape = tuple(int(n) for n in shape)
+        self.block_size = int(block_size)
+        self.dtype = np.dtype(np.int32)
+        self.blocks = {}
+
+    @property
+    def nbytes(self):
+        """ Memory used by all the stored blocks, in bytes. """
+        return sum(blk.nbytes for blk in self.blocks.values())
+
+    def _block_slices(self, y0, y1, x0, x1):
+        """ Yield ``(by, bx, block_slice, window_slice)`` for each block
+        overlapping the ``[y0:y1, x0:x1]`` region of a plane.
+        """
+        b = self.block_size
+        for by in range(y0 // b, (y1 - 1) // b + 1):
+            ya, yb = max(y0, by * b), min(y1, (by + 1) * b)
+            for bx in range(x0 // b, (x1 - 1) // b + 1):
+                xa, xb = max(x0, bx * b), min(x1, (bx + 1) * b)
+                yield (by, bx,
+                       (slice(ya - by * b, yb - by * b), slice(xa - bx * b, xb - bx * b)),
+                       (slice(ya - y0, yb - y0), slice(xa - x0, xb - x0)))
+
+    def get_window(self, plane, y0, y1, x0, x1):
+        """ Return a dense copy of the ``[y0:y1, x0:x1]`` region of a plane. """
+        window = np.zeros((y1 - y0, x1 - x0), dtype=self.dtype)
+        for by, bx, bslice, wslice in self._block_slices(y0, y1, x0, x1):
+            blk = self.blocks.get((plane, by, bx))
+            if blk is not None:
+                window[wslice] = blk[bslice]
+        return window
+
+    def set_window(self, plane, y0, x0, window, combine=False):
+        """ Store a dense ``window`` of a plane, starting at ``(y0, x0)``,
+        either replacing the previous values or, with ``combine``, OR-ing
+        the bits with them.
+        """
+        y1 = y0 + window.shape[0]
+        x1 = x0 + window.shape[1]
+        b = self.block_size
+        for by, bx, bslice, wslice in self._block_slices(y0, y1, x0, x1):
+            blk = self.blocks.get((plane, by, bx))
+            if blk is None:
+                if not window[wslice].any():
+                    continue
+                blk = np.zeros((b, b), dtype=self.dtype)
+                self.blocks[(plane, by, bx)] = blk
+            if combine:
+                np.bitwise_or(blk[bslice], window[wslice], out=blk[bslice])
+            else:
+                blk[bslice] = window[wslice]
+
+    def merge(self, other, y0=0, x0=0):
+        """ Combine (OR) the bits of another `SparseContext`, covering the
+        region of this one starting at ``(y0, x0)``.
+        """
+        b = other.block_size
+        ny, nx = other.shape[1:]
+        for (plane, by, bx), blk in other.blocks.items():
+            window = blk[:min(b, ny - by * b), :min(b, nx - bx * b)]
+            self.set_window(plane, y0 + by * b, x0 + bx * b, window,
+                            combine=True)
+
+    def toarray(self):
+        """ Expand into the classic dense ``(nplanes, ny, nx)`` cube. """
+        cube = np.zeros(self.shape, dtype=self.dtype)
+        b = self.block_size
+        ny, nx = self.shape[1:]
+        for (plane, by, bx), blk in self.blocks.items():
+            hy = min(b, ny - by * b)
+            hx = min(b, nx - bx * b)
+            cube[plane, by * b:by * b + hy, bx * b:bx * b + hx] = blk[:hy, :hx]
+        return cube
+
+    def to_hdu(self, header=None, name='CTX'):
+        """ Return a binary table HDU holding all stored blocks, with one
+        row (``PLANE``, ``YBLOCK``, ``XBLOCK``, ``DATA``) per block.
+        """
+        keys = sorted(self.blocks)
+        b = self.block_size
+        data = np.zeros((len(keys), b, b), dtype=self.dtype)
+        for i, key in enumerate(keys):
+            data[i] = self.blocks[key]
+        keys = np.array(keys, dtype=np.int32).reshape((len(keys), 3))
+
+        cols = [fits.Column(name='PLANE', format='J', array=keys[:, 0]),
+                fits.Column(name='YBLOCK', format='J', array=keys[:, 1]),
+                fits.Column(name='XBLOCK', format='J', array=keys[:, 2]),
+                fits.Column(name='DATA', format='{:d}J'.format(b * b),
+                            dim='({:d},{:d})'.format(b, b), array=data)]
+        hdr = fits.Header() if header is None else header.copy(strip=True)
+        for kw in ['BSCALE', 'BZERO', 'BUNIT']:
+            hdr.remove(kw, ignore_missing=True, remove_all=True)
+        hdu = fits.BinTableHDU.from_columns(cols, header=hdr, name=name)
+        hdu.header['CTXTYPE'] = ('SPARSE', 'Context stored as blocks of pixels')
+        hdu.header['CTXNPLN'] = (self.shape[0], 'Number of context image planes')
+        hdu.header['CTXNAXS1'] = (self.shape[2], 'Size of context image X-axis')
+        hdu.header['CTXNAXS2'] = (self.shape[1], 'Size of context image Y-axis')
+        hdu.header['CTXBLOCK'] = (b, 'Size of context blocks (pixels)')
+        return hdu
+
+    @classmethod
+    def from_hdu(cls, hdu):
+        """ Rebuild a `SparseContext` from the table written by `to_hdu`. """
+        hdr = hdu.header
+        ctx = cls((hdr['CTXNPLN'], hdr['CTXNAXS2'], hdr['CTXNAXS1']),
+                  block_size=hdr['CTXBLOCK'])
+        b = ctx.block_size
+        for plane, by, bx, blk in zip(hdu.data['PLANE'], hdu.data['YBLOCK'],
+                                      hdu.data['XBLOCK'], hdu.data['DATA']):
+            ctx.blocks[(int(plane), int(by), int(bx))] = \
+                np.array(blk, dtype=ctx.dtype).reshape((b, b))
+        return ctx
+
+
+def expand_context(hdu):
+    """ Return the classic context image array from a CTX extension,
+    whether written as an image or as a sparse table (see `SparseContext`).
+    As for the image, a context with a single plane gets returned as a
+    2-D array.
+    """
+    if hdu.header.get('CTXTYPE', '') != 'SPARSE':
+        return hdu.data
+
+    ctxarr = SparseContext.from_hdu(hdu).toarray()
+    if ctxarr.shape[0] == 1:
+        ctxarr = ctxarr[0]
+    return ctxarr
@@ -41,7 +41,7 @@ from astropy.io import fits
 from stwcs import updatewcs as uw
 from stwcs.wcsutil import altwcs, wcscorr
 from stsci.tools import (cfgpars, parseinput, fileutil, asnutil, irafglob,
-                         check_files, logutil, mputil, textutil)
+                         check_files, logutil, textutil)
 try:
     from stsci.tools.bitmask import interpret_bit_flags
 except ImportError:
@@ -58,9 +58,6 @@ log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 # list parameters which correspond to steps where multiprocessing can be used
 parallel_steps = [(3,'driz_separate'),(6,'driz_cr')]
 
-if util.can_parallel:
-    import multiprocessing
-
 
 def setCommonInput(configObj, createOutwcs=True):
     """
@@ -226,8 +223,14 @@ def setCommonInput(configObj, createOutwcs=True):
         # Provide user with some information on resource usage for this run
         # raises ValueError Exception in interactive mode and user quits
         num_cores = configObj.get('num_cores') if use_parallel else 1
-
-        reportResourceUsage(imageObjectList, outwcs, num_cores)
+        final_section = util.getSectionName(configObj, 7)
+        memmap = sparse_ctx = False
+        if final_section is not None:
+            memmap = configObj[final_section].get('final_memmap', False)
+            sparse_ctx = configObj[final_section].get('final_sparse_ctx', False)
+
+        reportResourceUsage(imageObjectList, outwcs, num_cores, memmap=memmap,
+                            sparse_ctx=sparse_ctx)
     except ValueError:
         imageObjectList = None
 
@@ -235,28 +238,48 @@ def setCommonInput(configObj, createOutwcs=True):
 
 
 def reportResourceUsage(imageObjectList, outwcs, num_cores,
-                        interactive=False):
+                        interactive=False, memmap=False, sparse_ctx=False):
     """ Provide some information to the user on the estimated resource
     usage (primarily memory) for this run.
+
+    With ``memmap``, the final drizzle output arrays get kept in scratch
+    files (see the ``final_memmap`` parameter), so that only the tiles
+    being drizzled at any one time count towards the memory usage.
+    With ``sparse_ctx`` (see the ``final_sparse_ctx`` parameter), the
+    context image gets counted as a single plane.
     """
 
     from . import imageObject
+    from .adrizzle import _max_tile_bytes
     if outwcs is None:
-        output_mem = 0
+        frame_pixels = 0
     else:
         if isinstance(outwcs,imageObject.WCSObject):
             owcs = outwcs.final_wcs
         else:
             owcs = outwcs
-        output_mem = np.prod(owcs.pixel_shape) * 4 * 3  # bytes used for output arrays
+        frame_pixels = int(np.prod(owcs.pixel_shape))
     img1 = imageObjectList[0]
     numchips = 0
     input_mem = 0
     for img in imageObjectList:
         numchips += img._nmembers # account for group parameter set by user
 
+    # The final context image needs one plane for every 32 inputs
+    nplanes = 1
+    if (img1[1].outputNames['outContext'] not in [None, '', ' '] and
+            not sparse_ctx):
+        nplanes = (numchips - 1) // 32 + 1
+    single_mem = frame_pixels * 4 * 3  # bytes used for single drizzle arrays
+    output_mem = frame_pixels * 4 * (2 + nplanes)  # bytes used for final arrays
+
     # if we have the cpus and s/w, ok, but still allow user to set pool size
     pool_size = util.get_pool_size(num_cores, None)
+    # the final drizzle uses all cores, over tiles of the output frame
+    if memmap:
+        final_mem = min(output_mem, pool_size * _max_tile_bytes) if pool_size > 1 else 0
+    else:
+        final_mem = output_mem * 2 if pool_size > 1 else output_mem
     pool_size = pool_size if (numchips >= pool_size) else numchips
 
     inimg = 0
@@ -269,13 +292,18 @@ def reportResourceUsage(imageObjectList, outwcs, num_cores,
                 input_mem += cmem*2
             if chip_mem == 0:
                 chip_mem = cmem
-    max_mem = (input_mem + output_mem*pool_size + chip_mem*2)//(1024*1024)
+    max_mem = (input_mem + max(single_mem*pool_size, final_mem) +
+               chip_mem*2)//(1024*1024)
 
     print('*'*80)
     print('*')
     print('*  Estimated memory usage:  up to %d Mb.'%(max_mem))
     print('*  Output image size:       {:d} X {:d} pixels. '.format(*owcs.pixel_shape))
     print('*  Output image file:       ~ %d Mb. '%(output_mem//(1024*1024)))
+    if memmap:
+        print('*  Output arrays:           memory-mapped scratch files')
+    if sparse_ctx:
+        print('*  Context image:           sparse')
     print('*  Cores available:         %d'%(pool_size))
     print('*')
     print('*'*80)
@@ -579,12 +607,15 @@ def _process_input_wcs(infiles, wcskey, updatewcs):
     # Run parseinput though it's likely already been done in processFilenames
     outfiles = parseinput.parseinput(infiles)[0]
 
-    # Disable parallel processing here for now until hardware I/O gets "wider".
     # Since this part is IO bound, parallelizing doesn't help more than a little
     # in most cases, and may actually slow this down on some desktop nodes.
-#   cfgval_num_cores = None # get this from paramDict
-#   pool_size = util.get_pool_size(cfgval_num_cores, len(outfiles))
+    # So only run in parallel when the user asked for a number of cores
+    # for the worker pool of an AstroDrizzle session.
     pool_size = 1
+    if util.has_worker_pool():
+        pool = util.get_worker_pool()
+        if pool.num_cores is not None:
+            pool_size = min(pool.size, len(outfiles))
 
     # do the WCS updating
     if wcskey in ['', ' ', 'INDEF', None]:
@@ -595,13 +626,10 @@ def _process_input_wcs(infiles, wcskey, updatewcs):
 
     if pool_size > 1:
         log.info('Executing %d parallel workers' % pool_size)
-        subprocs = []
-        for fname in outfiles:
-            p = multiprocessing.Process(target=_process_input_wcs_single,
-                name='processInput._process_input_wcs()', # for err msgs
-                args=(fname, wcskey, updatewcs) )
-            subprocs.append(p)
-        mputil.launch_and_wait(subprocs, pool_size) # blocks till all done
+        tasks = [(fname, wcskey, updatewcs) for fname in outfiles]
+        pool.run(_process_input_wcs_single, tasks,
+                 name='processInput._process_input_wcs()', # for err msgs
+                 pool_size=pool_size) # blocks till all done
     else:
         log.info('Executing serially')
         for fname in outfiles:
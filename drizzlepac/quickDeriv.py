@@ -15,59 +15,87 @@ IS RETURNED BY :py:func:`quickderiv`.
 import numpy as np
 from .version import *
 
+# Default size (in bytes) of the blocks of rows of the input image
+# processed at once by `qderiv`:
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
 def qderiv(array): # TAKE THE ABSOLUTE DERIVATIVE OF A NUMARRY OBJECT
-    """Take the absolute derivate of an image in memory."""
-
-    #Create 2 empty arrays in memory of the same dimensions as 'array'
-    tmpArray = np.zeros(array.shape,dtype=np.float64)
-    outArray = np.zeros(array.shape, dtype=np.float64)
-
-    # Get the length of an array side
-    (naxis1,naxis2) = array.shape
-    #print "The input image size is (",naxis1,",",naxis2,")."
-
-#Main derivate loop:
-    #Shift images +/- 1 in Y.
-    for y in range(-1,2,2):
-        if y == -1:
-            #shift input image 1 pixel right
-            tmpArray[0:(naxis1-1),1:(naxis2-1)] = array[0:(naxis1-1),0:(naxis2-2)]
-            #print "Y shift = 1"
-        else:
-            #shift input image 1 pixel left
-            tmpArray[0:(naxis1-1),0:(naxis2-2)] = array[0:(naxis1-1),1:(naxis2-1)]
-            #print "Y shift = -1"
-        #print "call _absoluteSubtract()"
-        (tmpArray,outArray) = _absoluteSubtract(array,tmpArray,outArray)
-
-    #Shift images +/- 1 in X.
-    for x in range(-1,2,2):
-        if x == -1:
-            #shift input image 1 pixel right
-            tmpArray[1:(naxis1-1),0:(naxis2-1)] = array[0:(naxis1-2),0:(naxis2-1)]
-            #print "X shift = 1"
-        else:
-            #shift input image 1 pixel left
-            tmpArray[0:(naxis1-2),0:(naxis2-1)] = array[1:(naxis1-1),0:(naxis2-1)]
-            #print "X shift = -1"
-        #print "call _absoluteSubtract()"
-        (tmpArray,outArray) = _absoluteSubtract(array,tmpArray,outArray)
-
-
-
-    return outArray.astype(np.float32)
-
-
-def _absoluteSubtract(array,tmpArray,outArray):
-    #subtract shifted image from imput image
-    tmpArray = array - tmpArray
-    #take the absolute value of tmpArray
-    tmpArray = np.fabs(tmpArray)
-    #save maximum value of outArray or tmpArray and save in outArray
-    outArray = np.maximum(tmpArray,outArray)
-    #zero out tmpArray before reuse
-    tmpArray = tmpArray * 0.
-
-    return (tmpArray,outArray)
+    """Take the absolute derivate of an image in memory.
+
+    Each pixel gets the largest absolute difference between its value and
+    those of its 4 neighbors. Pixels in the first row and column, and in
+    the last 2 rows and columns, may instead get their own absolute value,
+    if that is larger.
+
+    The differences get computed in blocks of rows of about `BLOCK_SIZE`
+    bytes, in single precision for single precision input images, so that
+    no temporary arrays of the full size of the image are needed.
+    """
+    array = np.asarray(array)
+    dtype = np.float32 if array.dtype == np.float32 else np.float64
+
+    (naxis1, naxis2) = array.shape
+    outArray = np.empty(array.shape, dtype=np.float32)
+
+    nrows = max(BLOCK_SIZE // max(naxis2 * np.dtype(dtype).itemsize, 1), 1)
+    for r1 in range(0, naxis1, nrows):
+        r2 = min(r1 + nrows, naxis1)
+        outArray[r1:r2] = _qderiv_rows(array, r1, r2, dtype)
+
+    return outArray
+
+
+def _qderiv_rows(array, r1, r2, dtype):
+    """ Compute the absolute derivative of rows ``r1`` to ``r2`` (exclusive)
+    of an image, in the given ``dtype``.
+    """
+    (naxis1, naxis2) = array.shape
+    # input rows needed, including one on either side:
+    a1 = max(r1 - 1, 0)
+    a2 = min(r2 + 1, naxis1)
+    block = array[a1:a2].astype(dtype)
+    rows = block[r1 - a1:r2 - a1]
+    deriv = np.zeros(rows.shape, dtype=dtype)
+
+    # Differences with the neighbors in the same row, for all but the last
+    # row, leaving out the last column:
+    n = min(r2, naxis1 - 1) - r1
+    if n > 0:
+        diff = np.abs(rows[:n, 1:naxis2 - 1] - rows[:n, :naxis2 - 2])
+        np.maximum(deriv[:n, 1:naxis2 - 1], diff,
+                   out=deriv[:n, 1:naxis2 - 1])
+        np.maximum(deriv[:n, :naxis2 - 2], diff, out=deriv[:n, :naxis2 - 2])
+
+    # Differences with the neighbors in the same column, for all but the
+    # last column, leaving out the last row:
+    y1 = max(r1, 1)
+    y2 = min(r2, naxis1 - 1)
+    if y2 > y1:
+        # with the previous row
+        diff = np.abs(block[y1 - a1:y2 - a1, :naxis2 - 1] -
+                      block[y1 - a1 - 1:y2 - a1 - 1, :naxis2 - 1])
+        np.maximum(deriv[y1 - r1:y2 - r1, :naxis2 - 1], diff,
+                   out=deriv[y1 - r1:y2 - r1, :naxis2 - 1])
+    y2 = min(r2, naxis1 - 2)
+    if y2 > r1:
+        # with the next row
+        diff = np.abs(block[r1 - a1:y2 - a1, :naxis2 - 1] -
+                      block[r1 - a1 + 1:y2 - a1 + 1, :naxis2 - 1])
+        np.maximum(deriv[:y2 - r1, :naxis2 - 1], diff,
+                   out=deriv[:y2 - r1, :naxis2 - 1])
+
+    # Pixels missing any of the differences above also get compared with
+    # their own absolute value:
+    edges = [(slice(None), slice(0, 1)),
+             (slice(None), slice(max(naxis2 - 2, 0), None))]
+    if r1 == 0:
+        edges.append((slice(0, 1), slice(None)))
+    if r2 > naxis1 - 2:
+        edges.append((slice(max(naxis1 - 2 - r1, 0), None), slice(None)))
+    for edge in edges:
+        np.maximum(deriv[edge], np.abs(rows[edge]), out=deriv[edge])
+
+    return deriv
 
 # END MODULE
@@ -0,0 +1,172 @@
+"""
+Fast estimates of the mode and standard deviation of the pixel values of
+an image, computed by :py:class:`QuickStats` either from a random
+subsample of the pixels or from a single histogram of all of them, as
+quicker replacements of a full `stsci.imagestats.ImageStats` computation.
+
+:License: :doc:`LICENSE`
+
+"""
+import numpy as np
+from stsci.imagestats import ImageStats
+
+from .version import *
+
+__all__ = ['QuickStats', 'methods']
+
+# Names of the available methods, as also accepted by the 'skystat'
+# parameter of the sky subtraction step:
+methods = ['subsample', 'histogram']
+
+# Default maximum number of pixels used by the 'subsample' method, also
+# used for the first estimate of the 'histogram' method:
+SUBSAMPLE_SIZE = 1024 * 1024
+
+# Size (in pixels) of the blocks of the image added to the histogram at once:
+BLOCK_SIZE = 1024 * 1024
+
+# Range covered by the histogram, in units of the standard deviation of
+# the first estimate, beyond its 'lsig'/'usig' clipping limits:
+_HIST_RANGE = 2.0
+
+
+class QuickStats:
+    """
+    Estimate the (clipped) mode and standard deviation of the pixels of an
+    image, with the same parameters as `stsci.imagestats.ImageStats`.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image (or list of pixel values) to compute the statistics of.
+
+    method : {'subsample', 'histogram'}
+        With ``'subsample'``, the statistics get computed by ``ImageStats``
+        from at most ``npix_max`` pixels picked at random. With
+        ``'histogram'``, for larger images, those only serve to set up a
+        histogram with fixed bins, ``binwidth`` sigma wide, which then gets
+        filled with all the pixels of the image in one pass, and the
+        clipping and the mode get computed from it.
+
+    lower, upper, nclip, lsig, usig, binwidth
+        Same as for `stsci.imagestats.ImageStats`.
+
+    npix_max : int, optional
+        Maximum number of pixels to subsample.
+
+    Attributes
+    ----------
+    npix, mean, stddev, mode, histogram, hwidth
+        Same as for `stsci.imagestats.ImageStats`, with ``npix`` being
+        the number of pixels the statistics were computed from.
+
+    error : float
+        Estimated error of the mode, as found from the peak of a histogram
+        of ``npix`` values with bins ``hwidth`` wide, following a normal
+        distribution with a standard deviation of ``stddev``.
+
+    """
+    def __init__(self, image, method='subsample', lower=None, upper=None,
+                 nclip=0, lsig=3.0, usig=3.0, binwidth=0.1,
+                 npix_max=SUBSAMPLE_SIZE):
+        if method not in methods:
+            raise ValueError("Unknown statistics method '{}'".format(method))
+
+        image = np.asanyarray(image).ravel()
+        kwargs = {'lower': lower, 'upper': upper, 'nclip': nclip,
+                  'lsig': lsig, 'usig': usig, 'binwidth': binwidth}
+
+        stats = ImageStats(_subsample(image, npix_max),
+                           fields='npix,mean,stddev,mode', **kwargs)
+        self.npix = stats.npix
+        self.mean = stats.mean
+        self.stddev = stats.stddev
+        self.mode = stats.mode
+        self.histogram = stats.histogram
+        self.hwidth = binwidth * stats.stddev
+
+        if method == 'histogram' and image.size > npix_max and \
+           self.hwidth >= 10.0 * np.finfo(np.float32).eps:
+            self._histogramStats(image, self.hwidth, **kwargs)
+
+        self.error = _modeError(self.npix, self.stddev, self.hwidth)
+
+    def _histogramStats(self, image, hwidth, lower, upper, nclip, lsig, usig,
+                        binwidth):
+        """ Recompute the statistics from a histogram of all the pixels,
+        with bins ``hwidth`` wide around the first estimate.
+        """
+        hmin = self.mean - (lsig + _HIST_RANGE) * self.stddev
+        hmax = self.mean + (usig + _HIST_RANGE) * self.stddev
+        if lower is not None:
+            hmin = max(hmin, lower)
+        if upper is not None:
+            hmax = min(hmax, upper)
+        nbins = max(int(np.ceil((hmax - hmin) / hwidth)), 1)
+        hmax = hmin + nbins * hwidth
+
+        counts = np.zeros(nbins, dtype=np.int64)
+        for i in range(0, image.size, BLOCK_SIZE):
+            counts += np.histogram(image[i:i + BLOCK_SIZE], bins=nbins,
+                                   range=(hmin, hmax))[0]
+        centers = hmin + (np.arange(nbins) + 0.5) * hwidth
+
+        # Iterate the clipping on the histogram:
+        clipmin, clipmax = hmin, hmax
+        for it in range(nclip + 1):
+            inside = (centers >= clipmin) & (centers <= clipmax)
+            npix = counts[inside].sum()
+            if npix <= 0:
+                # leave the first estimate as it is
+                return
+            mean = np.dot(counts[inside], centers[inside]) / npix
+            stddev = np.sqrt(np.dot(counts[inside],
+                                    (centers[inside] - mean)**2) / npix)
+            if it < nclip:
+                clipmin = max(hmin, mean - lsig * stddev)
+                clipmax = min(hmax, mean + usig * stddev)
+
+        bins = counts[inside]
+        self.npix = int(npix)
+        self.mean = mean
+        self.stddev = stddev
+        self.mode = _histogramMode(bins, centers[inside][0] - 0.5 * hwidth,
+                                   hwidth)
+        self.histogram = bins
+
+
+def _subsample(image, npix_max):
+    """ Return at most ``npix_max`` pixels of a flattened image, picked at
+    random (the same ones each time).
+    """
+    if image.size <= npix_max:
+        return image
+    rng = np.random.default_rng(0)
+    return image[rng.integers(0, image.size, npix_max)]
+
+
+def _modeError(npix, stddev, hwidth):
+    """ Estimate the error of the mode found by interpolating the peak of
+    a histogram, from the noise of the counts in the bins around the peak
+    of a normal distribution.
+    """
+    if npix < 1 or stddev <= 0.0 or hwidth <= 0.0:
+        return 0.0
+    npeak = npix * hwidth / (stddev * np.sqrt(2.0 * np.pi))
+    return stddev**2 / (hwidth * np.sqrt(2.0 * npeak))
+
+
+def _histogramMode(bins, hmin, hwidth):
+    """ Compute the mode from the peak of a histogram, in the same way as
+    `stsci.imagestats.ImageStats`.
+    """
+    nbins = len(bins)
+    peak = int(np.argmax(bins))
+    if nbins < 3 or peak == 0 or peak == nbins - 1:
+        return hmin + (peak + 0.5) * hwidth
+
+    dh1 = int(bins[peak]) - int(bins[peak - 1])
+    dh2 = int(bins[peak]) - int(bins[peak + 1])
+    if dh1 + dh2 == 0:
+        return hmin + (peak + 0.5) * hwidth
+    return hmin + (peak + 0.5 + 0.5 * (dh1 - dh2) / (dh1 + dh2)) * hwidth
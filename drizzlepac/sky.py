@@ -21,10 +21,13 @@ except ImportError:
 
 from stsci.skypac.skymatch import skymatch
 from stsci.skypac.utils import MultiFileLog, ResourceRefCount, ext2str, \
-     file_name_components, in_memory_mask, temp_mask_file, openImageEx
+     file_name_components, in_memory_mask, temp_mask_file, openImageEx, \
+     is_countrate
+from stsci.skypac.skystatistics import SkyStats
 from stsci.skypac.parseat import FileExtMaskInfo, parse_at_file
 
 from . import processInput
+from . import quickStats
 import stsci.imagestats as imagestats
 import numpy as np
 
@@ -197,7 +200,14 @@ def subtractSky(imageObjList,configObj,saveFile=False,procSteps=None):
         else:
             clean = True
 
-        _skymatch(imageObjList, paramDict, inmemory, clean, log)
+        if _use_chip_sky(paramDict):
+            if paramDict.get('sky_parallel', False):
+                num_cores = configObj.get('num_cores')
+            else:
+                num_cores = 1
+            _skyParallel(imageObjList, paramDict, num_cores)
+        else:
+            _skymatch(imageObjList, paramDict, inmemory, clean, log)
 
     if procSteps is not None:
         procSteps.endStep('Subtract Sky')
@@ -330,10 +340,17 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
 
         new_fi.append(fi)
 
+    skystat = paramDict['skystat']
+    if skystat in quickStats.methods:
+        log.warning("Sky statistics '{}' not available with skymethod='{}' "
+                    "or a skymask_cat. Using 'mode' instead."
+                    .format(skystat, paramDict['skymethod']))
+        skystat = 'mode'
+
     # Run skymatch algorithm:
     skymatch(new_fi,
              skymethod   = paramDict['skymethod'],
-             skystat     = paramDict['skystat'],
+             skystat     = skystat,
              lower       = paramDict['skylower'],
              upper       = paramDict['skyupper'],
              nclip       = paramDict['skyclip'],
@@ -372,16 +389,216 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
     for fi in new_fi:
         fi.release_all_images()
 
-def _buildStaticDQUserMask(img, ext, sky_bits, use_static, umask,
-                           umaskext, in_memory):
-    # creates a temporary mask by combining 'static' mask,
-    # DQ image, and user-supplied mask.
+def _use_chip_sky(paramDict):
+    # The sky of each chip can only be computed on its own, independently
+    # of all other chips, for the methods not matching the sky of
+    # overlapping images, and without any user-supplied masks. This is
+    # done when asked to compute them in parallel, or for the quick
+    # statistics 'skymatch' does not provide.
+    if paramDict['skymethod'] not in ['localmin', 'globalmin'] or \
+       not util.is_blank(paramDict['skymask_cat']):
+        return False
+    return (paramDict.get('sky_parallel', False) or
+            paramDict['skystat'] in quickStats.methods)
+
+
+def _skyParallel(imageList, paramDict, num_cores):
+    # '_skyParallel' computes the same 'localmin' and 'globalmin' sky values
+    # as '_skymatch', with the statistics of all chips of all images
+    # computed in parallel. The minimum sky values get found once all
+    # of them are done, and all the headers then get updated at once.
+
+    #header keyword that contains the sky that's been subtracted
+    skyKW = "MDRIZSKY"
+
+    sky_bits = interpret_bit_flags(paramDict['sky_bits'])
+    chiplists = [img.returnAllChips(extname=img.scienceExt)
+                 for img in imageList]
+    chips = [(img, chip) for img, chiplist in zip(imageList, chiplists)
+             for chip in chiplist]
+
+    pool_size = util.get_pool_size(num_cores, len(chips))
+    if pool_size > 1:
+        log.info('Executing %d parallel workers' % pool_size)
+        pool = util.get_worker_pool(num_cores)
+        results = pool.manager.dict()
+        tasks = [(img, chip, paramDict, sky_bits, results)
+                 for img, chip in chips]
+        pool.run(_computeChipSky, tasks, name='sky._computeChipSky()',
+                 pool_size=pool_size)  # blocks till all done
+        results = dict(results)
+    else:
+        log.info('Executing serially')
+        results = {}
+        for img, chip in chips:
+            _computeChipSky(img, chip, paramDict, sky_bits, results)
+
+    imageSkies = [[results[(img._filename, chip._chip)] for chip in chiplist]
+                  for img, chiplist in zip(imageList, chiplists)]
+    skyValues = _reduceSky(imageSkies, paramDict['skymethod'])
+
+    updates = []
+    for img, chiplist, skyList in zip(imageList, chiplists, skyValues):
+        log.info("Sky values for %s:" % img._filename)
+        for chip, skyValue in zip(chiplist, skyList):
+            chip.subtractedSky = skyValue
+            chip.computedSky = skyValue
+            log.info("    %s = %s for chip %d" %
+                     (skyKW, skyValue, chip._chip))
+            updates.append((chip, img._filename,
+                            (img.scienceExt, chip._chip), skyValue))
+
+    _updateKWs(updates, skyKW)
+
+
+def _computeChipSky(img, chip, paramDict, sky_bits, results):
+    """
+    Compute the sky statistics of a single chip, over the pixels left by
+    its DQ and static masks, and the factor converting its data to
+    brightness (flux per unit area). They get stored in ``results``,
+    with the sky set to `None` when there are no pixels left to compute it.
+    This gets run as a separate process when computing the sky in parallel.
+
+    """
+    ext = (img.scienceExt, chip._chip)
+    mask = _buildStaticDQMask(img, ext, sky_bits, paramDict['use_static'])
+
+    fobj = fileutil.openImage(img._filename, memmap=False)
+    data = fobj[ext].data
+    conv = _data2brightness(chip, fobj, ext)
+    fobj.close()
+
+    if mask is not None:
+        data = data[np.asarray(mask, dtype=bool)]
+        del mask
+
+    skyValue = None
+    if data.size < 1:
+        log.warning("Not enough data points to compute sky for %s[%s,%d]." %
+                    (img._filename, ext[0], ext[1]))
+    else:
+        try:
+            skyValue, npix, error = _calcSky(data, paramDict)
+        except ValueError:
+            npix = 0
+        if npix < 1:
+            log.warning("Not enough data points to compute sky for "
+                        "%s[%s,%d] after clipping was applied." %
+                        (img._filename, ext[0], ext[1]))
+            skyValue = None
+        elif error is None:
+            log.info("    Computed sky value/pixel for %s[%s,%d]: %s " %
+                     (img._filename, ext[0], ext[1], skyValue))
+        else:
+            log.info("    Computed sky value/pixel for %s[%s,%d]: %s "
+                     "(+/- %s) " %
+                     (img._filename, ext[0], ext[1], skyValue, error))
+
+    results[(img._filename, chip._chip)] = (skyValue, conv)
+
+
+def _calcSky(data, skypars):
+    # Computes the sky statistics requested by 'skystat', returning the sky
+    # value, the number of pixels it was computed from and, for the quick
+    # statistics, the estimated error of the sky value (None otherwise).
+    if skypars['skystat'] in quickStats.methods:
+        stats = quickStats.QuickStats(data,
+                                      method=skypars['skystat'],
+                                      lower=skypars['skylower'],
+                                      upper=skypars['skyupper'],
+                                      nclip=skypars['skyclip'],
+                                      lsig=skypars['skylsigma'],
+                                      usig=skypars['skyusigma'],
+                                      binwidth=skypars['skywidth'])
+        return stats.mode, stats.npix, stats.error
+
+    skystat = SkyStats(skystat=skypars['skystat'],
+                       lower=skypars['skylower'],
+                       upper=skypars['skyupper'],
+                       nclip=skypars['skyclip'],
+                       lsig=skypars['skylsigma'],
+                       usig=skypars['skyusigma'],
+                       binwidth=skypars['skywidth'])
+    skyValue, npix = skystat.calc_sky(data)
+    return skyValue, npix, None
+
+
+def _data2brightness(chip, fobj, ext):
+    # Factor converting the data of a chip to brightness, the same way as
+    # done by 'skymatch': scaled by the nominal area of its pixels and, for
+    # data in counts (or in units that cannot be told), by the exposure time.
+    pscale = chip.wcs.idcscale
+    if pscale is None:
+        for hdr in [fobj[ext].header, fobj[0].header]:
+            for kw in ['PAMSCALE', 'IDCSCALE']:
+                if pscale is None and kw in hdr:
+                    pscale = float(hdr[kw])
+    if pscale is None:
+        if chip.wcs.wcs.has_cd():
+            pscale = 3600.0 * np.sqrt(np.abs(np.linalg.det(chip.wcs.wcs.cd)))
+        else:
+            pscale = 1.0
+    conv = 1.0 / float(pscale)**2
+
+    if not is_countrate(fobj, ext, units_kwd='BUNIT', guess_if_missing=True,
+                        verbose=False):
+        exptime = fobj[0].header.get('EXPTIME', fobj[ext].header.get('EXPTIME'))
+        if exptime is not None and exptime > 0.0:
+            conv /= exptime
+
+    return conv
+
 
-    def merge_masks(m1, m2):
-        if m1 is None: return m2
-        if m2 is None: return m1
-        return np.logical_and(m1, m2).astype(np.uint8)
+def _reduceSky(imageSkies, skymethod):
+    """
+    Find the sky values to record for all chips of all images, from their
+    statistics.
+
+    Parameters
+    ----------
+    imageSkies : list
+        For each image, the list of ``(sky, conv)`` pairs of each of its
+        chips, with the sky computed for the chip (`None` if it could not be
+        computed) and the factor converting its data to brightness.
+
+    skymethod : {'localmin', 'globalmin'}
+        Use the minimum sky brightness of all the chips of each image
+        ('localmin'), or of all the chips of all images ('globalmin').
+
+    Returns
+    -------
+    skyValues : list
+        For each image, the list of sky values of each of its chips, in the
+        units of its data.
+
+    """
+    minSky = []
+    for chipSkies in imageSkies:
+        skies = [sky * conv for sky, conv in chipSkies if sky is not None]
+        minSky.append(min(skies) if skies else None)
+
+    if skymethod == 'globalmin':
+        skies = [sky for sky in minSky if sky is not None]
+        minSky = len(minSky) * [min(skies) if skies else None]
+
+    skyValues = []
+    for chipSkies, sky in zip(imageSkies, minSky):
+        if sky is None:
+            sky = 0.0
+        skyValues.append([sky / conv for _, conv in chipSkies])
+
+    return skyValues
+
+
+def _merge_masks(m1, m2):
+    if m1 is None: return m2
+    if m2 is None: return m1
+    return np.logical_and(m1, m2).astype(np.uint8)
 
+
+def _buildStaticDQMask(img, ext, sky_bits, use_static):
+    # combines the DQ mask and 'static' mask of a chip, as selected,
+    # returning None when neither is used.
     mask = None
 
     # build DQ mask
@@ -416,7 +633,16 @@ def _buildStaticDQUserMask(img, ext, sky_bits, use_static, umask,
                 log.warning("Static mask for file \'{}\', ext={} NOT FOUND." \
                             .format(img._filename, ext))
         # combine DQ and static masks:
-        mask = merge_masks(mask, smask)
+        mask = _merge_masks(mask, smask)
+
+    return mask
+
+
+def _buildStaticDQUserMask(img, ext, sky_bits, use_static, umask,
+                           umaskext, in_memory):
+    # creates a temporary mask by combining 'static' mask,
+    # DQ image, and user-supplied mask.
+    mask = _buildStaticDQMask(img, ext, sky_bits, use_static)
 
     # combine user mask with the previously computed mask:
     if umask is not None and not umask.closed:
@@ -427,7 +653,7 @@ def _buildStaticDQUserMask(img, ext, sky_bits, use_static, umask,
         else:
             # combine user mask with the previously computed mask:
             dtm  = umask.hdu[umaskext].data
-            mask = merge_masks(mask, dtm)
+            mask = _merge_masks(mask, dtm)
 
     if mask is None:
         return (None, None)
@@ -767,6 +993,28 @@ def _updateKW(image, filename, exten, skyKW, Value):
     fobj[exten].header[skyKW] = (Value, 'Sky value computed by AstroDrizzle')
     fobj.close()
 
+def _updateKWs(updates, skyKW):
+    """
+    Update the headers of many chips with their sky values, opening each
+    file only once. ``updates`` is a list of ``(image, filename, exten,
+    value)`` tuples, as the arguments of `_updateKW`.
+
+    """
+    files = {}
+    for image, filename, exten, Value in updates:
+        # Update the value in memory
+        image.header[skyKW] = Value
+        files.setdefault(filename, []).append((exten, Value))
+
+    # Now update the values on disk
+    for filename, values in files.items():
+        log.info('Updating keyword %s in %s' % (skyKW, filename))
+        fobj = fileutil.openImage(filename, mode='update', memmap=False)
+        for exten, Value in values:
+            fobj[exten].header[skyKW] = (Value,
+                                         'Sky value computed by AstroDrizzle')
+        fobj.close()
+
 def _addDefaultSkyKW(imageObjList):
     """Add MDRIZSKY keyword to "commanded" SCI headers of all input images,
         if that keyword does not already exist.
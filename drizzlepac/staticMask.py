@@ -20,6 +20,7 @@ from astropy.io import fits
 from stsci.imagestats import ImageStats
 from . import util
 from . import processInput
+from . import quickStats
 
 __taskname__ = "drizzlepac.staticMask"
 _step_num_ = 1
@@ -87,8 +88,8 @@ def createStaticMask(imageObjectList=[],configObj=None,procSteps=None):
     #create a static mask object
     myMask = staticMask(configObj)
 
-    for image in imageObjectList:
-        myMask.addMember(image) # create tmp filename here...
+    # create tmp filenames here...
+    myMask.addMembers(imageObjectList, num_cores=configObj.get('num_cores'))
 
 
     #save the masks to disk for later access
@@ -121,7 +122,8 @@ class staticMask:
     masks pixels that are unwanted in the SCI array.
     A static mask  object gets created for each global
     mask needed, one for each chip from each instrument/detector.
-    Each static mask array has type Int16, and resides in memory.
+    Each static mask array resides in memory as a bitmap packed by
+    numpy.packbits, and gets saved as an Int16 image.
 
     :Notes:
         Class that manages the creation of a global static
@@ -138,8 +140,11 @@ class staticMask:
         self.step_name=util.getSectionName(configObj,_step_num_)
         if configObj is not None:
             self.static_sig = configObj[self.step_name]['static_sig']
+            self.static_stat = configObj[self.step_name].get('static_stat',
+                                                             'mode')
         else:
             self.static_sig = 4. # define a reasonable number
+            self.static_stat = 'mode'
             log.warning('Using default of 4. for static mask sigma.')
 
     def addMember(self, imagePtr=None):
@@ -161,18 +166,60 @@ class staticMask:
         The signature is defined in the image object for each chip
 
         """
-        numchips=imagePtr._numchips
-        log.info("Computing static mask:\n")
+        self.addMembers([imagePtr], num_cores=1)
+
+    def addMembers(self, imageObjectList, num_cores=None):
+        """
+        Combines all the input images with the static masks that
+        have the same signatures.
+
+        The masks of the chips get computed by up to ``num_cores``
+        parallel workers, each returning a bitmap packed with
+        `numpy.packbits`, and get combined (in the order of the images)
+        with the static mask of their signature, also kept as a packed
+        bitmap until it gets saved.
+
+        Parameters
+        ----------
+        imageObjectList : list
+            List of imageObject references
 
-        chips = imagePtr.group
-        if chips is None:
-            chips = imagePtr.getExtensions()
+        num_cores : int, optional
+            Maximum number of parallel workers to use (all available
+            cores if `None`).
 
-        #for chip in range(1,numchips+1,1):
-        for chip in chips:
-            chipid=imagePtr.scienceExt + ','+ str(chip)
-            chipimage=imagePtr.getData(chipid)
-            signature=imagePtr[chipid].signature
+        """
+        chips = []
+        for imagePtr in imageObjectList:
+            chiplist = imagePtr.group
+            if chiplist is None:
+                chiplist = imagePtr.getExtensions()
+            for chip in chiplist:
+                chips.append((imagePtr, chip))
+
+        pool_size = util.get_pool_size(num_cores, len(chips))
+        if pool_size > 1:
+            log.info('Executing %d parallel workers' % pool_size)
+            pool = util.get_worker_pool(num_cores)
+            results = pool.manager.dict()
+            tasks = [(imagePtr, chip, self.static_stat, self.static_sig,
+                      results)
+                     for imagePtr, chip in chips]
+            pool.run(_computeChipMask, tasks,
+                     name='staticMask._computeChipMask()',
+                     pool_size=pool_size)  # blocks till all done
+            results = dict(results)
+        else:
+            log.info('Executing serially')
+            results = {}
+            for imagePtr, chip in chips:
+                _computeChipMask(imagePtr, chip, self.static_stat,
+                                 self.static_sig, results)
+
+        log.info("Computing static mask:\n")
+        for imagePtr, chip in chips:
+            chipid = imagePtr.scienceExt + ',' + str(chip)
+            signature = imagePtr[chipid].signature
 
             # If this is a new signature, create a new Static Mask file which is empty
             # only create a new mask if one doesn't already exist
@@ -188,30 +235,24 @@ class staticMask:
                         break
             imagePtr[chipid].outputNames['staticMask'] = maskname
 
-            stats = ImageStats(chipimage,nclip=3,fields='mode')
-            mode = stats.mode
-            rms  = stats.stddev
-            nbins = len(stats.histogram)
-            del stats
-
+            mode, rms, error, chipmask = results[(imagePtr._filename, chip)]
+            if error is not None:
+                log.info('  mode error = %7f' % error)
             log.info('  mode = %9f;   rms = %7f;   static_sig = %0.2f' %
                      (mode, rms, self.static_sig))
 
-            if nbins >= 2: # only combine data from new image if enough data to mask
-                sky_rms_diff = mode - (self.static_sig*rms)
-                np.bitwise_and(self.masklist[signature],
-                               np.logical_not(np.less(chipimage, sky_rms_diff)),
-                               self.masklist[signature])
-            del chipimage
+            if chipmask is not None:
+                np.bitwise_and(self.masklist[signature], chipmask,
+                               out=self.masklist[signature])
 
     def _buildMaskArray(self,signature):
-        """ Creates empty  numpy array for static mask array signature. """
-        return np.ones(signature[1],dtype=np.int16)
+        """ Creates empty packed bitmap for static mask array signature. """
+        return np.packbits(np.ones(signature[1], dtype=bool), axis=None)
 
     def getMaskArray(self, signature):
         """ Returns the appropriate StaticMask array for the image. """
-        if signature in self.masklist:
-            mask =  self.masklist[signature]
+        if signature in self.masklist and self.masklist[signature] is not None:
+            mask = _unpackMask(self.masklist[signature], signature[1])
         else:
             mask = None
         return mask
@@ -265,7 +306,7 @@ class staticMask:
             #create a new fits image with the mask array and a standard header
             #open a new header and data unit
             newHDU = fits.PrimaryHDU()
-            newHDU.data = self.masklist[key]
+            newHDU.data = self.getMaskArray(key)
 
             if virtual:
                 for img in imageObjectList:
@@ -282,6 +323,46 @@ class staticMask:
                     raise IOError
 
 
+def _computeChipMask(imagePtr, chip, static_stat, static_sig, results):
+    """
+    Compute the static mask of a single chip, flagging (with zeros) the
+    pixels more than ``static_sig`` sigma below its mode, as a bitmap
+    packed with `numpy.packbits`, or `None` when there is not enough data
+    to mask. It gets stored in ``results`` along with the mode, standard
+    deviation and (quick statistics only) mode error of the chip. This gets
+    run as a separate process when computing the static masks in parallel.
+
+    """
+    chipimage = imagePtr.getData(imagePtr.scienceExt + ',' + str(chip))
+    if static_stat in quickStats.methods:
+        stats = quickStats.QuickStats(chipimage, nclip=3, method=static_stat)
+        error = stats.error
+    else:
+        stats = ImageStats(chipimage, nclip=3, fields='mode')
+        error = None
+    mode = stats.mode
+    rms = stats.stddev
+    nbins = len(stats.histogram)
+    del stats
+
+    chipmask = None
+    if nbins >= 2: # only combine data from new image if enough data to mask
+        sky_rms_diff = mode - (static_sig * rms)
+        mask = np.less(chipimage, sky_rms_diff)
+        np.logical_not(mask, out=mask)
+        chipmask = np.packbits(mask, axis=None)
+        del mask
+    del chipimage
+
+    results[(imagePtr._filename, chip)] = (mode, rms, error, chipmask)
+
+
+def _unpackMask(bitmap, shape):
+    """ Return a static mask packed by `numpy.packbits` as an Int16 array. """
+    size = int(np.prod(shape))
+    return np.unpackbits(bitmap, count=size).reshape(shape).astype(np.int16)
+
+
 def help(file=None):
     """
     Print out syntax help for running astrodrizzle
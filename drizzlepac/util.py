@@ -37,6 +37,7 @@ _cpu_count = -1
 if 'ASTRODRIZ_NO_PARALLEL' not in os.environ:
     try:
         import multiprocessing
+        import multiprocessing.connection
         try:
             # sanity check - do we even have the hardware?
             _cpu_count = multiprocessing.cpu_count()
@@ -46,6 +47,15 @@ if 'ASTRODRIZ_NO_PARALLEL' not in os.environ:
     except ImportError:
         print('\nCould not import multiprocessing, will only take advantage of a single CPU core')
 
+# shared memory blocks are used to pass in-memory products between processes
+shared_memory = None
+if can_parallel:
+    try:
+        from multiprocessing import resource_tracker, shared_memory
+    except ImportError:
+        # only available with python >= 3.8
+        shared_memory = None
+
 
 def get_pool_size(usr_config_value, num_tasks):
     """ Determine size of thread/process-pool for parallel processing.
@@ -75,6 +85,260 @@ def get_pool_size(usr_config_value, num_tasks):
         return min(_cpu_count, num_tasks)
 
 
+class WorkerPool:
+    """ Scheduler of the parallel tasks of all the processing steps of an
+    AstroDrizzle session.
+
+    No processes are kept between tasks: each task gets run by a new
+    process forked from the (already initialized) main process, so that it
+    inherits all imported modules and objects, such as the imageObject
+    instances, without needing to pickle them. At most ``size`` of them are
+    running at any one time, with a new one being started as soon as any
+    previous one finishes.
+
+    ``num_cores`` is the user-specified number of cores the pool was sized
+    from, `None` when it was sized from the number of available cores.
+
+    A single ``multiprocessing.Manager`` gets started (only when first
+    needed) for sharing in-memory outputs with the workers, and is kept for
+    use by all steps until the pool gets closed.
+    """
+    def __init__(self, size, num_cores=None):
+        self.size = size
+        self.num_cores = num_cores
+        self._manager = None
+
+    @property
+    def manager(self):
+        """ The ``multiprocessing.Manager`` shared by all steps. """
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager
+
+    def run(self, target, arglist, name=None, pool_size=None):
+        """ Run ``target(*args)`` for each set of ``args`` in ``arglist``
+        in parallel, blocking until all of them are done.
+
+        Parameters
+        ----------
+        target : function
+            Function to be run by each worker
+
+        arglist : list
+            List of argument tuples, one for each task
+
+        name : str, optional
+            Name of the task, as reported in error messages
+
+        pool_size : int, optional
+            Maximum number of tasks to run at the same time, if fewer
+            than the size of the pool.
+
+        """
+        nworkers = self.size if pool_size is None else min(self.size, pool_size)
+        nworkers = max(nworkers, 1)
+
+        pending = [multiprocessing.Process(target=target, name=name, args=args)
+                   for args in arglist]
+        running = []
+        failed = []
+        while pending or running:
+            while pending and len(running) < nworkers:
+                p = pending.pop(0)
+                p.start()
+                running.append(p)
+
+            # wait for any of the running workers to finish
+            multiprocessing.connection.wait([p.sentinel for p in running])
+            for p in running[:]:
+                if not p.is_alive():
+                    p.join()
+                    running.remove(p)
+                    if p.exitcode != 0:
+                        failed.append(p)
+
+        if failed:
+            raise RuntimeError("Problem during: " + str(failed[0].name) +
+                               ', exitcode: ' + str(failed[0].exitcode) +
+                               '. Check log.')
+
+    def close(self):
+        """ Shut down the shared manager, if one was started. """
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+_worker_pool = None
+
+def start_worker_pool(num_cores):
+    """ Start the worker pool to be used by all the steps of an AstroDrizzle
+    session, sized according to the user-specified ``num_cores``.
+    """
+    global _worker_pool
+    end_worker_pool()
+    _worker_pool = WorkerPool(get_pool_size(num_cores, None), num_cores)
+    return _worker_pool
+
+def end_worker_pool():
+    """ Close the worker pool of the current AstroDrizzle session, if any. """
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool = None
+
+def has_worker_pool():
+    """ Report whether an AstroDrizzle session has started a worker pool. """
+    return _worker_pool is not None
+
+def get_worker_pool(num_cores=None):
+    """ Return the worker pool of the current AstroDrizzle session. When a
+    step is being run on its own, outside of a session, a new pool sized
+    according to ``num_cores`` gets returned instead.
+    """
+    if _worker_pool is not None:
+        return _worker_pool
+    return WorkerPool(get_pool_size(num_cores, None), num_cores)
+
+
+class SharedOutputs(dict):
+    """ Dictionary holding the in-memory (virtual) output products of an
+    ``imageObject``, which can also be updated by parallel workers.
+
+    Once :py:meth:`share` has been called, any product saved by a worker
+    process gets its data arrays copied into ``multiprocessing.shared_memory``
+    blocks, with only the names of those blocks (along with the headers)
+    being passed back through the worker pool's manager. The main process
+    then maps those blocks directly into its own copy of the products
+    when :py:meth:`collect` gets called, without any further copying or
+    pickling of the data arrays.
+
+    Without ``shared_memory`` support (python < 3.8), the products themselves
+    get passed back through the manager instead.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._published = None
+        self._owner = os.getpid()
+        self._blocks = []
+        # names of the blocks last published for each product by a worker
+        self._sent = {}
+
+    def share(self, manager):
+        """ Start accepting products saved by worker processes. """
+        if shared_memory is not None:
+            # The resource tracker must already be running in this process,
+            # otherwise each worker would start (and then stop) its own,
+            # removing the blocks as soon as the worker finishes.
+            resource_tracker.ensure_running()
+        self._owner = os.getpid()
+        self._published = manager.dict()
+        self._sent = {}
+
+    def collect(self):
+        """ Add all products saved by worker processes to this dictionary,
+        and stop sharing.
+        """
+        if self._published is None:
+            return
+        for name, value in self._published.items():
+            super().__setitem__(name, self._attach(value))
+        self._published = None
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        if self._published is not None and os.getpid() != self._owner:
+            desc = self._detach(value)
+            self._published[name] = desc
+            # The blocks published before for the same product can no
+            # longer be reached by the main process, so remove them now:
+            for block_name in self._sent.pop(name, []):
+                _unlink_block(block_name)
+            self._sent[name] = self._block_names(desc)
+
+    def close(self):
+        """ Release all shared memory blocks mapped in by this process. """
+        blocks, self._blocks = self._blocks, []
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # data still in use elsewhere, so keep it mapped for now
+                self._blocks.append(block)
+
+    def __del__(self):
+        self.clear()
+        self.close()
+
+    @staticmethod
+    def _detach(value):
+        """ Copy the data from an HDU or HDUList into new shared memory
+        blocks, returning a picklable description of it.
+        """
+        if shared_memory is None or value is None:
+            return value
+
+        if isinstance(value, fits.HDUList):
+            hdus = list(value)
+        else:
+            hdus = [value]
+        desc = []
+        for hdu in hdus:
+            data = hdu.data
+            block = None
+            if isinstance(data, np.ndarray) and data.nbytes > 0:
+                data = np.ascontiguousarray(data)
+                block = shared_memory.SharedMemory(create=True,
+                                                   size=data.nbytes)
+                np.ndarray(data.shape, dtype=data.dtype,
+                           buffer=block.buf)[...] = data
+                block.close()
+                data = (block.name, data.shape, data.dtype.str)
+            desc.append((type(hdu), hdu.header, data, block is not None))
+        return (isinstance(value, fits.HDUList), desc)
+
+    @staticmethod
+    def _block_names(value):
+        """ Return the names of the shared memory blocks used by a product
+        described by :py:meth:`_detach`.
+        """
+        if shared_memory is None or value is None:
+            return []
+        return [data[0] for hdu_class, header, data, in_block in value[1]
+                if in_block]
+
+    def _attach(self, value):
+        """ Rebuild an HDU or HDUList described by :py:meth:`_detach`, with
+        its data arrays mapped directly from the shared memory blocks.
+        """
+        if shared_memory is None or value is None:
+            return value
+
+        is_hdulist, desc = value
+        hdus = []
+        for hdu_class, header, data, in_block in desc:
+            if in_block:
+                name, shape, dtype = data
+                block = shared_memory.SharedMemory(name=name)
+                # Nothing else needs this block by name any longer, the
+                # memory itself gets released once it is no longer mapped.
+                block.unlink()
+                self._blocks.append(block)
+                data = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            hdus.append(hdu_class(data=data, header=header))
+        return fits.HDUList(hdus) if is_hdulist else hdus[0]
+
+
+def _unlink_block(name):
+    """ Remove a shared memory block created by this process. """
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
 DEFAULT_LOGNAME = 'astrodrizzle.log'
 blank_list = [None, '', ' ', 'None', 'INDEF']
 
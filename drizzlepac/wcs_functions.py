@@ -5,8 +5,13 @@
 :License: :doc:`LICENSE`
 
 """
-from astropy.io import fits as pyfits
+import os
 import copy
+import hashlib
+import tempfile
+import shutil
+
+from astropy.io import fits as pyfits
 import numpy as np
 from numpy import linalg
 
@@ -120,6 +125,198 @@ class LinearMap:
         return np.dot(self.transform, [pixx, pixy]) + self.offset
 
 
+##
+#
+# ### Cache of the tables used by the default C-based mapping
+#
+##
+class PixmapCache:
+    """ Cache of the tables of output pixel positions computed by
+    ``cdriz.DefaultWCSMapping`` for each input chip.
+
+    Building a ``DefaultWCSMapping`` requires evaluating the full distortion
+    model (SIP, NPOL and D2IM) of the chip on a grid of points spaced by
+    ``stepsize`` pixels. The single drizzle, blot and final drizzle steps
+    all map each chip onto the same output frame, so the table computed by
+    the first of them gets reused by the others. Tables are identified by
+    a hash of the input and output WCS (including the distortion lookup
+    tables), the size of the chip and the step size, so that any change
+    to the alignment gets picked up automatically.
+
+    When ``directory`` gets specified, the tables also get saved there as
+    ``.npy`` files, making them available to parallel workers as well as
+    to later runs on the same (aligned) images.
+    """
+    def __init__(self, directory=None, shared=False):
+        self._tables = {}
+        self._tmpdir = None
+        if not directory and shared:
+            # Pass tables between parallel workers through a session
+            # directory, removed when the cache gets closed
+            directory = self._tmpdir = tempfile.mkdtemp(prefix='pixmap_')
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+
+    @staticmethod
+    def get_key(input_wcs, output_wcs, stepsize):
+        """ Return the key identifying the mapping from ``input_wcs`` to
+        ``output_wcs`` computed with the given ``stepsize``.
+        """
+        digest = hashlib.sha1()
+        for w in (input_wcs, output_wcs):
+            digest.update(w.to_header_string(relax=True).encode())
+            for arr in (w.wcs.crpix, w.wcs.crval, w.wcs.cdelt, w.wcs.get_pc()):
+                digest.update(np.asarray(arr, dtype=np.float64).tobytes())
+            if w.sip is not None:
+                for arr in (w.sip.a, w.sip.b, w.sip.crpix):
+                    digest.update(np.asarray(arr, dtype=np.float64).tobytes())
+            for lut in (w.cpdis1, w.cpdis2, w.det2im1, w.det2im2):
+                if lut is None:
+                    digest.update(b'-')
+                    continue
+                digest.update(np.asarray(lut.data, dtype=np.float32).tobytes())
+                for arr in (lut.crpix, lut.crval, lut.cdelt):
+                    digest.update(np.asarray(arr, dtype=np.float64).tobytes())
+        digest.update(repr((tuple(input_wcs.pixel_shape), float(stepsize))).encode())
+        return digest.hexdigest()
+
+    def get_mapping(self, input_wcs, output_wcs, stepsize):
+        """ Return a ``cdriz.DefaultWCSMapping`` from ``input_wcs`` to
+        ``output_wcs``, reusing the cached table when available.
+        """
+        from . import cdriz
+
+        nx, ny = input_wcs.pixel_shape
+        if stepsize <= 0:
+            # Mapping gets computed directly for every pixel; nothing to cache
+            return cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny,
+                                           stepsize)
+
+        key = self.get_key(input_wcs, output_wcs, stepsize)
+        table = self._tables.get(key)
+        fname = None
+        if self.directory:
+            fname = os.path.join(self.directory, 'pixmap_{:s}.npy'.format(key))
+            if table is None and os.path.exists(fname):
+                try:
+                    table = np.load(fname)
+                except (OSError, ValueError):
+                    log.warning('Could not read cached pixel mapping {:s}'
+                                .format(fname))
+
+        if table is not None:
+            try:
+                mapping = cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny,
+                                                  stepsize, table=table)
+                self._tables[key] = table
+                return mapping
+            except ValueError:
+                log.warning('Ignoring invalid cached pixel mapping')
+
+        mapping = cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny, stepsize)
+        table = mapping.get_table()
+        self._tables[key] = table
+        if fname is not None:
+            # Write to a temporary file first, so that other processes never
+            # see a partially written table
+            tmpname = '{:s}.{:d}.tmp.npy'.format(fname[:-4], os.getpid())
+            try:
+                np.save(tmpname, table)
+                os.replace(tmpname, fname)
+            except OSError:
+                log.warning('Could not save pixel mapping to {:s}'.format(fname))
+
+        return mapping
+
+    def close(self):
+        """ Forget all cached tables, and remove the session directory, if
+        one had to be created.
+        """
+        self._tables.clear()
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+            self.directory = None
+
+
+_pixmap_cache = None
+
+def start_pixmap_cache(directory=None, shared=False):
+    """ Start the pixel mapping cache to be used by all the steps of an
+    AstroDrizzle session. Set ``shared`` when steps may be run by parallel
+    workers, so that tables computed by the workers get passed on.
+    """
+    global _pixmap_cache
+    end_pixmap_cache()
+    _pixmap_cache = PixmapCache(directory=directory, shared=shared)
+    return _pixmap_cache
+
+def end_pixmap_cache():
+    """ Close the pixel mapping cache of the current AstroDrizzle session. """
+    global _pixmap_cache
+    if _pixmap_cache is not None:
+        _pixmap_cache.close()
+        _pixmap_cache = None
+
+def get_default_mapping(input_wcs, output_wcs, stepsize):
+    """ Return a ``cdriz.DefaultWCSMapping`` from ``input_wcs`` to
+    ``output_wcs``, using the pixel mapping cache of the current
+    AstroDrizzle session, if any.
+    """
+    if _pixmap_cache is not None:
+        return _pixmap_cache.get_mapping(input_wcs, output_wcs, stepsize)
+
+    from . import cdriz
+    return cdriz.DefaultWCSMapping(input_wcs, output_wcs,
+                                   input_wcs.pixel_shape[0],
+                                   input_wcs.pixel_shape[1], stepsize)
+
+
+def calc_pixmap(mapping, shape):
+    """ Compute the full-frame pixel map of an image of the given ``shape``
+    (``(ny, nx)``) with a single vectorized call to ``mapping``.
+
+    ``mapping`` takes arrays of 1-based input pixel positions and returns
+    the 1-based output pixel positions, like the ``forward`` method of the
+    `WCSMap`, `IdentityMap` and `LinearMap` classes. The result is a
+    ``(ny, nx, 2)`` array holding the 0-based output ``(x, y)`` position of
+    the center of each input pixel, suitable for use as the ``pixmap`` of
+    ``adrizzle.do_driz()`` and ``ablot.do_blot()``.
+    """
+    ny, nx = shape
+    y, x = np.indices((ny, nx), dtype=np.float64)
+    outx, outy = mapping(x.ravel() + 1.0, y.ravel() + 1.0)
+    pixmap = np.empty((ny, nx, 2), dtype=np.float64)
+    pixmap[..., 0] = np.reshape(outx, (ny, nx)) - 1.0
+    pixmap[..., 1] = np.reshape(outy, (ny, nx)) - 1.0
+    return pixmap
+
+def pixmap_to_mapping(pixmap):
+    """ Return a ``cdriz.DefaultWCSMapping`` interpolating the full-frame
+    ``(ny, nx, 2)`` pixel map computed by `calc_pixmap`, so that the mapping
+    gets applied entirely in C, without calling back into Python.
+    """
+    from . import cdriz
+
+    pixmap = np.asarray(pixmap, dtype=np.float64)
+    if pixmap.ndim != 3 or pixmap.shape[2] != 2 or min(pixmap.shape[:2]) < 2:
+        raise ValueError("Pixel map needs to have a shape of (ny, nx, 2), "
+                         "with nx and ny of at least 2")
+    ny, nx = pixmap.shape[:2]
+
+    # The table gets sampled at 1-based pixel positions, from 0 to n + 1,
+    # so pad the (1-based) pixel map by extrapolating one pixel on each side
+    table = np.empty((ny + 2, nx + 2, 2), dtype=np.float64)
+    table[1:-1, 1:-1] = pixmap + 1.0
+    table[1:-1, 0] = 2.0 * table[1:-1, 1] - table[1:-1, 2]
+    table[1:-1, -1] = 2.0 * table[1:-1, -2] - table[1:-1, -3]
+    table[0] = 2.0 * table[1] - table[2]
+    table[-1] = 2.0 * table[-2] - table[-3]
+
+    return cdriz.DefaultWCSMapping(None, None, nx, ny, 1.0, table=table)
+
+
 # Stand-alone functions for WCS handling
 def get_hstwcs(filename, hdulist, extnum):
     """ Return the HSTWCS object for a given chip. """
@@ -355,6 +552,28 @@ def make_outputwcs(imageObjectList, output, configObj=None, perfect=False):
         outwcs.final_wcs = mergeWCS(default_wcs, final_pars)
         outwcs.wcs = outwcs.final_wcs.copy()
 
+    # New inputs drizzled onto an existing product need to use the output
+    # frame of that product, and add to its exposure time.
+    if final_step['driz_combine'] and final_step.get('final_update', False):
+        if configObj['build']:
+            prodname = outwcs.outputNames['outFinal']
+        else:
+            prodname = outwcs.outputNames['outSci']
+        if os.path.exists(prodname):
+            extnum = util.findWCSExtn(prodname)
+            print('Creating OUTPUT WCS from existing product {}[{}]'.format(prodname, extnum))
+            outwcs.final_wcs = wcsutil.HSTWCS('{}[{}]'.format(prodname, extnum))
+            outwcs.wcs = outwcs.final_wcs.copy()
+
+            prodhdr = pyfits.getheader(prodname)
+            outwcs._exptime += prodhdr.get('EXPTIME', 0.0)
+            outwcs._expstart = min(outwcs._expstart,
+                                   prodhdr.get('EXPSTART', outwcs._expstart))
+            outwcs._expend = max(outwcs._expend,
+                                 prodhdr.get('EXPEND', outwcs._expend))
+            scihdr = pyfits.getheader(prodname, ext=int(extnum))
+            outwcs.nimages += scihdr.get('NCOMBINE', 0)
+
     # Apply user settings to create custom output_wcs instances
     # for each drizzle step
     updateImageWCS(imageObjectList, outwcs)
@@ -443,6 +662,108 @@ def calcNewEdges(wcs, shape):
     return edges
 
 
+def calcOutputBounds(input_wcs, output_wcs, margin=0):
+    """
+    Compute the bounding box of an input image in the pixel frame of
+    the output WCS, based on the positions of all the pixels around the
+    edge of the input image (as computed by `calcNewEdges`).
+
+    Parameters
+    ----------
+    input_wcs : obj
+        HSTWCS object for the input image
+
+    output_wcs : obj
+        HSTWCS object defining the output frame
+
+    margin : int
+        Number of output pixels to pad the bounding box on each side
+
+    Returns
+    -------
+    bounds : tuple or None
+        ``(xmin, xmax, ymin, ymax)`` as 0-based, inclusive pixel indices
+        in the output frame, clipped to the size of the output frame,
+        or `None` if the input image does not overlap the output frame at all.
+
+    """
+    onx, ony = output_wcs.pixel_shape
+    edges = calcNewEdges(input_wcs, input_wcs.array_shape)
+    xout, yout = output_wcs.wcs_world2pix(edges[0], edges[1], 0)
+
+    if not (np.all(np.isfinite(xout)) and np.all(np.isfinite(yout))):
+        # No reliable bounds can be determined, so use the full frame
+        return (0, onx - 1, 0, ony - 1)
+
+    xmin = int(np.floor(xout.min())) - margin
+    xmax = int(np.ceil(xout.max())) + margin
+    ymin = int(np.floor(yout.min())) - margin
+    ymax = int(np.ceil(yout.max())) + margin
+
+    if xmax < 0 or ymax < 0 or xmin > onx - 1 or ymin > ony - 1:
+        return None
+
+    return (max(xmin, 0), min(xmax, onx - 1), max(ymin, 0), min(ymax, ony - 1))
+
+
+def calcInputRows(input_wcs, output_wcs, bounds, margin=0, npoints=64):
+    """
+    Compute the range of rows of an input image which map within the given
+    bounds of the output frame, based on the positions of points along the
+    edges of those bounds mapped back onto the input image.
+
+    Parameters
+    ----------
+    input_wcs : obj
+        HSTWCS object for the input image
+
+    output_wcs : obj
+        HSTWCS object defining the output frame
+
+    bounds : tuple
+        ``(xmin, xmax, ymin, ymax)`` as 0-based, inclusive pixel indices
+        in the output frame
+
+    margin : int
+        Number of input rows to pad the range on each side
+
+    npoints : int
+        Number of points used along each edge of the bounds
+
+    Returns
+    -------
+    rows : tuple or None
+        ``(ymin, ymax)`` as 0-based, inclusive row indices of the input
+        image, clipped to the size of the input image, or `None` if no
+        row of the input image maps within the bounds.
+
+    """
+    ny = input_wcs.array_shape[0]
+    xmin, xmax, ymin, ymax = bounds
+    xside = np.linspace(xmin - 0.5, xmax + 0.5, npoints)
+    yside = np.linspace(ymin - 0.5, ymax + 0.5, npoints)
+    x = np.concatenate([xside, xside, np.full(npoints, xmin - 0.5),
+                        np.full(npoints, xmax + 0.5)])
+    y = np.concatenate([np.full(npoints, ymin - 0.5), np.full(npoints, ymax + 0.5),
+                        yside, yside])
+
+    ra, dec = output_wcs.wcs_pix2world(x, y, 0)
+    try:
+        xin, yin = input_wcs.all_world2pix(ra, dec, 0, quiet=True)
+    except Exception:
+        # No reliable range can be determined, so use all rows
+        return (0, ny - 1)
+    if not np.all(np.isfinite(yin)):
+        return (0, ny - 1)
+
+    rmin = int(np.floor(yin.min())) - margin
+    rmax = int(np.ceil(yin.max())) + margin
+    if rmax < 0 or rmin > ny - 1:
+        return None
+
+    return (max(rmin, 0), min(rmax, ny - 1))
+
+
 def computeEdgesCenter(edges):
     alpha = np.deg2rad(edges[0])
     dec = np.deg2rad(edges[1])
@@ -19,6 +19,8 @@
 #include "cdrizzleutil.h"
 #include "cdrizzlewcs.h"
 
+#define TDRIZ_VERSION "Callable C-based DRIZZLE Version 0.8 (20th May 2009)"
+
 static PyObject *gl_Error;
 
 
@@ -167,26 +169,50 @@ PyWCSMap_init(PyWCSMap *self, PyObject *args, PyObject *kwds)
   PyObject *output_obj = NULL;
   int nx, ny;
   double factor;
+  /* Optional table of output positions computed by an earlier mapping */
+  PyObject *table_obj = Py_None;
+  PyArrayObject *table = NULL;
   int status = -1;
 
   /* Other miscellaneous local variables */
   struct driz_error_t error;
   int istat = 1;
 
+  static char *kwlist[] = {"", "", "", "", "", "table", NULL};
+
   driz_error_init(&error);
 
   /* TODO: Make factor a kwarg */
-  if (! PyArg_ParseTuple(args, "OOiid:DefaultWCSMapping.__init__",
-                         &input_obj, &output_obj, &nx, &ny, &factor)){
+  if (! PyArg_ParseTupleAndKeywords(args, kwds, "OOiid|O:DefaultWCSMapping.__init__",
+                         kwlist, &input_obj, &output_obj, &nx, &ny, &factor,
+                         &table_obj)){
     goto exit;
   }
 
-  /* Create the C struct from all of these mapping parameters */
-  istat = default_wcsmap_init(
-      &self->m,
-      &((Wcs*)input_obj)->x, &((Wcs*)output_obj)->x,
-      nx, ny, factor,
-      &error);
+  if (table_obj != Py_None) {
+    /* Reuse the table, rather than evaluating the WCS for every point */
+    table = (PyArrayObject*)PyArray_ContiguousFromAny(table_obj, NPY_FLOAT64, 3, 3);
+    if (table == NULL) {
+      goto exit;
+    }
+    if (factor <= 0 ||
+        PyArray_DIM(table, 0) != (int)((double)ny / factor) + 2 ||
+        PyArray_DIM(table, 1) != (int)((double)nx / factor) + 2 ||
+        PyArray_DIM(table, 2) != 2) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Mapping table does not match the image size and step size");
+      goto exit;
+    }
+    istat = default_wcsmap_init_table(
+        &self->m, nx, ny, factor, (double*)PyArray_DATA(table), &error);
+  } else {
+    /* Create the C struct from all of these mapping parameters */
+    istat = default_wcsmap_init(
+        &self->m,
+        &((Wcs*)input_obj)->x, &((Wcs*)output_obj)->x,
+        nx, ny, factor,
+        &error);
+  }
 
   if (istat || driz_error_is_set(&error)) {
     if (strcmp(driz_error_get_message(&error), "<PYTHON>") != 0)
@@ -202,10 +228,43 @@ PyWCSMap_init(PyWCSMap *self, PyObject *args, PyObject *kwds)
   status = 0;
 
  exit:
+  Py_XDECREF(table);
 
   return status;
 }
 
+static PyObject*
+PyWCSMap_get_table(PyWCSMap* self, PyObject* args UNUSED_PARAM)
+{
+  npy_intp dims[3];
+  PyArrayObject* table = NULL;
+
+  if (self->m.table == NULL) {
+    Py_RETURN_NONE;
+  }
+
+  dims[0] = self->m.sny;
+  dims[1] = self->m.snx;
+  dims[2] = 2;
+  table = (PyArrayObject*)PyArray_SimpleNew(3, dims, NPY_FLOAT64);
+  if (table == NULL) {
+    return NULL;
+  }
+  memcpy(PyArray_DATA(table), self->m.table,
+         (size_t)dims[0] * (size_t)dims[1] * 2 * sizeof(double));
+
+  return (PyObject*)table;
+}
+
+static PyMethodDef PyWCSMap_methods[] = {
+  {"get_table", (PyCFunction)PyWCSMap_get_table, METH_NOARGS,
+   "get_table()\n\nReturn a copy of the table of output positions used for "
+   "interpolating the mapping, of shape (sny, snx, 2), or None when not "
+   "interpolating.  It can be passed back as 'table' to avoid evaluating "
+   "the WCS again for the same input, output and step size."},
+  {NULL, NULL, 0, NULL}  /* sentinel */
+};
+
 static PyObject*
 PyWCSMap_call(PyWCSMap* self, PyObject* args, PyObject* kwargs)
 {
@@ -302,14 +361,14 @@ static PyTypeObject WCSMapType = {
   0,                                               /*tp_setattro*/
   0,                                               /*tp_as_buffer*/
   (long) Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
-  (char *) "DefaultWCSMapping(input,output)",      /* tp_doc */
+  (char *) "DefaultWCSMapping(input, output, nx, ny, factor, table=None)", /* tp_doc */
   0,                                               /* tp_traverse */
   0,                                               /* tp_clear */
   0,                                               /* tp_richcompare */
   0,                                               /* tp_weaklistoffset */
   0,                                               /* tp_iter */
   0,                                               /* tp_iternext */
-  0,                                               /* tp_methods */
+  PyWCSMap_methods,                                /* tp_methods */
   0,                                               /* tp_members */
   0,                                               /* tp_getset */
   0,                                               /* tp_base */
@@ -322,8 +381,176 @@ static PyTypeObject WCSMapType = {
   PyWCSMap_new,                                    /* tp_new */
 };
 
+/**
+
+Code to split the drizzling or blotting of a single image across
+several native threads.
+
+Each thread works on its own band of lines of the output window, using
+its own copy of the parameters, so that no output pixel ever gets
+updated by more than one thread and the results are the same as when
+using a single thread.  This only gets used with the (thread-safe)
+interpolated C-based mapping, and runs without holding the GIL.
+
+*/
+struct driz_thread_t {
+  struct driz_param_t p;
+  integer_t ystart;
+  integer_t nmiss;
+  integer_t nskip;
+  int istat;
+  struct driz_error_t error;
+  PyThread_type_lock done;
+};
+
+typedef void (*driz_thread_func_t)(void*);
+
+static void
+dobox_thread(void* arg) {
+  struct driz_thread_t* t = (struct driz_thread_t*)arg;
+
+  t->istat = dobox(&t->p, t->ystart, &t->nmiss, &t->nskip, &t->error);
+  if (t->done != NULL) PyThread_release_lock(t->done);
+}
+
+static void
+doblot_thread(void* arg) {
+  struct driz_thread_t* t = (struct driz_thread_t*)arg;
+
+  t->istat = doblot(&t->p, &t->error);
+  if (t->done != NULL) PyThread_release_lock(t->done);
+}
+
+static int
+run_threads(struct driz_param_t* p, const integer_t ystart,
+            const integer_t y1, const integer_t y2, const int nthreads,
+            driz_thread_func_t func,
+            /* Output parameters */
+            integer_t* nmiss, integer_t* nskip,
+            struct driz_error_t* error) {
+  struct driz_thread_t* threads = NULL;
+  struct driz_thread_t* t = NULL;
+  integer_t nlines = y2 - y1 + 1;
+  integer_t width = p->wxmax - p->wxmin + 1;
+  size_t offset;
+  int i;
+
+  threads = (struct driz_thread_t*)malloc(nthreads * sizeof(struct driz_thread_t));
+  if (threads == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    return 1;
+  }
+
+  for (i = 0; i < nthreads; ++i) {
+    t = &threads[i];
+    t->p = *p;
+    t->p.wymin = y1 + (integer_t)(((double)nlines * i) / nthreads);
+    t->p.wymax = y1 + (integer_t)(((double)nlines * (i + 1)) / nthreads) - 1;
+
+    /* The output arrays start at the first line of each band */
+    offset = (size_t)(t->p.wymin - p->wymin) * (size_t)width;
+    if (t->p.output_data != NULL) t->p.output_data += offset;
+    if (t->p.output_counts != NULL) t->p.output_counts += offset;
+    if (t->p.output_context != NULL) t->p.output_context += offset;
+
+    t->ystart = ystart;
+    t->nmiss = 0;
+    t->nskip = 0;
+    t->istat = 0;
+    driz_error_init(&t->error);
+
+    /* The lock is held until the thread is done; if no thread can be
+       started, the work just gets done here */
+    t->done = PyThread_allocate_lock();
+    if (t->done == NULL) {
+      func(t);
+      continue;
+    }
+    PyThread_acquire_lock(t->done, WAIT_LOCK);
+    if (PyThread_start_new_thread(func, t) == (unsigned long)-1) {
+      func(t);
+    }
+  }
+
+  for (i = 0; i < nthreads; ++i) {
+    t = &threads[i];
+    if (t->done != NULL) {
+      PyThread_acquire_lock(t->done, WAIT_LOCK);
+      PyThread_release_lock(t->done);
+      PyThread_free_lock(t->done);
+    }
+  }
+
+  /* Lines skipped as being off the output are the same for all of the
+     threads, while points missing the output get counted by each thread
+     for its own band, so the smallest count is the closest to the total */
+  for (i = 0; i < nthreads; ++i) {
+    t = &threads[i];
+    if (t->istat && !driz_error_is_set(error)) {
+      driz_error_set_message(error, driz_error_get_message(&t->error));
+    }
+    if (i == 0 || t->nmiss < *nmiss) *nmiss = t->nmiss;
+    if (i == 0 || t->nskip < *nskip) *nskip = t->nskip;
+  }
+
+  free(threads);
+
+  return driz_error_is_set(error);
+}
+
+static int
+run_dobox(struct driz_param_t* p, const integer_t ystart, int nthreads,
+          /* Output parameters */
+          integer_t* nmiss, integer_t* nskip, struct driz_error_t* error) {
+  integer_t y1, y2;
+
+  if (nthreads > 1) {
+    /* Only do this once, rather than once for each thread */
+    if (convert_input_to_cps(p, error)) {
+      return 1;
+    }
+
+    /* Only split the part of the output the input actually lands on */
+    if (get_output_yrange(p, ystart, DRIZ_KERNEL_MARGIN(p), &y1, &y2, error)) {
+      return 1;
+    }
+    nthreads = (int)MIN((integer_t)nthreads, y2 - y1 + 1);
+  }
+
+  if (nthreads <= 1) {
+    return dobox(p, ystart, nmiss, nskip, error);
+  }
+
+  return run_threads(p, ystart, y1, y2, nthreads, dobox_thread,
+                     nmiss, nskip, error);
+}
+
+static int
+run_doblot(struct driz_param_t* p, int nthreads, struct driz_error_t* error) {
+  integer_t nmiss, nskip;
+
+  nthreads = (int)MIN((integer_t)nthreads, p->wymax - p->wymin + 1);
+  if (nthreads <= 1) {
+    return doblot(p, error);
+  }
+
+  return run_threads(p, 0, p->wymin, p->wymax, nthreads, doblot_thread,
+                     &nmiss, &nskip, error);
+}
+
+/*
+ Whether the drizzling or blotting can be done without the GIL, and so
+ also split across threads: the mapping must not call back into Python,
+ and the direct (stepsize=0) WCS mapping is not thread-safe either.
+*/
+static int
+can_release_gil(mapping_callback_t callback, void* callback_state) {
+  return (callback == default_wcsmap &&
+          ((struct wcsmap_param_t*)callback_state)->factor > 0);
+}
+
 static PyObject *
-tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
+tdriz(PyObject *obj UNUSED_PARAM, PyObject *args, PyObject *keywds)
 {
   /* Arguments in the order they appear */
   PyObject *oimg, *owei, *oout, *owht, *ocon;
@@ -336,6 +563,10 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   char *fillstr;
   integer_t nmiss, nskip, vflag;
   PyObject *callback_obj;
+  /* Optional keywords describing a tile of a larger output frame */
+  long outx0 = 0, outy0 = 0, outnx = -1, outny = -1;
+  /* Optional number of threads to split the drizzling across */
+  int nthreads = 1;
 
   /* Derived values */
   PyArrayObject *img = NULL, *wei = NULL, *out = NULL, *wht = NULL, *con = NULL;
@@ -358,12 +589,19 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
 
   driz_error_init(&error);
 
-  if (!PyArg_ParseTuple(args,"OOOOOllllldddsdssffsiiiO:tdriz",
+  static char *kwlist[] = {"", "", "", "", "", "", "", "", "", "", "", "",
+                           "", "", "", "", "", "", "", "", "", "", "", "",
+                           "outx0", "outy0", "outnx", "outny", "nthreads",
+                           NULL};
+
+  if (!PyArg_ParseTupleAndKeywords(args, keywds,
+                        "OOOOOllllldddsdssffsiiiO|lllli:tdriz", kwlist,
                         &oimg, &owei, &oout, &owht, &ocon, &uniqid, &ystart,
                         &xmin, &ymin, &dny, &scale, &xscale, &yscale,
                         &align_str, &pfract, &kernel_str, &inun_str,
                         &expin, &wtscl, &fillstr, &nmiss,&nskip, &vflag,
-                        &callback_obj)) {
+                        &callback_obj, &outx0, &outy0, &outnx, &outny,
+                        &nthreads)) {
     return PyErr_Format(gl_Error, "cdriz.tdriz: Invalid Parameters.");
   }
 
@@ -463,6 +701,23 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   onx = PyArray_DIMS(out)[1];
   ony = PyArray_DIMS(out)[0];
 
+  /* The output arrays may only hold a tile of the full output frame,
+     starting at (outx0, outy0) within a frame of size (outnx, outny).
+     By default, they hold the whole frame. */
+  if (outnx < 0) outnx = onx;
+  if (outny < 0) outny = ony;
+  if (outx0 < 0 || outy0 < 0 ||
+      outx0 + onx > outnx || outy0 + ony > outny) {
+    driz_error_set_message(&error, "Output arrays do not fit within the output frame");
+    goto _exit;
+  }
+
+  if (PyArray_DIMS(wht)[1] != onx || PyArray_DIMS(wht)[0] != ony ||
+      PyArray_DIMS(con)[1] != onx || PyArray_DIMS(con)[0] != ony) {
+    driz_error_set_message(&error, "Output arrays must all have the same shape");
+    goto _exit;
+  }
+
   nmiss = 0;
   nskip = 0;
 
@@ -479,8 +734,12 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   p.dnx = nx;
   p.dny = ny;
   p.ny = dny;
-  p.onx = p.xmax = onx;
-  p.ony = p.ymax = ony;
+  p.onx = p.xmax = outnx;
+  p.ony = p.ymax = outny;
+  p.wxmin = outx0;
+  p.wxmax = outx0 + onx - 1;
+  p.wymin = outy0;
+  p.wymax = outy0 + ony - 1;
   p.scale = scale;
   p.x_scale = xscale;
   p.y_scale = yscale;
@@ -499,8 +758,17 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   /*
   start_t = clock();
   */
+  DRIZLOG("-Drizzling using kernel = %s\n",kernel_enum2str(p.kernel));
+
   /* Do the drizzling */
-  if (dobox(&p, ystart, &nmiss, &nskip, &error)) {
+  if (can_release_gil(callback, callback_state)) {
+    Py_BEGIN_ALLOW_THREADS
+    istat = run_dobox(&p, ystart, nthreads, &nmiss, &nskip, &error);
+    Py_END_ALLOW_THREADS
+  } else {
+    istat = dobox(&p, ystart, &nmiss, &nskip, &error);
+  }
+  if (istat) {
     goto _exit;
   }
   /*
@@ -533,7 +801,7 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
       PyErr_SetString(PyExc_Exception, driz_error_get_message(&error));
     return NULL;
   } else {
-    return Py_BuildValue("sii", "Callable C-based DRIZZLE Version 0.8 (20th May 2009)", nmiss, nskip);
+    return Py_BuildValue("sii", TDRIZ_VERSION, nmiss, nskip);
   }
 }
 
@@ -623,7 +891,7 @@ twdriz(PyObject *obj, PyObject *args)
 
 
 static PyObject *
-tblot(PyObject *obj, PyObject *args)
+tblot(PyObject *obj, PyObject *args, PyObject *keywds)
 {
   /* Arguments in the order they appear */
   PyObject *oimg, *oout;
@@ -635,6 +903,8 @@ tblot(PyObject *obj, PyObject *args)
   float ef, misval, sinscl;
   long vflag;
   PyObject *callback_obj = NULL;
+  /* Optional number of threads to split the blotting across */
+  int nthreads = 1;
 
   PyArrayObject *img = NULL, *out = NULL;
   enum e_align_t align;
@@ -648,10 +918,14 @@ tblot(PyObject *obj, PyObject *args)
 
   driz_error_init(&error);
 
-  if (!PyArg_ParseTuple(args,"OOlllldfddssffflO:tblot", &oimg, &oout, &xmin,
+  static char *kwlist[] = {"", "", "", "", "", "", "", "", "", "", "", "",
+                           "", "", "", "", "", "nthreads", NULL};
+
+  if (!PyArg_ParseTupleAndKeywords(args, keywds,
+                        "OOlllldfddssffflO|i:tblot", kwlist, &oimg, &oout, &xmin,
                         &xmax, &ymin, &ymax, &scale, &kscale, &xscale,
                         &yscale, &align_str, &interp_str, &ef, &misval,
-                        &sinscl, &vflag, &callback_obj)){
+                        &sinscl, &vflag, &callback_obj, &nthreads)){
     return PyErr_Format(gl_Error, "cdriz.tblot: Invalid Parameters.");
   }
 
@@ -666,8 +940,15 @@ tblot(PyObject *obj, PyObject *args)
     goto _exit;
   }
 
-  callback = py_mapping_callback;
-  callback_state = (void *)callback_obj;
+  if (PyObject_TypeCheck(callback_obj, &WCSMapType)) {
+    /* If we're using the default mapping, we can set things up to avoid
+       the Python/C bridge */
+    callback = default_wcsmap;
+    callback_state = (void *)&(((PyWCSMap *)callback_obj)->m);
+  } else {
+    callback = py_mapping_callback;
+    callback_state = (void *)callback_obj;
+  }
 
   img = (PyArrayObject *)PyArray_ContiguousFromAny(oimg, NPY_FLOAT32, 2, 2);
   if (!img) {
@@ -702,6 +983,10 @@ tblot(PyObject *obj, PyObject *args)
   p.dny = ny;
   p.onx = onx;
   p.ony = ony;
+  p.wxmin = 0;
+  p.wxmax = onx - 1;
+  p.wymin = 0;
+  p.wymax = ony - 1;
   p.scale = scale;
   p.kscale = kscale;
   p.x_scale = xscale;
@@ -715,7 +1000,13 @@ tblot(PyObject *obj, PyObject *args)
   p.mapping_callback = callback;
   p.mapping_callback_state = callback_state;
 
-  istat = doblot(&p, &error);
+  if (can_release_gil(callback, callback_state)) {
+    Py_BEGIN_ALLOW_THREADS
+    istat = run_doblot(&p, nthreads, &error);
+    Py_END_ALLOW_THREADS
+  } else {
+    istat = doblot(&p, &error);
+  }
 
  _exit:
   Py_DECREF(img);
@@ -1165,9 +1456,9 @@ arrxyzero(PyObject *obj, PyObject *args)
 
 static PyMethodDef cdriz_methods[] =
   {
-    {"tdriz",  tdriz, METH_VARARGS, "tdriz(image, weight, output, outweight, context, uniqid, ystart, xmin, ymin, dny, scale, xscale, yscale, align, pfrace, kernel, inun, expin, wtscl, fill, nmiss, nskip, vflag, callback)"},
+    {"tdriz",  (PyCFunction)tdriz, METH_VARARGS|METH_KEYWORDS, "tdriz(image, weight, output, outweight, context, uniqid, ystart, xmin, ymin, dny, scale, xscale, yscale, align, pfrace, kernel, inun, expin, wtscl, fill, nmiss, nskip, vflag, callback, outx0=0, outy0=0, outnx=-1, outny=-1, nthreads=1)"},
     /*{"twdriz",  tdriz, METH_VARARGS, "triz(image, weight, output, outweight, ystart, xmin, ymin, dny, wcsin, wcsout,pxg,pyg,pfract, kernel, coeffs, fillstr,nmiss,nskip,vflag)"},*/
-    {"tblot",  tblot, METH_VARARGS, "tblot(image, output, xmin, xmax, ymin, ymax, scale, kscale, xscale, yscale, align, interp, ef, misval, sinscl, vflag, callback)"},
+    {"tblot",  (PyCFunction)tblot, METH_VARARGS|METH_KEYWORDS, "tblot(image, output, xmin, xmax, ymin, ymax, scale, kscale, xscale, yscale, align, interp, ef, misval, sinscl, vflag, callback, nthreads=1)"},
     {"arrmoments", arrmoments, METH_VARARGS, "arrmoments(image, p, q)"},
     {"arrxyround", arrxyround, METH_VARARGS, "arrxyround(data,x0,y0,skymode,ker2d,xsigsq,ysigsq,datamin,datamax)"},
     {"arrxyzero", arrxyzero, METH_VARARGS, "arrxyzero(imgxy,refxy,searchrad,zpmat)"},
@@ -1204,6 +1495,7 @@ PyObject *PyInit_cdriz(void)
 
   Py_INCREF(&WCSMapType);
   PyModule_AddObject(m, "DefaultWCSMapping", (PyObject *)&WCSMapType);
+  PyModule_AddStringConstant(m, "tdriz_version", TDRIZ_VERSION);
 
   return m;
 }
@@ -316,7 +316,9 @@ interpolate_nearest_neighbor(const void* state UNUSED_PARAM,
   assert(state == NULL);
   INTERPOLATION_ASSERTS;
 
-  *value = DATA_VALUE((integer_t)(x + 0.5), (integer_t)(y + 0.5));
+  /* x, y may lie up to a pixel past the last one */
+  *value = DATA_VALUE(MIN((integer_t)(x + 0.5), dnx - 1),
+                      MIN((integer_t)(y + 0.5), dny - 1));
   return 0;
 }
 
@@ -382,13 +384,13 @@ interpolate_bilinear(const void* state UNUSED_PARAM,
     hold12 = DATA_VALUE(nx, ny+1);
   }
 
-  if (nx >= dnx && ny >= dny) {
+  if (nx >= dnx - 1 && ny >= dny - 1) {
     hold22 = 2.0f * hold21 - (2.0f * DATA_VALUE(nx, ny-1) -
                               DATA_VALUE(nx-1, ny-1));
-  } else if (nx >= dnx) {
+  } else if (nx >= dnx - 1) {
     hold22 = 2.0f * hold12 - DATA_VALUE(nx-1, ny+1);
-  } else if (ny >= dny) {
-    hold22 = 2.0f * hold21 - DATA_VALUE(nx+1, ny+1);
+  } else if (ny >= dny - 1) {
+    hold22 = 2.0f * hold21 - DATA_VALUE(nx+1, ny-1);
   } else {
     hold22 = DATA_VALUE(nx+1, ny+1);
   }
@@ -489,34 +491,35 @@ interpolate_poly3(const void* state UNUSED_PARAM,
     }
   }
 
+  /* Reflect the rows past the last one of the data; the row at ny + 2
+     then holds row dny - 3 to reflect when there is only one row of data
+     past ny */
   lastrw = MIN(nterms - 1, dny - ny);
-  if (lastrw < nterms - 1) {
-    assert(lastrw >= 0 && lastrw < nterms);
+  assert(lastrw >= 1 && lastrw < nterms);
 
-    for (j = lastrw + 1; j <= nterms - 1; ++j) {
+  if (lastrw < nterms - 1) {
+    for (j = lastrw + 1; j <= nterms - 2; ++j) {
       assert(2*lastrw-j >= 0 && 2*lastrw-j < nterms);
-      assert(j >= 0 && j < 4);
 
       weighted_sum_vectors(nterms,
                            &coeff[lastrw][0], 2.0,
                            &coeff[2*lastrw-j][0], -1.0,
                            &coeff[j][0]);
     }
-  } else if (lastrw == 1) {
-    assert(lastrw >= 0 && lastrw < nterms);
 
-    weighted_sum_vectors(nterms,
-                         &coeff[lastrw][0], 2.0,
-                         &coeff[3][0], -1.0,
-                         &coeff[3][0]);
-  } else {
-    assert(lastrw >= 0 && lastrw < nterms);
-    assert(2*lastrw-3 >= 0 && 2*lastrw-3 < nterms);
+    if (lastrw == 1) {
+      weighted_sum_vectors(nterms,
+                           &coeff[lastrw][0], 2.0,
+                           &coeff[3][0], -1.0,
+                           &coeff[3][0]);
+    } else {
+      assert(2*lastrw-3 >= 0 && 2*lastrw-3 < nterms);
 
-    weighted_sum_vectors(nterms,
-                         &coeff[lastrw][0], 2.0,
-                         &coeff[2*lastrw-3][0], -1.0,
-                         &coeff[3][0]);
+      weighted_sum_vectors(nterms,
+                           &coeff[lastrw][0], 2.0,
+                           &coeff[2*lastrw-3][0], -1.0,
+                           &coeff[3][0]);
+    }
   }
 
   xval = 2.0f + (x - (float)nx);
@@ -614,8 +617,11 @@ interpolate_poly5(const void* state UNUSED_PARAM,
     }
   }
 
+  /* Reflect the rows past the last one of the data; the row at ny + 3
+     then holds row dny - 4 to reflect when there is only one row of data
+     past ny */
   lastrw = MIN(nterms - 1, dny - ny + 1);
-  assert(lastrw < nterms);
+  assert(lastrw >= 2 && lastrw < nterms);
 
   if (lastrw < nterms - 1) {
     for (j = lastrw + 1; j <= nterms - 2; ++j) {
@@ -626,18 +632,20 @@ interpolate_poly5(const void* state UNUSED_PARAM,
                            &coeff[2*lastrw-j][0], -1.0,
                            &coeff[j][0]);
     }
-  } else if (lastrw == 2) {
-    weighted_sum_vectors(nterms,
-                         &coeff[2][0], 2.0,
-                         &coeff[5][0], -1.0,
-                         &coeff[5][0]);
-  } else {
-    assert(2*lastrw - 5 >= 0 && 2*lastrw-5 < nterms);
 
-    weighted_sum_vectors(nterms,
-                         &coeff[lastrw][0], 2.0,
-                         &coeff[2*lastrw-5][0], -1.0,
-                         &coeff[5][0]);
+    if (lastrw == 2) {
+      weighted_sum_vectors(nterms,
+                           &coeff[2][0], 2.0,
+                           &coeff[5][0], -1.0,
+                           &coeff[5][0]);
+    } else {
+      assert(2*lastrw - 5 >= 0 && 2*lastrw-5 < nterms);
+
+      weighted_sum_vectors(nterms,
+                           &coeff[lastrw][0], 2.0,
+                           &coeff[2*lastrw-5][0], -1.0,
+                           &coeff[5][0]);
+    }
   }
 
   xval = 3.0f + (x - (float)nx);
@@ -680,15 +688,12 @@ interpolate_sinc_(const float* data, const integer_t firstt,
   const float a4 = 0.03705f;
   float taper[INTERPOLATE_SINC_NCONV];
   float ac[INTERPOLATE_SINC_NCONV], ar[INTERPOLATE_SINC_NCONV];
-  float sdx, dx, dy, dxn, dyn, dx2;
+  float sdx, dx, dy, dx2;
   float ax, ay, px, py;
   float sum, sumx, sumy;
   float tmp;
-  integer_t minj, maxj, offj;
-  integer_t mink, maxk, offk;
-  integer_t nx, ny;
-  integer_t i, j, k, m, index;
-  integer_t indices[3][4];
+  integer_t nx, ny, row, col;
+  integer_t i, j, k, index;
 
   assert(x);
   assert(y);
@@ -732,28 +737,24 @@ interpolate_sinc_(const float* data, const integer_t firstt,
     dy = (y[i] - (float)ny) * sinscl;
 
     if (fabsf(dx) < mindx && fabsf(dy) < mindy) {
-      index = firstt + (ny - 1) * len_coeff + nx - 1; /* TODO: Base check */
+      index = firstt + ny * len_coeff + nx;
       value[i] = data[index];
       continue;
     }
 
-    dxn = 1.0f + (float)nsinc + dx;
-    dyn = 1.0f + (float)nsinc + dy;
     sumx = 0.0f;
     sumy = 0.0f;
     for (j = 0; j < nconv; ++j) {
-      /* TODO: These out of range indices also seem to be in Fortran... */
-      ax = dxn - (float)j - 1; /* TODO: Base check */
-      ay = dyn - (float)j - 1; /* TODO: Base check */
-      assert(ax != 0.0);
-      assert(ay != 0.0);
+      /* Distances to the pixels at offsets -nsinc...nsinc from nx, ny */
+      ax = dx - (float)(j - nsinc);
+      ay = dy - (float)(j - nsinc);
 
       if (ax == 0.0) {
         px = 1.0;
       } else if (dx == 0.0) {
         px = 0.0;
       } else {
-        px = taper[j - 1] / ax;
+        px = taper[j] / ax;
       }
 
       if (ay == 0.0) {
@@ -761,72 +762,29 @@ interpolate_sinc_(const float* data, const integer_t firstt,
       } else if (dy == 0.0) {
         py = 0.0;
       } else {
-        py = taper[j - 1] / ay;
+        py = taper[j] / ay;
       }
 
-      /* TODO: These out of range indices also seem to be in Fortran... */
-      ac[j - 1] = px;
-      ar[j - 1] = py;
+      ac[j] = px;
+      ar[j] = py;
       sumx += px;
       sumy += py;
     }
 
-    /* Compute the limits of the convolution */
-    minj = MAX(0, ny - nsinc - 1); /* TODO: Bases check */
-    maxj = MIN(lenary, ny + nsinc); /* TODO: Bases check */
-    offj = nsinc - ny; /* TODO: Bases check */
-
-    mink = MAX(0, nx - nsinc - 1); /* TODO: Bases check */
-    maxk = MIN(len_coeff, nx + nsinc); /* TODO: Bases check */
-    offk = nsinc - nx; /* TODO: Bases check */
-
+    /* Convolve, with the rows and columns beyond the edges of the data
+       taking the values of the edge ones */
     value[i] = 0.0;
+    for (j = 0; j < nconv; ++j) {
+      row = CLAMP(ny + j - nsinc, 0, lenary - 1);
+      index = firstt + row * len_coeff;
 
-    indices[0][0] = ny - nsinc;
-    indices[0][1] = minj - 1;
-    indices[0][2] = firstt;
-    indices[0][3] = 0;
-
-    indices[1][0] = minj;
-    indices[1][1] = maxj;
-    indices[1][2] = firstt;
-    indices[1][3] = len_coeff;
-
-    indices[2][0] = maxj + 1;
-    indices[2][1] = ny + nsinc;
-    indices[2][2] = firstt + (lenary - 1) * len_coeff;
-    indices[2][3] = 0;
-
-    for (m = 0; m < 3; ++m) {
-      for (j = indices[m][0]; j <= indices[m][1]; ++j) {
-        sum = 0.0;
-        index = indices[m][2] + j * indices[m][3];
-        assert(index >= 0 && index < len_coeff*lenary - 1);
-        assert(index+len_coeff >= 0 && index+len_coeff < len_coeff*lenary);
-
-        for (k = nx - nsinc; k < mink - 1; ++k) { /* TODO: Bases check */
-          assert(k+offk >= 0 && k+offk < INTERPOLATE_SINC_NCONV);
-
-          sum += ac[k+offk] * data[index+1];
-        }
-
-        for (k = mink; k <= maxk; ++k) { /* TODO: Bases check */
-          assert(k+offk >= 0 && k+offk < INTERPOLATE_SINC_NCONV);
-          assert(index+k >= 0 && index+k < len_coeff*lenary);
-
-          sum += ac[k+offk] * data[index+k];
-        }
-
-        for (k = maxk + 1; k <= nx + nsinc; ++k) {
-          assert(k+offk >= 0 && k+offk < INTERPOLATE_SINC_NCONV);
-
-          sum += ac[k+offk] * data[index+len_coeff];
-        }
-
-        assert(j + offj >= 0 && j + offj < INTERPOLATE_SINC_NCONV);
-
-        value[i] += ar[j + offj] * sum;
+      sum = 0.0;
+      for (k = 0; k < nconv; ++k) {
+        col = CLAMP(nx + k - nsinc, 0, len_coeff - 1);
+        sum += ac[k] * data[index + col];
       }
+
+      value[i] += ar[j] * sum;
     }
 
     assert(sumx != 0.0);
@@ -1101,8 +1059,9 @@ doblot(struct driz_param_t* p,
   yin[1] = 0.0;
   v = 1.0;
 
-  /* Outer look over output image pixels (X, Y) */
-  for (j = 0; j < p->ony; ++j) {
+  /* Outer look over output image pixels (X, Y), limited to the lines
+     of the output window */
+  for (j = p->wymin; j <= p->wymax; ++j) {
     yv = (double)j+1;
 
     yin[0] = yv;
@@ -1119,8 +1078,8 @@ doblot(struct driz_param_t* p,
       yo = (float)(yout[i] - dy);
 
       /* Check it is on the input image */
-      if (xo >= 0.0 && xo <= p->dnx &&
-          yo >= 0.0 && yo <= p->dny) {
+      if (xo >= 0.0 && xo < p->dnx &&
+          yo >= 0.0 && yo < p->dny) {
 
         /* Check for look-up-table interpolation */
         if (interpolate(state, p->data, p->dnx, p->dny, xo, yo, &v, error)) {
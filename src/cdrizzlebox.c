@@ -37,6 +37,9 @@ after applying the standard drizzle transformation.
 This is intended to allow the number of points which are needlessly
 drizzled outside the output image to be minimized.
 
+The range of output Y positions the line gets transformed to is also
+returned, as (ymin, ymax).
+
 was: CHOVER
 */
 #define CHECK_OVER_NPOINT 21
@@ -45,6 +48,7 @@ static int
 check_over(struct driz_param_t* p, const integer_t y, const integer_t margin,
            /* Output parameters */
            double* ofrac, integer_t* x1, integer_t* x2,
+           double* ymin, double* ymax,
            struct driz_error_t* error) {
   const integer_t npoint = CHECK_OVER_NPOINT;
   double xval[CHECK_OVER_NPOINT], yval[CHECK_OVER_NPOINT];
@@ -59,6 +63,8 @@ check_over(struct driz_param_t* p, const integer_t y, const integer_t margin,
   assert(ofrac);
   assert(x1);
   assert(x2);
+  assert(ymin);
+  assert(ymax);
   assert(error);
 
   if (p->dnx < npoint)
@@ -85,8 +91,12 @@ check_over(struct driz_param_t* p, const integer_t y, const integer_t margin,
     return 1;
 
   /* Check where the overlap starts and ends */
+  *ymin = yout[0];
+  *ymax = yout[0];
   for (i = 0; i < np; ++i) {
     logo[i] = 0;
+    *ymin = MIN(*ymin, yout[i]);
+    *ymax = MAX(*ymax, yout[i]);
   }
 
   for (i = 0; i < np - 1; ++i) {
@@ -208,8 +218,8 @@ update_context_image(struct driz_param_t* p, const integer_t ii, const integer_t
   assert(oldcon);
   assert(newcon);
   assert(error);
-  assert(ii >= 0 && ii < p->nsx);
-  assert(jj >= 0 && jj < p->nsy);
+  assert(ii >= p->wxmin && ii <= p->wxmax);
+  assert(jj >= p->wymin && jj <= p->wymax);
 
   /* Look up the current context value */
   icon = *output_context_ptr(p, ii, jj);
@@ -538,8 +548,8 @@ do_kernel_point(struct driz_param_t* p, const integer_t j,
     jj = fortran_round(*mapping_ptr(p, yo, i) - dy);
 
     /* Check it is on the output image */
-    if (ii >= 0 && ii < p->nsx &&
-        jj >= 0 && jj < p->nsy) {
+    if (ii >= p->wxmin && ii <= p->wxmax &&
+        jj >= p->wymin && jj <= p->wymax) {
       vc = *output_counts_ptr(p, ii, jj);
     /* Convert i,j 1-based pixel positions into 0-based
        indices for accessing data array. */
@@ -598,10 +608,10 @@ do_kernel_tophat(struct driz_param_t* p, const integer_t j,
     yyi = yy - p->pfo;
     yya = yy + p->pfo;
 
-    nxi = MAX(fortran_round(xxi), 0);
-    nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nxi = MAX(fortran_round(xxi), p->wxmin);
+    nxa = MIN(fortran_round(xxa), p->wxmax);
+    nyi = MAX(fortran_round(yyi), p->wymin);
+    nya = MIN(fortran_round(yya), p->wymax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -680,10 +690,10 @@ do_kernel_gaussian(struct driz_param_t* p, const integer_t j,
     yyi = yy - p->pfo;
     yya = yy + p->pfo;
 
-    nxi = MAX(fortran_round(xxi), 0);
-    nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nxi = MAX(fortran_round(xxi), p->wxmin);
+    nxa = MIN(fortran_round(xxa), p->wxmax);
+    nyi = MAX(fortran_round(yyi), p->wymin);
+    nya = MIN(fortran_round(yya), p->wymax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -762,10 +772,10 @@ do_kernel_lanczos(struct driz_param_t* p, const integer_t j,
     yyi = yy - p->pfo;
     yya = yy + p->pfo;
 
-    nxi = MAX(fortran_round(xxi), 0);
-    nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nxi = MAX(fortran_round(xxi), p->wxmin);
+    nxa = MIN(fortran_round(xxa), p->wxmax);
+    nyi = MAX(fortran_round(yyi), p->wymin);
+    nya = MIN(fortran_round(yya), p->wymax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -850,10 +860,10 @@ do_kernel_turbo(struct driz_param_t* p, const integer_t j,
     nxa = fortran_round(xxa);
     nyi = fortran_round(yyi);
     nya = fortran_round(yya);
-    iis = MAX(nxi, 0);  /* Needed to be set to 0 to avoid edge effects */
-    iie = MIN(nxa, p->nsx - 1);
-    jjs = MAX(nyi, 0);  /* Needed to be set to 0 to avoid edge effects */
-    jje = MIN(nya, p->nsy - 1);
+    iis = MAX(nxi, p->wxmin);  /* Clamp to the output window to avoid edge effects */
+    iie = MIN(nxa, p->wxmax);
+    jjs = MAX(nyi, p->wymin);  /* Clamp to the output window to avoid edge effects */
+    jje = MIN(nya, p->wymax);
 
     nhit = 0;
 
@@ -986,21 +996,21 @@ do_kernel_square(struct driz_param_t* p,
     nhit = 0;
 
     /* Allow for stretching because of scale change */
-    d = *data_ptr(p, i-1, j) * (float)p->scale2;
+    d = *data_ptr(p, i-1, (integer_t)y - 1) * (float)p->scale2;
 
     /* Scale the weighting mask by the scale factor and inversely by
        the Jacobian to ensure conservation of weight in the output */
     if (p->weights) {
-      w = *weights_ptr(p, i-1, j) * p->weight_scale;
+      w = *weights_ptr(p, i-1, (integer_t)y - 1) * p->weight_scale;
     } else {
       w = 1.0;
     }
 
     /* Loop over output pixels which could be affected */
-    min_jj = MAX(fortran_round(min_doubles(yout, 4)), 0);
-    max_jj = MIN(fortran_round(max_doubles(yout, 4)), p->nsy - 1);
-    min_ii = MAX(fortran_round(min_doubles(xout, 4)), 0);
-    max_ii = MIN(fortran_round(max_doubles(xout, 4)), p->nsx - 1);
+    min_jj = MAX(fortran_round(min_doubles(yout, 4)), p->wymin);
+    max_jj = MIN(fortran_round(max_doubles(yout, 4)), p->wymax);
+    min_ii = MAX(fortran_round(min_doubles(xout, 4)), p->wxmin);
+    max_ii = MIN(fortran_round(max_doubles(xout, 4)), p->wxmax);
 
     for (jj = min_jj; jj <= max_jj; ++jj) {
       for (ii = min_ii; ii <= max_ii; ++ii) {
@@ -1045,6 +1055,111 @@ kernel_handler_map[] = {
   do_kernel_lanczos
 };
 
+/**
+Convert the input data to counts per second, if needed, by dividing it
+by the exposure time.  The data gets updated in place, and the units
+reset to CPS, so that this only ever gets done once.
+*/
+int
+convert_input_to_cps(struct driz_param_t* p, struct driz_error_t* error) {
+  float inv_exposure_time;
+  float* data_begin, *data_end;
+
+  assert(p);
+  assert(error);
+
+  if (p->in_units == unit_cps) {
+    return 0;
+  }
+
+  if (p->exposure_time == 0.0) {
+    driz_error_set_message(error, "Invalid exposure time");
+    return 1;
+  }
+  assert(p->exposure_time != 0.0);
+  inv_exposure_time = 1.0f / p->exposure_time;
+  /* TODO: Removing this printf causes the results to be
+     less accurate.  Frustrating Heisenbug */
+  /*printf("%f\n", inv_exposure_time); */
+  data_begin = p->data;
+  data_end = data_begin + (p->dny * p->dnx);
+  for (; data_begin != data_end; ++data_begin) {
+    *data_begin *= inv_exposure_time;
+  }
+  p->in_units = unit_cps;
+
+  return 0;
+}
+
+/**
+Find the range of output lines, within the output window, which may
+get any flux when drizzling the input image.  This is done by
+transforming points along all four edges of the input image, with the
+range then padded by the given margin.
+
+When none of the input lands within the output window, y1 gets
+returned larger than y2.
+*/
+#define EDGE_NPOINT 32
+
+int
+get_output_yrange(struct driz_param_t* p, const integer_t ystart,
+                  const integer_t margin,
+                  /* Output parameters */
+                  integer_t* y1, integer_t* y2,
+                  struct driz_error_t* error) {
+  const integer_t npoint = 4 * EDGE_NPOINT;
+  double xval[4 * EDGE_NPOINT], yval[4 * EDGE_NPOINT];
+  double xtmp[4 * EDGE_NPOINT], ytmp[4 * EDGE_NPOINT];
+  double xout[4 * EDGE_NPOINT], yout[4 * EDGE_NPOINT];
+  double ymin, ymax, f;
+  integer_t i, nvalid;
+
+  assert(p);
+  assert(y1);
+  assert(y2);
+  assert(error);
+
+  for (i = 0; i < EDGE_NPOINT; ++i) {
+    f = (double)i / (double)(EDGE_NPOINT - 1);
+    /* Bottom and top edges */
+    xval[i] = 1.0 + f * (double)(p->dnx - 1);
+    yval[i] = (double)ystart + 1.0;
+    xval[i + EDGE_NPOINT] = xval[i];
+    yval[i + EDGE_NPOINT] = (double)(ystart + p->ny);
+    /* Left and right edges */
+    xval[i + 2 * EDGE_NPOINT] = 1.0;
+    yval[i + 2 * EDGE_NPOINT] = (double)ystart + 1.0 + f * (double)(p->ny - 1);
+    xval[i + 3 * EDGE_NPOINT] = (double)p->dnx;
+    yval[i + 3 * EDGE_NPOINT] = yval[i + 2 * EDGE_NPOINT];
+  }
+
+  if (map_value(p, FALSE, npoint, xval, yval, xtmp, ytmp, xout, yout, error))
+    return 1;
+
+  ymin = ymax = 0.0;
+  nvalid = 0;
+  for (i = 0; i < npoint; ++i) {
+    if (!isfinite(yout[i])) continue;
+    if (nvalid == 0 || yout[i] < ymin) ymin = yout[i];
+    if (nvalid == 0 || yout[i] > ymax) ymax = yout[i];
+    ++nvalid;
+  }
+
+  if (nvalid < npoint) {
+    /* Can not tell where the input lands, so use the whole window */
+    *y1 = p->wymin;
+    *y2 = p->wymax;
+    return 0;
+  }
+
+  /* Output positions are 1-based, while output lines are 0-based */
+  *y1 = MAX((integer_t)floor(ymin) - 1 - margin, p->wymin);
+  *y2 = MIN((integer_t)ceil(ymax) - 1 + margin, p->wymax);
+
+  return 0;
+}
+
 /**
 This module does the actual mapping of input flux to output images
 using "boxer", a code written by Bill Sparks for FOC geometric
@@ -1066,7 +1181,8 @@ dobox(struct driz_param_t* p, const integer_t ystart,
   const size_t nlut = 512;
   const float del = 0.01;
   integer_t j, x1, x2, last_x1, last_x2;
-  double y, dh, ofrac;
+  integer_t margin;
+  double y, dh, ofrac, ymin, ymax;
   kernel_handler_t kernel_handler = NULL;
   integer_t oldcon, newcon;
   integer_t np;
@@ -1076,8 +1192,6 @@ dobox(struct driz_param_t* p, const integer_t ystart,
   double* ytmp = NULL;
   double* xo = NULL;
   double* yo = NULL;
-  float inv_exposure_time;
-  float* data_begin, *data_end;
   int kernel_order;
   size_t new_buffer_size;
   size_t bit_no;
@@ -1224,24 +1338,13 @@ dobox(struct driz_param_t* p, const integer_t ystart,
 
   /* If the input image is not in CPS we need to divide by the
      exposure */
-  if (p->in_units != unit_cps) {
-    if (p->exposure_time == 0.0) {
-      driz_error_set_message(error, "Invalid exposure time");
-      goto dobox_exit_;
-    }
-    assert(p->exposure_time != 0.0);
-    inv_exposure_time = 1.0f / p->exposure_time;
-    /* TODO: Removing this printf causes the results to be
-       less accurate.  Frustrating Heisenbug */
-    /*printf("%f\n", inv_exposure_time); */
-    data_begin = p->data;
-    data_end = data_begin + (p->ny * p->dnx);
-    for (; data_begin != data_end; ++data_begin) {
-      *data_begin *= inv_exposure_time;
-    }
+  if (convert_input_to_cps(p, error)) {
+    goto dobox_exit_;
   }
 
-  DRIZLOG("-Drizzling using kernel = %s\n",kernel_enum2str(p->kernel));
+  /* How far from the transformed line the kernel may still drop flux,
+     allowing for the line to bend between the points checked */
+  margin = DRIZ_KERNEL_MARGIN(p);
 
   /* This is the outer loop over all the lines in the input image */
   last_x1 = p->dnx;
@@ -1250,10 +1353,21 @@ dobox(struct driz_param_t* p, const integer_t ystart,
   for (j = 0; j < p->ny; ++j) {
     y += 1.0;
     /* Check the overlap with the output */
-    if (check_over(p, (integer_t)y, 5, &ofrac, &x1, &x2, error)) {
+    if (check_over(p, (integer_t)y, 5, &ofrac, &x1, &x2, &ymin, &ymax, error)) {
       goto dobox_exit_;
     }
 
+    /* Lines which fall completely outside of the output window, when
+       only working on part of the output frame, can be skipped too,
+       without counting them as missed */
+    if (ofrac != 0.0 &&
+        (ymax < (double)(p->wymin + 1 - margin) ||
+         ymin > (double)(p->wymax + 1 + margin))) {
+      last_x1 = p->dnx;
+      last_x2 = 0;
+      continue;
+    }
+
     /* If the line falls completely off the output, then skip it */
     if (ofrac != 0.0) {
       assert(x1 > 0 && x1 <= p->dnx);
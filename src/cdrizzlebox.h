@@ -22,4 +22,27 @@ int
 dobox(struct driz_param_t* p, const integer_t ystart, integer_t* nmiss,
       integer_t* nskip, struct driz_error_t* error);
 
+/**
+Divide the input data by the exposure time, unless already in CPS.
+*/
+int
+convert_input_to_cps(struct driz_param_t* p, struct driz_error_t* error);
+
+/**
+Find the range of lines (y1, y2) of the output window which may get
+any flux from the input image, padded by margin.
+*/
+int
+get_output_yrange(struct driz_param_t* p, const integer_t ystart,
+                  const integer_t margin, integer_t* y1, integer_t* y2,
+                  struct driz_error_t* error);
+
+/**
+Number of output pixels beyond the transformed position of an input
+pixel that any of the kernels may still drop flux onto, with some
+allowance for the distortion between the points being checked.
+*/
+#define DRIZ_KERNEL_MARGIN(p) \
+  ((integer_t)ceil(3.0 * MAX((p)->pixel_fraction, 0.4) / (p)->scale) + 10)
+
 #endif /* CDRIZZLEBOX_H */
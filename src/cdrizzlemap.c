@@ -404,6 +404,17 @@ default_wcsmap_interpolate(struct wcsmap_param_t* m,
     y = *yiptr++ / m->factor;
     xi = (int)floor(x);
     yi = (int)floor(y);
+    /* Extrapolate from the edge of the table for positions beyond it */
+    if (xi < 0) {
+      xi = 0;
+    } else if (xi > m->snx - 2) {
+      xi = m->snx - 2;
+    }
+    if (yi < 0) {
+      yi = 0;
+    } else if (yi > m->sny - 2) {
+      yi = m->sny - 2;
+    }
     xf = x - (double)xi;
     yf = y - (double)yi;
     ixf = 1.0 - xf;
@@ -597,6 +608,44 @@ default_wcsmap_init(struct wcsmap_param_t* m,
   return 0;
 }
 
+int
+default_wcsmap_init_table(struct wcsmap_param_t* m,
+                          int nx, int ny, double factor,
+                          const double* table,
+                          /* Output parameters */
+                          struct driz_error_t* error) {
+  int snx, sny;
+  size_t table_size;
+
+  assert(m);
+  assert(table);
+  assert(m->table == NULL);
+
+  if (factor <= 0) {
+    driz_error_set_message(error, "A mapping table requires a step size > 0");
+    return 1;
+  }
+
+  snx = (int)((double)nx / factor) + 2;
+  sny = (int)((double)ny / factor) + 2;
+  table_size = (size_t)snx * (size_t)sny * 2;
+
+  m->table = malloc(table_size * sizeof(double));
+  if (m->table == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    return 1;
+  }
+  memcpy(m->table, table, table_size * sizeof(double));
+
+  m->nx = nx;
+  m->ny = ny;
+  m->snx = snx;
+  m->sny = sny;
+  m->factor = factor;
+
+  return 0;
+}
+
 void
 wcsmap_param_dump(struct wcsmap_param_t* m) {
   assert(m);
@@ -51,6 +51,19 @@ default_wcsmap_init(struct wcsmap_param_t* m,
                     /* Output parameters */
                     struct driz_error_t* error);
 
+/**
+Set up the (interpolated) WCS mapping from an already computed table
+of output positions, of shape [sny][snx][2], as found in the table
+member after calling default_wcsmap_init with the same nx, ny and
+factor.
+*/
+int
+default_wcsmap_init_table(struct wcsmap_param_t* m,
+                          int nx, int ny, double factor,
+                          const double* table,
+                          /* Output parameters */
+                          struct driz_error_t* error);
+
 /**
 
 Declarations for supporting the DefaultMapping (pixel-based)
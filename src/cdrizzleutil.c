@@ -170,6 +170,10 @@ driz_param_init(struct driz_param_t* p) {
   p->output_counts = NULL;
   p->output_context = NULL;
   p->output_done = NULL;
+  p->wxmin = 0;
+  p->wxmax = -1;
+  p->wymin = 0;
+  p->wymax = -1;
 
   p->lanczos.lut = NULL;
   p->lanczos.space = 1.0;
@@ -375,15 +379,11 @@ create_lanczos_lut(const int kernel_order, const size_t npix,
 void
 put_fill(struct driz_param_t* p, const float fill_value) {
   integer_t i, j;
-  integer_t onx, ony;
 
   assert(p);
 
-  onx = p->xmax - p->xmin + 1;
-  ony = p->ymax - p->ymin + 1;
-
-  for (j = 0; j < ony; ++j) {
-    for (i = 0; i < onx; ++i) {
+  for (j = p->wymin; j <= p->wymax; ++j) {
+    for (i = p->wxmin; i <= p->wxmax; ++i) {
       if (*output_counts_ptr(p, i, j) == 0.0) {
         *output_data_ptr(p, i, j) = fill_value;
       }
@@ -208,6 +208,15 @@ struct driz_param_t {
   integer_t nsx;
   integer_t nsy;
 
+  /* Region of the output frame actually held in the output arrays,
+     as 0-based inclusive pixel indices.  This is normally the whole
+     output frame, but may be a smaller tile of it, in which case only
+     the pixels falling within this window get updated. */
+  integer_t wxmin;
+  integer_t wxmax;
+  integer_t wymin;
+  integer_t wymax;
+
   integer_t intab[MAXEN*MAXIM]; /* [maxen][maxim] */
   integer_t nen; /* TODO: Rename me */
 
@@ -270,27 +279,30 @@ static inline_macro float*
 output_data_ptr(struct driz_param_t* p, integer_t x, integer_t y) {
   assert(p);
   assert(p->output_data);
-  assert(x >= 0 && x < p->onx);
-  assert(y >= 0 && y < p->ony);
-  return (p->output_data + (y * p->onx) + x);
+  assert(x >= p->wxmin && x <= p->wxmax);
+  assert(y >= p->wymin && y <= p->wymax);
+  return (p->output_data + ((y - p->wymin) * (p->wxmax - p->wxmin + 1)) +
+          (x - p->wxmin));
 }
 
 static inline_macro float*
 output_counts_ptr(struct driz_param_t* p, integer_t x, integer_t y) {
   assert(p);
   assert(p->output_counts);
-  assert(x >= 0 && x < p->onx);
-  assert(y >= 0 && y < p->ony);
-  return (p->output_counts + (y * p->onx) + x);
+  assert(x >= p->wxmin && x <= p->wxmax);
+  assert(y >= p->wymin && y <= p->wymax);
+  return (p->output_counts + ((y - p->wymin) * (p->wxmax - p->wxmin + 1)) +
+          (x - p->wxmin));
 }
 
 static inline_macro integer_t*
 output_context_ptr(struct driz_param_t* p, integer_t x, integer_t y) {
   assert(p);
   assert(p->output_context);
-  assert(x >= 0 && x < p->onx);
-  assert(y >= 0 && y < p->ony);
-  return (p->output_context + (y * p->onx) + x);
+  assert(x >= p->wxmin && x <= p->wxmax);
+  assert(y >= p->wymin && y <= p->wymax);
+  return (p->output_context + ((y - p->wymin) * (p->wxmax - p->wxmin + 1)) +
+          (x - p->wxmin));
 }
 
 static inline_macro integer_t*
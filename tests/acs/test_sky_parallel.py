@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import pytest
+from astropy.io import fits
+from ci_watson.hst_helpers import raw_from_asn
+
+from drizzlepac import processInput, sky
+
+from ..resources import BaseACS
+
+
+class TestSkyParallel(BaseACS):
+
+    @pytest.mark.parametrize('skymethod', ['localmin', 'globalmin'])
+    @pytest.mark.parametrize('unknown_units', [False, True])
+    def test_sky_parallel(self, skymethod, unknown_units):
+        """ The sky of all chips computed at once gives the same values as
+        skymatch, also when the units of an input cannot be told.
+        """
+        asn_file = self.get_data('input', 'j8dw01010_asn.fits')
+        flt_files = []
+        for raw_file in raw_from_asn(asn_file, suffix='_flt.fits'):
+            flt_files.append(self.get_input_file('input', raw_file))
+
+        if unknown_units:
+            # counts are then assumed, as for a different exposure time
+            with fits.open(flt_files[0], mode='update') as hdul:
+                hdul[0].header['EXPTIME'] *= 2.0
+                for hdu in hdul[1:]:
+                    if hdu.header.get('EXTNAME') == 'SCI':
+                        hdu.header['BUNIT'] = 'UNKNOWN'
+
+        paramDict = {'skymethod': skymethod, 'skystat': 'median',
+                     'skylower': None, 'skyupper': None, 'skyclip': 5,
+                     'skylsigma': 4.0, 'skyusigma': 4.0, 'skywidth': 0.1,
+                     'skymask_cat': '', 'use_static': False,
+                     'sky_bits': '0', 'skysub': True, 'sky_parallel': True}
+
+        skies = []
+        for prefix in ['match_', 'par_']:
+            files = []
+            for fname in flt_files:
+                files.append(prefix + os.path.basename(fname))
+                shutil.copy(fname, files[-1])
+            images = processInput.createImageObjectList(files, instrpars={},
+                                                        group=None)
+            if prefix == 'match_':
+                sky._skymatch(images, paramDict, False, True, sky.log)
+            else:
+                sky._skyParallel(images, paramDict, 1)
+            skies.append([chip.subtractedSky for img in images
+                          for chip in img.returnAllChips(extname='SCI')])
+
+        assert len(skies[0]) == 2 * len(flt_files)
+        assert skies[1] == pytest.approx(skies[0], rel=1e-6)
@@ -1,12 +1,16 @@
 import os
+import types
 import pytest
 
 import numpy as np
+from astropy.io import fits
 from stwcs import distortion
 from ..resources import BaseUnit
 
 import drizzlepac.adrizzle as adrizzle
 import drizzlepac.ablot as ablot
+import drizzlepac.outputimage as outputimage
+import drizzlepac.wcs_functions as wcs_functions
 
 
 class TestDriz(BaseUnit):
@@ -373,6 +377,301 @@ class TestDriz(BaseUnit):
         self.ignore_keywords += ['rootname']
         self.compare_outputs([(output, output_template)])
 
+    def test_square_with_tiles(self):
+        """
+        Test do_driz square kernel drizzling into tiles of the output frame
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+        outsci = np.zeros((naxis2, naxis1), dtype='float32')
+        outwht = np.zeros((naxis2, naxis1), dtype='float32')
+        outcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                         output_wcs, outsci, outwht, outcon,
+                         expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale)
+
+        tilesci = np.zeros((naxis2, naxis1), dtype='float32')
+        tilewht = np.zeros((naxis2, naxis1), dtype='float32')
+        tilecon = np.zeros((1, naxis2, naxis1), dtype='i4')
+        for tile in adrizzle._build_output_tiles((naxis2, naxis1), 6):
+            xmin, xmax, ymin, ymax = tile
+            tslice = (slice(ymin, ymax + 1), slice(xmin, xmax + 1))
+            _sci = tilesci[tslice].copy()
+            _wht = tilewht[tslice].copy()
+            _con = tilecon[(slice(None),) + tslice].copy()
+            adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                             output_wcs, _sci, _wht, _con,
+                             expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale,
+                             out_origin=(xmin, ymin))
+            tilesci[tslice] = _sci
+            tilewht[tslice] = _wht
+            tilecon[(slice(None),) + tslice] = _con
+
+        assert np.array_equal(outsci, tilesci)
+        assert np.array_equal(outwht, tilewht)
+        assert np.array_equal(outcon, tilecon)
+
+    def test_square_with_threads(self):
+        """
+        Test do_driz square kernel drizzling split across threads
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        results = []
+        for nthreads in [1, 4]:
+            outsci = np.zeros((naxis2, naxis1), dtype='float32')
+            outwht = np.zeros((naxis2, naxis1), dtype='float32')
+            outcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+            adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                             output_wcs, outsci, outwht, outcon,
+                             expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale,
+                             nthreads=nthreads)
+            results.append((outsci, outwht, outcon))
+
+        for serial, threaded in zip(*results):
+            assert np.array_equal(serial, threaded)
+
+    def test_square_with_pixmap_cache(self):
+        """
+        Test do_driz square kernel using a cached pixel mapping
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        results = []
+        # Compute the mapping, then reuse it from memory, then from disk
+        for restart in [True, False, True]:
+            if restart:
+                wcs_functions.start_pixmap_cache(os.getcwd())
+            outsci = np.zeros((naxis2, naxis1), dtype='float32')
+            outwht = np.zeros((naxis2, naxis1), dtype='float32')
+            outcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+            adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                             output_wcs, outsci, outwht, outcon,
+                             expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale)
+            results.append((outsci, outwht, outcon))
+        wcs_functions.end_pixmap_cache()
+
+        for first, cached in zip(results[0], results[1]):
+            assert np.array_equal(first, cached)
+        for first, cached in zip(results[0], results[2]):
+            assert np.array_equal(first, cached)
+
+    def test_square_with_pixmap(self):
+        """
+        Test do_driz square kernel using a precomputed pixel map
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        outsci = np.zeros(insci.shape, dtype='float32')
+        outwht = np.zeros(insci.shape, dtype='float32')
+        outcon = np.zeros((1,) + insci.shape, dtype='i4')
+
+        identity = wcs_functions.IdentityMap(input_wcs, input_wcs)
+        pixmap = wcs_functions.calc_pixmap(identity.forward, insci.shape)
+        adrizzle.do_driz(insci, input_wcs, inwht,
+                         input_wcs, outsci, outwht, outcon,
+                         1.0, 'cps', 1.0, wcslin_pscale=input_wcs.pscale,
+                         pixmap=pixmap)
+
+        assert np.allclose(outsci, insci, atol=1e-5)
+        assert np.all(outwht == 1.0)
+
+    def test_square_with_sparse_context(self):
+        """
+        Test do_driz square kernel updating a sparse context image
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        results = []
+        for sparse in [False, True]:
+            outsci = np.zeros((naxis2, naxis1), dtype='float32')
+            outwht = np.zeros((naxis2, naxis1), dtype='float32')
+            if sparse:
+                outcon = outputimage.SparseContext((2, naxis2, naxis1))
+            else:
+                outcon = np.zeros((2, naxis2, naxis1), dtype='i4')
+            for uniqid in [1, 40]:
+                adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                                 output_wcs, outsci, outwht, outcon,
+                                 expin, in_units, wt_scl,
+                                 wcslin_pscale=wcslin.pscale, uniqid=uniqid)
+            results.append((outsci, outwht, outcon))
+
+        dense, sparse = results
+        assert np.array_equal(dense[0], sparse[0])
+        assert np.array_equal(dense[1], sparse[1])
+        assert np.array_equal(dense[2], sparse[2].toarray())
+        assert np.array_equal(dense[2],
+                              outputimage.expand_context(sparse[2].to_hdu()))
+
+    def test_square_onto_output_tile(self):
+        """
+        Test do_driz square kernel only drizzling the input rows reaching
+        a tile of the output frame
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        outsci = np.zeros((naxis2, naxis1), dtype='float32')
+        outwht = np.zeros((naxis2, naxis1), dtype='float32')
+        outcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+        adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                         output_wcs, outsci, outwht, outcon,
+                         expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale)
+
+        x0, y0 = naxis1 // 4, naxis2 // 3
+        tslice = (slice(y0, y0 + naxis2 // 4), slice(x0, x0 + naxis1 // 2))
+        tilesci = np.zeros_like(outsci[tslice])
+        tilewht = np.zeros_like(outwht[tslice])
+        tilecon = np.zeros_like(outcon[(slice(None),) + tslice])
+        adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                         output_wcs, tilesci, tilewht, tilecon,
+                         expin, in_units, wt_scl, wcslin_pscale=wcslin.pscale,
+                         out_origin=(x0, y0))
+
+        ystart, nrows = adrizzle._get_input_rows(input_wcs, output_wcs,
+                                                 (x0, x0 + naxis1 // 2 - 1,
+                                                  y0, y0 + naxis2 // 4 - 1), 3)
+        assert 0 < nrows < insci.shape[0]
+        assert np.array_equal(tilesci, outsci[tslice])
+        assert np.array_equal(tilewht, outwht[tslice])
+        assert np.array_equal(tilecon, outcon[(slice(None),) + tslice])
+
+    def test_square_onto_existing_product(self):
+        """
+        Test do_driz square kernel adding an input onto an existing product
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output = 'output_square_update_drz.fits'
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_square_image.fits'))
+
+        insci = self.read_image(input)
+        input_wcs = self.read_wcs(input)
+        inwht = np.ones(insci.shape,dtype=insci.dtype)
+
+        output_wcs = self.read_wcs(output_template)
+        naxis1, naxis2 = output_wcs.pixel_shape
+
+        expin = 1.0
+        wt_scl = expin
+        in_units = 'cps'
+        wcslin = distortion.utils.output_wcs([input_wcs],undistort=False)
+
+        def drizzle(outsci, outwht, outcon, uniqid):
+            adrizzle.do_driz(insci.copy(), input_wcs, inwht,
+                             output_wcs, outsci, outwht, outcon,
+                             expin, in_units, wt_scl,
+                             wcslin_pscale=wcslin.pscale, uniqid=uniqid)
+
+        outsci = np.zeros((naxis2, naxis1), dtype='float32')
+        outwht = np.zeros((naxis2, naxis1), dtype='float32')
+        outcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+        for uniqid in [1, 2]:
+            drizzle(outsci, outwht, outcon, uniqid)
+
+        # Write out a product of the first input only, in counts
+        prevsci = np.zeros((naxis2, naxis1), dtype='float32')
+        prevwht = np.zeros((naxis2, naxis1), dtype='float32')
+        prevcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+        drizzle(prevsci, prevwht, prevcon, 1)
+        prihdr = fits.Header([('NDRIZIM', 1), ('EXPTIME', 2.0),
+                              ('D001OUUN', 'counts')])
+        fits.HDUList([fits.PrimaryHDU(header=prihdr),
+                      fits.ImageHDU(prevsci * 2.0, name='SCI'),
+                      fits.ImageHDU(prevwht, name='WHT'),
+                      fits.ImageHDU(prevcon[0], name='CTX')]).writeto(output)
+
+        img = types.SimpleNamespace(native_units='ELECTRONS',
+                                    outputNames={'outFinal': output,
+                                                 'outContext': output})
+        previous = adrizzle._read_final_product([img], output_wcs,
+                                                {'proc_unit': 'native'}, True)
+        assert previous[0]['NDRIZIM'] == 1
+
+        updsci = np.zeros((naxis2, naxis1), dtype='float32')
+        updwht = np.zeros((naxis2, naxis1), dtype='float32')
+        updcon = np.zeros((1, naxis2, naxis1), dtype='i4')
+        adrizzle._seed_final_arrays(previous, updsci, updwht, updcon)
+        drizzle(updsci, updwht, updcon, 2)
+
+        assert np.allclose(updsci, outsci, atol=1e-5)
+        assert np.array_equal(updwht, outwht)
+        assert np.array_equal(updcon, outcon)
+
 class TestBlot(BaseUnit):
     buff = 1
 
@@ -436,6 +735,26 @@ class TestBlot(BaseUnit):
         assert(med_diff < 1.0e-6)
         assert(max_diff < 1.0e-5)
 
+    def test_blot_with_threads(self):
+        """
+        Test do_blot with default grid image split across threads
+        """
+        input = os.path.basename(self.get_input_file('input', 'j8bt06nyq_unit.fits'))
+        output_template = os.path.basename(self.get_data('truth',
+                                           'reference_blot_default.fits'))
+
+        insci = self.read_image(input)
+        insci = self.make_grid_image(insci, 64, 100.0)
+        input_wcs = self.read_wcs(input)
+        output_wcs = self.read_wcs(output_template)
+
+        expin = 1.0
+        outsci = ablot.do_blot(insci, input_wcs, output_wcs, expin, coeffs = False)
+        threadsci = ablot.do_blot(insci, input_wcs, output_wcs, expin, coeffs = False,
+                                  nthreads=4)
+
+        assert np.array_equal(outsci, threadsci)
+
     def test_blot_with_lan3(self):
         """
         Test do_blot with lan3 grid image
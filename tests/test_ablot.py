@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from stwcs.wcsutil import HSTWCS
+
+from drizzlepac import ablot
+
+
+def _make_wcs(crval, nx, ny, scale, rot):
+    hdr = fits.Header()
+    hdr['NAXIS'] = 2
+    hdr['NAXIS1'] = nx
+    hdr['NAXIS2'] = ny
+    hdr['CTYPE1'] = 'RA---TAN'
+    hdr['CTYPE2'] = 'DEC--TAN'
+    hdr['CRVAL1'], hdr['CRVAL2'] = crval
+    hdr['CRPIX1'] = nx / 2.0
+    hdr['CRPIX2'] = ny / 2.0
+    c, s = np.cos(np.deg2rad(rot)), np.sin(np.deg2rad(rot))
+    hdr['CD1_1'] = -scale / 3600.0 * c
+    hdr['CD1_2'] = scale / 3600.0 * s
+    hdr['CD2_1'] = scale / 3600.0 * s
+    hdr['CD2_2'] = scale / 3600.0 * c
+    wcs = HSTWCS(fits.HDUList([fits.PrimaryHDU(header=hdr)]))
+    wcs.pixel_shape = (nx, ny)
+    return wcs
+
+
+# chips inside the source image, crossing each of its corners, and outside
+@pytest.mark.parametrize('crval', [(150.0002, 2.0001), (150.0026, 1.9976),
+                                   (150.0026, 2.0024), (149.9974, 2.0024),
+                                   (149.9974, 1.9976), (151.0, 3.0)])
+@pytest.mark.parametrize('rot', [5.0, 17.0])
+@pytest.mark.parametrize('interp', ['nearest', 'linear', 'poly5', 'sinc',
+                                    'lsinc'])
+def test_blot_region(monkeypatch, crval, rot, interp):
+    """ Blotting from the region of the source image covering the blotted
+    image gives the same result as blotting from all of it.
+    """
+    rng = np.random.default_rng(1)
+    source_wcs = _make_wcs((150.0, 2.0), 500, 460, 0.04, 0.0)
+    source = rng.normal(size=source_wcs.array_shape).astype(np.float32)
+
+    results = []
+    for margin in [max(source.shape), ablot._blot_margin_]:
+        monkeypatch.setattr(ablot, '_blot_margin_', margin)
+        blot_wcs = _make_wcs(crval, 120, 100, 0.05, rot)
+        results.append(ablot.do_blot(source, source_wcs, blot_wcs, 1.0,
+                                     coeffs=False, interp=interp))
+
+    whole, region = results
+    assert np.array_equal(whole == 0, region == 0)
+    # interpolated positions only differ by the rounding of their offsets:
+    assert np.allclose(whole, region, rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('interp', ['nearest', 'linear', 'poly3', 'poly5',
+                                    'sinc', 'lsinc'])
+def test_blot_ramp(interp):
+    """ Blotting a linear ramp onto the same WCS gives back the ramp. """
+    wcs = _make_wcs((150.0, 2.0), 200, 180, 0.04, 0.0)
+    y, x = np.indices(wcs.array_shape)
+    source = (1000.0 + 2.0 * x + 3.0 * y).astype(np.float32)
+
+    blotted = ablot.do_blot(source, wcs, wcs, 1.0, coeffs=False,
+                            interp=interp)
+    assert np.allclose(blotted[20:-20, 20:-20], source[20:-20, 20:-20],
+                       rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('interp', ['nearest', 'linear', 'poly3', 'poly5',
+                                    'sinc', 'lsinc', 'lan3', 'lan5'])
+def test_blot_nthreads(interp):
+    """ Blotting split across threads gives the same result as serially. """
+    rng = np.random.default_rng(3)
+    source_wcs = _make_wcs((150.0, 2.0), 500, 460, 0.04, 0.0)
+    source = rng.normal(size=source_wcs.array_shape).astype(np.float32)
+    # crossing the top right corner of the source image
+    blot_wcs = _make_wcs((149.9974, 2.0024), 120, 100, 0.05, 5.0)
+
+    serial = ablot.do_blot(source, source_wcs, blot_wcs, 1.0, coeffs=False,
+                           interp=interp, nthreads=1)
+    assert np.any(serial != 0)
+    for nthreads in [2, 3, 7, 7]:
+        threaded = ablot.do_blot(source, source_wcs, blot_wcs, 1.0,
+                                 coeffs=False, interp=interp,
+                                 nthreads=nthreads)
+        assert np.array_equal(threaded, serial)
+
+
+@pytest.mark.parametrize('interp', ['linear', 'poly3', 'poly5'])
+def test_blot_ramp_edges(interp):
+    """ The data reflected past the edges of the source image continue a
+    linear ramp, so that it gets interpolated exactly up to the edges.
+    """
+    source_wcs = _make_wcs((150.0, 2.0), 200, 180, 0.04, 0.0)
+    y, x = np.indices(source_wcs.array_shape)
+    source = (1000.0 + 2.0 * x + 3.0 * y).astype(np.float32)
+    blot_wcs = _make_wcs((150.0, 2.0), 200, 180, 0.04, 0.0)
+    blot_wcs.wcs.crpix = blot_wcs.wcs.crpix - [0.3, 0.4]
+
+    blotted = ablot.do_blot(source, source_wcs, blot_wcs, 1.0, coeffs=False,
+                            interp=interp)
+    expected = source + 2.0 * 0.3 + 3.0 * 0.4
+    assert np.allclose(blotted[1:, 1:], expected[1:, 1:], rtol=0, atol=1e-3)
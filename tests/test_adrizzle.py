@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import multiprocessing
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from stwcs.wcsutil import HSTWCS
+
+from drizzlepac import adrizzle, util
+
+
+def _make_wcs(crval, nx, ny, scale, rot):
+    hdr = fits.Header()
+    hdr['NAXIS'] = 2
+    hdr['NAXIS1'] = nx
+    hdr['NAXIS2'] = ny
+    hdr['CTYPE1'] = 'RA---TAN'
+    hdr['CTYPE2'] = 'DEC--TAN'
+    hdr['CRVAL1'], hdr['CRVAL2'] = crval
+    hdr['CRPIX1'] = nx / 2.0
+    hdr['CRPIX2'] = ny / 2.0
+    c, s = np.cos(np.deg2rad(rot)), np.sin(np.deg2rad(rot))
+    hdr['CD1_1'] = -scale / 3600.0 * c
+    hdr['CD1_2'] = scale / 3600.0 * s
+    hdr['CD2_1'] = scale / 3600.0 * s
+    hdr['CD2_2'] = scale / 3600.0 * c
+    wcs = HSTWCS(fits.HDUList([fits.PrimaryHDU(header=hdr)]))
+    wcs.pixel_shape = (nx, ny)
+    return wcs
+
+
+class _Chip:
+    def __init__(self, chip, wcs, rng):
+        self._chip = chip
+        self.wcs = wcs
+        self.wcslin_pscale = wcs.pscale
+        self.in_units = 'counts'
+        self._exptime = 100.0 * chip
+        self._wtscl = 1.0
+        self.data = rng.normal(100.0, 10.0, wcs.array_shape).astype(np.float32)
+        self.weight = (rng.random(wcs.array_shape) > 0.1).astype(np.float32)
+
+
+class _Image:
+    scienceExt = 'SCI'
+
+    def __init__(self, chips):
+        self.chips = chips
+
+    def returnAllChips(self, extname=None):
+        return self.chips
+
+    def set_wtscl(self, chip, wtscl):
+        self.chips[chip - 1]._wtscl = float(wtscl)
+
+
+@pytest.fixture
+def inputs(monkeypatch):
+    """ Two images of two chips each, crossing the edges of the output
+    frame or off it, with the chip data and weights read from the stub
+    chips instead of from files.
+    """
+    monkeypatch.setattr(adrizzle, '_get_chip_input_name', lambda chip: None)
+    monkeypatch.setattr(adrizzle, '_get_chip_science',
+                        lambda chip, name: chip.data.copy())
+    monkeypatch.setattr(adrizzle, '_build_chip_mask',
+                        lambda img, chip, paramDict, single, name: None)
+    monkeypatch.setattr(adrizzle, '_build_chip_weight',
+                        lambda img, chip, dqarr, paramDict, pix_ratio:
+                        chip.weight.copy())
+
+    rng = np.random.default_rng(5)
+    images = []
+    for crval, rot in [((150.0, 2.0), 10.0), ((150.0025, 2.002), 40.0)]:
+        chips = [_Chip(1, _make_wcs(crval, 90, 70, 0.05, rot), rng),
+                 _Chip(2, _make_wcs((crval[0], crval[1] - 0.001), 90, 70,
+                                    0.05, rot), rng)]
+        images.append(_Image(chips))
+    return images
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """ Enable the parallel code even on a single core machine. """
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, 'multiprocessing', multiprocessing)
+    monkeypatch.setattr(adrizzle, 'multiprocessing', multiprocessing,
+                        raising=False)
+
+
+def _param_dict(fillval):
+    return {'kernel': 'square', 'pixfrac': 0.8, 'fillval': fillval,
+            'stepsize': 10, 'wt_scl': '0.5', 'num_cores': 4,
+            'sparse_ctx': False, 'memmap': False}
+
+
+def _drizzle_serial(images, outwcs, paramDict, create_array=None):
+    if create_array is None:
+        create_array = np.zeros
+    outsci = create_array(outwcs.array_shape, np.float32)
+    outwht = create_array(outwcs.array_shape, np.float32)
+    outctx = create_array((1,) + outwcs.array_shape, np.int32)
+    uniqid = 0
+    for img in images:
+        for chip in img.returnAllChips():
+            uniqid += 1
+            adrizzle.do_driz(chip.data.copy(), chip.wcs, chip.weight.copy(),
+                             outwcs, outsci, outwht, outctx,
+                             chip._exptime, 'counts', 0.5,
+                             wcslin_pscale=chip.wcslin_pscale, uniqid=uniqid,
+                             pixfrac=paramDict['pixfrac'],
+                             kernel=paramDict['kernel'],
+                             fillval=paramDict['fillval'],
+                             stepsize=paramDict['stepsize'])
+    return outsci, outwht, outctx
+
+
+@pytest.mark.parametrize('fillval', ['INDEF', 0.5])
+@pytest.mark.parametrize('pool_size', [2, 4, 7])
+def test_driz_tiles(inputs, parallel, pool_size, fillval):
+    """ Drizzling tiles of the output frame in parallel gives the same
+    result as drizzling all of it at once.
+    """
+    outwcs = _make_wcs((150.001, 2.001), 160, 150, 0.06, 0.0)
+    paramDict = _param_dict(fillval)
+    serial = _drizzle_serial(inputs, outwcs, paramDict)
+
+    shape = outwcs.array_shape
+    _sharedsci, _outsci = adrizzle._create_shared_array(shape, np.float32)
+    _sharedwht, _outwht = adrizzle._create_shared_array(shape, np.float32)
+    _sharedctx, _outctx = adrizzle._create_shared_array((1,) + shape, np.int32)
+    adrizzle.run_driz_tiles(inputs, outwcs, outwcs, paramDict, 1, pool_size,
+                            _sharedsci, _sharedwht, _sharedctx, None)
+
+    assert np.any(serial[1] > 0) and np.any(serial[1] == 0)
+    assert np.array_equal(_outsci, serial[0])
+    assert np.array_equal(_outwht, serial[1])
+    assert np.array_equal(_outctx, serial[2])
+
+
+def test_driz_memmap(inputs, tmp_path):
+    """ Drizzling into memory-mapped scratch arrays gives the same result
+    as drizzling into arrays in memory.
+    """
+    outwcs = _make_wcs((150.001, 2.001), 160, 150, 0.06, 0.0)
+    paramDict = _param_dict('INDEF')
+    serial = _drizzle_serial(inputs, outwcs, paramDict)
+    mapped = _drizzle_serial(
+        inputs, outwcs, paramDict,
+        lambda shape, dtype: adrizzle._create_scratch_array(shape, dtype,
+                                                            str(tmp_path))
+    )
+
+    for expected, result in zip(serial, mapped):
+        assert isinstance(result, np.memmap)
+        assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize('max_tile_bytes', [None, 20000])
+@pytest.mark.parametrize('pool_size', [2, 3])
+def test_driz_tiles_memmap(inputs, parallel, monkeypatch, tmp_path,
+                           pool_size, max_tile_bytes):
+    """ Drizzling tiles of the output frame in parallel into memory-mapped
+    scratch arrays, including when splitting the frame into more tiles to
+    limit their size, gives the same result as drizzling all of it at once.
+    """
+    if max_tile_bytes is not None:
+        monkeypatch.setattr(adrizzle, '_max_tile_bytes', max_tile_bytes)
+    outwcs = _make_wcs((150.001, 2.001), 160, 150, 0.06, 0.0)
+    paramDict = _param_dict(0.5)
+    paramDict['memmap'] = True
+    serial = _drizzle_serial(inputs, outwcs, paramDict)
+
+    shape = outwcs.array_shape
+    _outsci = adrizzle._create_scratch_array(shape, np.float32, str(tmp_path))
+    _outwht = adrizzle._create_scratch_array(shape, np.float32, str(tmp_path))
+    _outctx = adrizzle._create_scratch_array((1,) + shape, np.int32,
+                                             str(tmp_path))
+    adrizzle.run_driz_tiles(inputs, outwcs, outwcs, paramDict, 1, pool_size,
+                            _outsci, _outwht, _outctx, None)
+
+    assert np.array_equal(_outsci, serial[0])
+    assert np.array_equal(_outwht, serial[1])
+    assert np.array_equal(_outctx, serial[2])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from stsci.image.numcombine import num_combine
+
+from drizzlepac import approxmed
+
+
+@pytest.mark.parametrize('nimages, nlow, nhigh', [(5, 0, 0), (6, 0, 0),
+                                                  (7, 0, 1), (10, 1, 2)])
+def test_approx_median_error_bound(nimages, nlow, nhigh):
+    """ The approximate median is within the documented error bound of the
+    exact one.
+    """
+    rng = np.random.default_rng(1)
+    shape = (nimages, 50, 40)
+    data = rng.normal(10.0, 2.0, shape).astype(np.float32)
+    data[rng.random(shape) < 0.03] += 1000.0
+    masks = (rng.random(shape) < 0.2).astype(np.uint8)
+
+    exact = num_combine(data, masks=masks, combination_type='median',
+                        nlow=nlow, nhigh=nhigh)
+    approx = approxmed.approx_median(
+        lambda: zip(data, masks), shape[1:], nlow=nlow, nhigh=nhigh
+    )
+
+    good = masks == 0
+    spread = (np.where(good, data, -np.inf).max(axis=0) -
+              np.where(good, data, np.inf).min(axis=0))
+    bound = spread / (2 * approxmed.NBINS**approxmed.NPASSES)
+    checked = good.sum(axis=0) > 0
+    assert np.all(np.abs(approx - exact)[checked] <=
+                  bound[checked] * (1 + 1e-4) + 1e-6)
+    assert np.all(approx[good.sum(axis=0) == 0] == 0)
+
+
+@pytest.mark.parametrize('nlow, nhigh', [(1, 1), (2, 1), (1, 3), (3, 3)])
+def test_all_rejected(nlow, nhigh):
+    """ Where nlow and nhigh reject all the good values of a pixel, the
+    result is the same as for numcombine's 'median'.
+    """
+    data = np.zeros((8, 1, 3), dtype=np.float32)
+    masks = np.ones(data.shape, dtype=np.uint8)
+    for pixel, values in enumerate([[60.9, 124.3], [5.0, 1.0, 3.0],
+                                    [7.0, 2.0, 9.0, 4.0]]):
+        data[:len(values), 0, pixel] = values
+        masks[:len(values), 0, pixel] = 0
+
+    exact = num_combine(data, masks=masks, combination_type='median',
+                        nlow=nlow, nhigh=nhigh)
+    approx = approxmed.approx_median(
+        lambda: zip(data, masks), data.shape[1:], nlow=nlow, nhigh=nhigh
+    )
+    good = masks == 0
+    spread = (np.where(good, data, -np.inf).max(axis=0) -
+              np.where(good, data, np.inf).min(axis=0))
+    bound = spread / (2 * approxmed.NBINS**approxmed.NPASSES)
+    assert np.all(np.abs(approx - exact) <= bound * (1 + 1e-4) + 1e-6)
+    if (nlow, nhigh) == (1, 1):
+        assert abs(approx[0, 0] - 92.6) <= bound[0, 0] + 1e-4
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from drizzlepac import adrizzle, createMedian, util
+
+
+@pytest.mark.parametrize('comb_type', ['minmed', 'iminmed', 'median'])
+@pytest.mark.parametrize('grow', [0, 1, 2])
+def test_combine_coverage(comb_type, grow):
+    """ Skipping the parts of a mosaic covered by too few inputs gives the
+    same result as combining all of it.
+    """
+    rng = np.random.default_rng(1)
+    nimages = 5
+    shape = (nimages, 80, 70)
+    images = rng.normal(10.0, 2.0, shape).astype(np.float32)
+    images[rng.random(shape) < 0.03] += 400.0
+
+    # each input only covers part of the output frame:
+    weights = np.zeros(shape, dtype=np.float32)
+    for wht in weights:
+        y0, x0 = rng.integers(0, 50, 2)
+        wht[y0:y0 + 30, x0:x0 + 30] = rng.uniform(0.5, 1.5)
+    images[weights == 0] = 0.0
+    masks = (weights < 0.3).astype(np.uint8)
+
+    combine_pars = {
+        'comb_type': comb_type, 'grow': grow, 'nsigma1': 4.0, 'nsigma2': 3.0,
+        'nlow': 0, 'nhigh': 1, 'lthresh': None, 'hthresh': None,
+        'readnoise': [4.0] * nimages, 'exptime': [100.0] * nimages,
+        'background': [1.0] * nimages
+    }
+
+    whole = createMedian._combine_stack(images, weights, masks, combine_pars)
+    skipped = createMedian._combine_coverage(images, weights, masks,
+                                             combine_pars)
+    assert np.array_equal(whole, skipped)
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """ Enable the parallel code even on a single core machine. """
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, 'multiprocessing', multiprocessing)
+    monkeypatch.setattr(adrizzle, 'multiprocessing', multiprocessing,
+                        raising=False)
+
+
+def _single_drizzled(nimages, shape):
+    """ Single drizzled science and weight images, as big-endian arrays
+    read from FITS files.
+    """
+    rng = np.random.default_rng(2)
+    scis, whts = [], []
+    for k in range(nimages):
+        sci = rng.normal(10.0, 2.0, shape).astype('>f4')
+        sci[rng.random(shape) < 0.03] += 400.0
+        wht = np.zeros(shape, dtype='>f4')
+        y0, x0 = rng.integers(0, shape[0] // 2, 2)
+        wht[y0:, x0:] = rng.uniform(0.5, 1.5)
+        sci[wht == 0] = 0.0
+        scis.append(sci)
+        whts.append(wht)
+    return scis, whts
+
+
+def _combine_pars(comb_type, nimages, shape, grow):
+    return {
+        'comb_type': comb_type, 'newmasks': True, 'grow': grow,
+        'nsigma1': 4.0, 'nsigma2': 3.0, 'nlow': 0, 'nhigh': 1,
+        'lthresh': None, 'hthresh': None, 'wht_mean': [0.3] * nimages,
+        'readnoise': [4.0] * nimages, 'exptime': [100.0] * nimages,
+        'background': [1.0] * nimages, 'shape': shape,
+        'dtype': np.dtype('>f4')
+    }
+
+
+@pytest.mark.parametrize('comb_type', ['minmed', 'median', 'amedian'])
+@pytest.mark.parametrize('section_nrows, grow', [(7, 1), (20, 2), (90, 0)])
+@pytest.mark.parametrize('num_cores', [2, 3, 8])
+def test_combine_sections_parallel(parallel, comb_type, section_nrows, grow,
+                                   num_cores):
+    """ Combining bands of sections in parallel gives the same median image
+    as combining all of the sections serially.
+    """
+    nimages, shape = 5, (61, 47)
+    scis, whts = _single_drizzled(nimages, shape)
+    combine_pars = _combine_pars(comb_type, nimages, shape, grow)
+    sections = createMedian._build_sections(shape[0], section_nrows, grow)
+
+    serial = createMedian._combine_sections(sections, scis, whts,
+                                            combine_pars, num_cores=1)
+    median = createMedian._combine_sections(sections, scis, whts,
+                                            combine_pars, num_cores=num_cores)
+    assert np.any(serial != 0)
+    assert np.array_equal(median, serial)
+
+
+class _Chip:
+    def __init__(self, outsingle):
+        self.outputNames = {'outSingle': outsingle}
+
+
+class _Image:
+    scienceExt = 'SCI'
+
+    def __init__(self, stackname, outsingles):
+        self.outputNames = {'outSStack': stackname}
+        self.chips = [_Chip(name) for name in outsingles]
+
+    def returnAllChips(self, extname=None):
+        return self.chips
+
+
+class _WCS:
+    def __init__(self, shape):
+        self.array_shape = shape
+
+
+@pytest.mark.parametrize('comb_type', ['minmed', 'median', 'amedian'])
+def test_single_stack(tmp_path, comb_type):
+    """ Combining the memory-mapped stack of single drizzled images gives
+    the same median image as combining the images themselves.
+    """
+    nimages, shape = 4, (61, 47)
+    scis, whts = _single_drizzled(nimages, shape)
+    stackname = str(tmp_path / 'test_single_stack.npy')
+    # both chips of the first image share the same single drizzle product:
+    images = [_Image(stackname, ['a_single_sci.fits', 'a_single_sci.fits']),
+              _Image(stackname, ['b_single_sci.fits']),
+              _Image(stackname, ['c_single_sci.fits', 'd_single_sci.fits'])]
+    outsingles = ['d_single_sci.fits', 'b_single_sci.fits',
+                  'a_single_sci.fits', 'c_single_sci.fits']
+
+    stack_index = adrizzle._create_single_stack(images, _WCS(shape))
+    for outsingle in outsingles:
+        k = ['a', 'b', 'c', 'd'].index(outsingle[0])
+        adrizzle._write_single_stack(stack_index, outsingle, scis[k], whts[k])
+
+    stack = createMedian._open_single_stack(stackname,
+                                            (2, nimages) + shape)
+    assert isinstance(stack, np.memmap)
+    assert createMedian._open_single_stack(stackname, (2, 3) + shape) is None
+    assert createMedian._open_single_stack(
+        str(tmp_path / 'missing.npy'), (2, nimages) + shape) is None
+
+    combine_pars = _combine_pars(comb_type, nimages, shape, 1)
+    sections = createMedian._build_sections(shape[0], 20, 1)
+    expected = createMedian._combine_sections(sections, scis, whts,
+                                              combine_pars)
+    median = createMedian._combine_sections(sections, stack[0], stack[1],
+                                            combine_pars)
+    assert np.array_equal(median, expected)
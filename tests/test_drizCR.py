@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from scipy import signal
+from stwcs.wcsutil import HSTWCS
+
+from drizzlepac import ablot, drizCR, outputimage
+
+
+@pytest.mark.parametrize('shape', [(40, 50), (3, 4)])
+@pytest.mark.parametrize('axis', [0, 1])
+@pytest.mark.parametrize('lo, hi', [(-1, 1), (-1, 0), (-2, 1), (1, 3),
+                                    (-5, -1), (0, 0)])
+def test_all_within(shape, axis, lo, hi):
+    """ Checking all the mask values within a window matches convolving the
+    mask with a line of 1's, using the 'symm' boundary.
+    """
+    rng = np.random.default_rng(1)
+    mask = rng.random(shape) > 0.1
+
+    # 'same' convolution output i sums input i + half - j over kernel j:
+    half = max(abs(lo), abs(hi))
+    kernel = np.zeros(2 * half + 1)
+    kernel[half - hi:half - lo + 1] = 1
+    kernel = kernel[:, None] if axis == 0 else kernel[None, :]
+    conv = signal.convolve2d(mask, kernel, boundary='symm', mode='same')
+
+    assert np.array_equal(drizCR._all_within(mask, lo, hi, axis),
+                          conv >= hi - lo + 1)
+
+
+@pytest.mark.parametrize('nrows', [1, 2, 5, 17, 60])
+@pytest.mark.parametrize('grow, ctegrow, cte_dir', [(1, 0, 1), (3, 2, 1),
+                                                     (4, 3, -1), (0, 5, -1)])
+@pytest.mark.parametrize('precomputed_deriv', [False, True])
+def test_cr_mask_sections(nrows, grow, ctegrow, cte_dir, precomputed_deriv):
+    """ The CR mask computed over sections of rows, with the extra rows
+    around each of them, is the same as for the whole chip.
+    """
+    rng = np.random.default_rng(3)
+    shape = (60, 45)
+    blot_data = rng.normal(100.0, 10.0, shape).astype(np.float32)
+    blot_data[rng.random(shape) < 0.05] += 500.0
+    input_image = blot_data + rng.normal(0.0, 10.0, shape).astype(np.float32)
+    input_image[rng.random(shape) < 0.05] += 1000.0
+
+    pars = (50.0, 1.0, 5.0, (3.5, 3.0), (2.0, 1.5), grow, ctegrow, cte_dir)
+    blot_deriv = None
+    if precomputed_deriv:
+        blot_deriv = drizCR.quickDeriv.qderiv(blot_data)
+
+    expected = drizCR._cr_mask(input_image, blot_data, *pars,
+                               blot_deriv=blot_deriv)
+    assert not expected.all() and expected.any()
+
+    cr_mask = drizCR._cr_mask_sections(input_image, blot_data, *pars, nrows,
+                                       blot_deriv=blot_deriv)
+    assert np.array_equal(cr_mask, expected)
+
+
+def test_is_current(tmp_path):
+    """ A cached file is only reused when newer than its sources and, if
+    requested, blotted with the same parameters.
+    """
+    blot_pars = {'blot_interp': 'poly5', 'blot_sinscl': 1.0,
+                 'blot_addsky': True, 'blot_skyval': 0.0}
+    source = str(tmp_path / 'median.fits')
+    cached = str(tmp_path / 'blt.fits')
+    fits.PrimaryHDU().writeto(source)
+    hdr = fits.Header()
+    outputimage.addBlotKeywords(hdr, blot_pars)
+    fits.PrimaryHDU(header=hdr).writeto(cached)
+    os.utime(source, (1000, 1000))
+
+    assert not drizCR._is_current(str(tmp_path / 'missing.fits'), source)
+    assert drizCR._is_current(cached, source)
+    assert drizCR._is_current(cached, source, blot_pars=blot_pars)
+    for par, value in [('blot_interp', 'sinc'), ('blot_sinscl', 2.0),
+                       ('blot_addsky', False), ('blot_skyval', 5.0)]:
+        assert not drizCR._is_current(cached, source,
+                                      blot_pars=dict(blot_pars, **{par: value}))
+    assert not drizCR._is_current(source, blot_pars=blot_pars)
+
+    os.utime(source, None)
+    os.utime(cached, (1000, 1000))
+    assert not drizCR._is_current(cached, source, blot_pars=blot_pars)
+
+
+def _make_wcs(crval, nx, ny, scale, rot):
+    hdr = fits.Header()
+    hdr['NAXIS'] = 2
+    hdr['NAXIS1'] = nx
+    hdr['NAXIS2'] = ny
+    hdr['CTYPE1'] = 'RA---TAN'
+    hdr['CTYPE2'] = 'DEC--TAN'
+    hdr['CRVAL1'], hdr['CRVAL2'] = crval
+    hdr['CRPIX1'] = nx / 2.0
+    hdr['CRPIX2'] = ny / 2.0
+    c, s = np.cos(np.deg2rad(rot)), np.sin(np.deg2rad(rot))
+    hdr['CD1_1'] = -scale / 3600.0 * c
+    hdr['CD1_2'] = scale / 3600.0 * s
+    hdr['CD2_1'] = scale / 3600.0 * s
+    hdr['CD2_2'] = scale / 3600.0 * c
+    wcs = HSTWCS(fits.HDUList([fits.PrimaryHDU(header=hdr)]))
+    wcs.pixel_shape = (nx, ny)
+    return wcs
+
+
+class _Chip:
+    def __init__(self, chip, wcs):
+        self.wcs = wcs
+        self.group_member = True
+        self.dq_extn = 'DQ,{:d}'.format(chip)
+        self.cte_dir = 1
+        self._exptime = 100.0
+        self._conversionFactor = 2.0
+        self._effGain = 2.0
+        self._rdnoise = 5.0
+        self.computedSky = 10.0
+        self.subtractedSky = 10.0
+        self.outputNames = {
+            'data': 'test_sci{:d}.fits'.format(chip),
+            'blotImage': 'test_sci{:d}_blt.fits'.format(chip),
+            'blotDeriv': 'test_sci{:d}_blt_deriv.fits'.format(chip),
+            'crmaskImage': 'test_sci{:d}_crmask.fits'.format(chip)
+        }
+
+
+class _Image:
+    """ In-memory image of two chips, with the data of each chip being its
+    blotted median image plus noise and cosmic-rays.
+    """
+    scienceExt = 'SCI'
+    inmemory = True
+    _filename = 'test.fits'
+
+    def __init__(self, chips, data):
+        self._numchips = len(chips)
+        self.chips = chips
+        self.data = data
+        self.virtualOutputs = {}
+        self.outputNames = {'outMedian': 'test_med.fits',
+                            'crcorImage': 'test_crclean.fits'}
+
+    def __getitem__(self, exten):
+        return self.chips[int(exten.split(',')[1]) - 1]
+
+    def getData(self, exten):
+        return self.data[int(exten.split(',')[1]) - 1].copy()
+
+    def buildMask(self, chip, bits=0):
+        return np.ones(self.data[chip - 1].shape, dtype=bool)
+
+    def saveVirtualOutputs(self, outdict):
+        self.virtualOutputs.update(outdict)
+
+
+@pytest.mark.parametrize('interp', ['linear', 'poly5', 'sinc'])
+@pytest.mark.parametrize('nthreads', [1, 3])
+def test_driz_cr_fused(interp, nthreads):
+    """ Blotting each chip within the driz_cr step gives the same CR masks
+    as reading in the chips blotted by the blot step.
+    """
+    rng = np.random.default_rng(4)
+    median_wcs = _make_wcs((150.0, 2.0), 300, 260, 0.05, 0.0)
+    median = rng.normal(50.0, 5.0, median_wcs.array_shape).astype(np.float32)
+    chips = [_Chip(1, _make_wcs((150.0005, 2.0003), 120, 100, 0.05, 7.0)),
+             _Chip(2, _make_wcs((149.9995, 1.9996), 120, 100, 0.05, 7.0))]
+    blot_pars = {'blot_interp': interp, 'blot_sinscl': 1.0,
+                 'blot_addsky': True, 'blot_skyval': 0.0, 'coeffs': False}
+
+    blotted, data = [], []
+    for chip in chips:
+        blot = ablot.blot_chip(chip, median, median_wcs, blot_pars)
+        sci = blot + rng.normal(0.0, 3.0, blot.shape).astype(np.float32)
+        sci[rng.random(blot.shape) < 0.02] += 300.0
+        blotted.append(blot)
+        data.append(sci)
+
+    paramDict = {'driz_cr_grow': 1, 'driz_cr_ctegrow': 0,
+                 'driz_cr_snr': '3.5 3.0', 'driz_cr_scale': '1.2 0.7',
+                 'driz_cr_corr': False, 'driz_cr_cache': False,
+                 'crbit': 4096, 'inmemory': True, 'blot_pars': blot_pars}
+
+    image = _Image(chips, data)
+    for chip, blot in zip(chips, blotted):
+        image.saveVirtualOutputs({chip.outputNames['blotImage']:
+                                  fits.HDUList([fits.PrimaryHDU(blot)])})
+    drizCR._driz_cr(image, image.virtualOutputs, paramDict)
+
+    fused = _Image(chips, data)
+    blotDict = {'pars': blot_pars, 'clean': True, 'median': median,
+                'output_wcs': median_wcs, 'wcsmap': ablot.wcs_functions.WCSMap,
+                'versions': ablot._blot_versions(), 'nthreads': nthreads}
+    drizCR._driz_cr(fused, fused.virtualOutputs, paramDict, blotDict)
+
+    for chip in chips:
+        name = chip.outputNames['crmaskImage']
+        expected = image.virtualOutputs[name][0].data
+        assert not expected.all() and expected.any()
+        assert np.array_equal(fused.virtualOutputs[name][0].data, expected)
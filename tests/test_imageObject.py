@@ -32,3 +32,51 @@ class TestimageObject():
         assert(image._naxis1 > 0)
         assert(image._naxis2 > 0)
         assert(image._instrument != '')
+
+
+def test_header_updates(tmp_path, monkeypatch):
+    """ Header changes get written out all at once, and the file only gets
+    opened for them when there are any.
+    """
+    from astropy.io import fits
+    from stsci.tools import fileutil
+
+    filename = str(tmp_path / 'test_flt.fits')
+    hdr = fits.Header([('MDRIZSKY', 1.5), ('TARGNAME', 'M31')])
+    fits.HDUList([fits.PrimaryHDU(header=hdr),
+                  fits.ImageHDU(name='SCI')]).writeto(filename)
+
+    opens = []
+    open_image = fileutil.openImage
+    def counting_open(*args, **kwargs):
+        opens.append(kwargs.get('mode'))
+        return open_image(*args, **kwargs)
+    monkeypatch.setattr(fileutil, 'openImage', counting_open)
+
+    img = imageObject.baseImageObject(filename)
+    img.flushHeaderUpdates()
+    assert opens == []
+
+    img.queueHeaderUpdate('PRIMARY', 'MDRIZSKY')
+    img.queueHeaderUpdate(('SCI', 1), 'MDRIZSKY', 2.5)
+    img.flushHeaderUpdates()
+    img.flushHeaderUpdates()
+    assert opens == ['update']
+
+    with fits.open(filename) as hdul:
+        assert 'MDRIZSKY' not in hdul[0].header
+        assert hdul[0].header['TARGNAME'] == 'M31'
+        assert hdul['SCI', 1].header['MDRIZSKY'] == 2.5
+
+
+def test_put_data():
+    import numpy as np
+    from astropy.io import fits
+
+    img = imageObject.baseImageObject('test_flt.fits')
+    img._image = fits.HDUList([fits.PrimaryHDU(),
+                               fits.ImageHDU(np.zeros((5, 6)), name='SCI')])
+    data = np.ones((5, 6), dtype=np.float32)
+    img.putData(data, 1)
+    assert img._image[1].data is data
+    assert img._image[1].header['BITPIX'] == -32
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from drizzlepac import minmed
+
+
+@pytest.mark.parametrize('nimages', [2, 3, 5])
+@pytest.mark.parametrize('masks', [False, True])
+@pytest.mark.parametrize('grow', [0, 1, 2])
+def test_min_med_blocks(nimages, masks, grow):
+    """ Combining the stack in blocks of rows gives the same result as
+    combining all of it at once.
+    """
+    rng = np.random.default_rng(1)
+    shape = (nimages, 60, 40)
+    images = rng.normal(10.0, 2.0, shape).astype(np.float32)
+    images[rng.random(shape) < 0.02] += 500.0
+    weights = rng.uniform(0.5, 1.5, shape).astype(np.float32)
+    if masks:
+        weight_masks = rng.random(shape) < 0.1
+        weight_masks[:, :3, :3] = True
+    else:
+        weight_masks = None
+
+    args = (images, weights, [4.0] * nimages, [100.0] * nimages,
+            [1.0] * nimages)
+    kwargs = {'weight_masks': weight_masks, 'combine_grow': grow}
+
+    whole = minmed.min_med(*args, block_rows=shape[1], **kwargs)
+    for block_rows in [1, 7]:
+        blocked = minmed.min_med(*args, block_rows=block_rows, **kwargs)
+        assert np.array_equal(whole, blocked)
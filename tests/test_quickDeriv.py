@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from drizzlepac import quickDeriv
+
+
+def _reference_qderiv(array):
+    """ Absolute derivative computed one neighbor at a time, with the pixels
+    outside of the region where each neighbor gets used compared to 0.
+    """
+    array = array.astype(np.float64)
+    n1, n2 = array.shape
+    out = np.zeros(array.shape)
+    regions = [
+        # (rows, columns) of the pixels, and offset of their neighbor
+        ((0, n1 - 1), (1, n2 - 1), (0, -1)),
+        ((0, n1 - 1), (0, n2 - 2), (0, 1)),
+        ((1, n1 - 1), (0, n2 - 1), (-1, 0)),
+        ((0, n1 - 2), (0, n2 - 1), (1, 0)),
+    ]
+    for (y1, y2), (x1, x2), (dy, dx) in regions:
+        shifted = np.zeros(array.shape)
+        if y2 > y1 and x2 > x1:
+            shifted[y1:y2, x1:x2] = array[y1 + dy:y2 + dy, x1 + dx:x2 + dx]
+        out = np.maximum(out, np.abs(array - shifted))
+    return out.astype(np.float32)
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (2, 3), (4, 7), (60, 45)])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, '>f4'])
+@pytest.mark.parametrize('block_size', [1, 100, quickDeriv.BLOCK_SIZE])
+def test_qderiv(monkeypatch, shape, dtype, block_size):
+    """ The derivative computed in blocks of rows matches the reference. """
+    monkeypatch.setattr(quickDeriv, 'BLOCK_SIZE', block_size)
+    rng = np.random.default_rng(1)
+    array = rng.normal(0.0, 100.0, shape).astype(dtype)
+
+    deriv = quickDeriv.qderiv(array)
+    assert deriv.dtype == np.float32
+    assert np.array_equal(deriv, _reference_qderiv(array))
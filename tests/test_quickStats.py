@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+from stsci.imagestats import ImageStats
+
+from drizzlepac import quickStats
+
+
+def _sky_image(shape, sky, sigma):
+    rng = np.random.default_rng(1)
+    image = rng.normal(sky, sigma, shape).astype(np.float32)
+    hits = rng.random(shape) < 0.02
+    image[hits] += rng.exponential(50 * sigma, hits.sum()).astype(np.float32)
+    return image
+
+
+@pytest.mark.parametrize('method', quickStats.methods)
+def test_small_image(method):
+    """ Images no larger than the subsample get the full statistics. """
+    image = _sky_image((100, 120), 30.0, 3.0)
+    stats = ImageStats(image, fields='npix,mean,stddev,mode', nclip=3)
+    quick = quickStats.QuickStats(image, method=method, nclip=3)
+    assert quick.npix == stats.npix
+    assert quick.mode == stats.mode
+    assert quick.stddev == stats.stddev
+
+
+@pytest.mark.parametrize('method', quickStats.methods)
+def test_estimate(method):
+    """ The estimated mode is within a few times its estimated error of the
+    sky level, and the standard deviation is close to that of the sky noise.
+    """
+    image = _sky_image((1000, 1000), 120.0, 12.0)
+    quick = quickStats.QuickStats(image, method=method, nclip=5, lsig=4.0,
+                                  usig=4.0, npix_max=200000)
+    assert quick.npix <= (200000 if method == 'subsample' else image.size)
+    assert abs(quick.mode - 120.0) < 3 * quick.error
+    assert abs(quick.stddev - 12.0) < 0.5
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        quickStats.QuickStats(np.ones(10), method='fast')
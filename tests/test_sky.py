@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import pytest
+
+from drizzlepac import sky
+
+
+# (sky, data to brightness factor) of the chips of 3 images:
+_image_skies = [[(10.0, 0.5), (12.0, 0.25)],
+                [(4.0, 2.0), (None, 1.0)],
+                [(None, 1.0)]]
+
+
+@pytest.mark.parametrize('skymethod, expected', [
+    ('localmin', [[6.0, 12.0], [4.0, 8.0], [0.0]]),
+    ('globalmin', [[6.0, 12.0], [1.5, 3.0], [3.0]]),
+])
+def test_reduce_sky(skymethod, expected):
+    """ The minimum sky brightness of each image, or of all of them, gets
+    converted back to the units of the data of each chip.
+    """
+    assert sky._reduceSky(_image_skies, skymethod) == expected
+
+
+@pytest.mark.parametrize('bunit, expected', [
+    ('ELECTRONS/S', 100.0),
+    ('ELECTRONS', 1.0),
+    ('UNKNOWN', 1.0),
+])
+def test_data2brightness(tmp_path, bunit, expected):
+    """ As for skymatch, data are divided by the exposure time unless they
+    are known to be count rates.
+    """
+    from types import SimpleNamespace
+    from astropy.io import fits
+
+    filename = str(tmp_path / 'test_flt.fits')
+    sci = fits.ImageHDU(name='SCI')
+    sci.header['BUNIT'] = bunit
+    fits.HDUList([fits.PrimaryHDU(), sci]).writeto(filename)
+    fits.setval(filename, 'EXPTIME', value=100.0, ext=0)
+
+    chip = SimpleNamespace(wcs=SimpleNamespace(idcscale=0.1))
+    with fits.open(filename) as fobj:
+        conv = sky._data2brightness(chip, fobj, ('SCI', 1))
+    assert conv == pytest.approx(expected)
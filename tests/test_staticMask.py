@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import numpy as np
+from stsci.imagestats import ImageStats
+
+from drizzlepac import staticMask
+
+
+class _Image:
+    scienceExt = 'SCI'
+    _filename = 'test_flt.fits'
+
+    def __init__(self, data):
+        self.data = data
+
+    def getData(self, exten):
+        assert exten == 'SCI,1'
+        return self.data
+
+
+def test_chip_mask():
+    """ The packed chip mask flags the pixels more than static_sig sigma
+    below the mode, as the unpacked Int16 mask used to.
+    """
+    rng = np.random.default_rng(2)
+    data = rng.normal(30.0, 3.0, (37, 51)).astype(np.float32)
+
+    results = {}
+    staticMask._computeChipMask(_Image(data), 1, 'mode', 1.5, results)
+    mode, rms, error, chipmask = results[('test_flt.fits', 1)]
+
+    imstats = ImageStats(data, nclip=3, fields='mode')
+    expected = np.ones(data.shape, dtype=np.int16)
+    np.bitwise_and(expected,
+                   np.logical_not(np.less(data, imstats.mode -
+                                          1.5 * imstats.stddev)),
+                   expected)
+
+    assert mode == imstats.mode
+    assert rms == imstats.stddev
+    assert error is None
+    assert chipmask.dtype == np.uint8
+    assert chipmask.size == (data.size + 7) // 8
+    mask = staticMask._unpackMask(chipmask, data.shape)
+    assert mask.dtype == np.int16
+    assert np.array_equal(mask, expected)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import multiprocessing.connection
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from drizzlepac import util
+
+shared_memory = pytest.importorskip('multiprocessing.shared_memory')
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """ Enable the parallel code even on a single core machine. """
+    from multiprocessing import resource_tracker
+    monkeypatch.setattr(util, 'multiprocessing', multiprocessing)
+    monkeypatch.setattr(util, 'shared_memory', shared_memory)
+    monkeypatch.setattr(util, 'resource_tracker', resource_tracker,
+                        raising=False)
+
+
+def _save_products(outputs, index, nsaves):
+    # saves the same product several times, as driz_cr does for each chip
+    for i in range(nsaves):
+        data = np.full((20, 30), 10 * index + i, dtype=np.float32)
+        outputs['out%d' % index] = fits.HDUList([fits.PrimaryHDU(data)])
+
+
+def _shm_blocks():
+    return {f for f in os.listdir('/dev/shm') if f.startswith('psm_')}
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'),
+                    reason='shared memory blocks not visible as files')
+def test_shared_outputs(parallel):
+    """ Products saved by workers get back to the main process, and only
+    the blocks of the last version of each product are left behind until
+    they get collected.
+    """
+    before = _shm_blocks()
+    pool = util.WorkerPool(2)
+    outputs = util.SharedOutputs()
+    outputs.share(pool.manager)
+    try:
+        pool.run(_save_products, [(outputs, index, 3) for index in range(3)],
+                 name='test_util._save_products()')
+        assert len(_shm_blocks() - before) == 3
+        outputs.collect()
+    finally:
+        pool.close()
+
+    assert _shm_blocks() == before
+    assert sorted(outputs) == ['out0', 'out1', 'out2']
+    for index in range(3):
+        data = outputs['out%d' % index][0].data
+        assert data.shape == (20, 30)
+        assert np.all(data == 10 * index + 2)
+    outputs.clear()
+    outputs.close()
+
+
+def _fail():
+    raise ValueError('task failed')
+
+
+def test_worker_pool_failure(parallel):
+    pool = util.WorkerPool(2)
+    with pytest.raises(RuntimeError, match='test_util._fail'):
+        pool.run(_fail, [()], name='test_util._fail()')